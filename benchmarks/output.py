@@ -0,0 +1,86 @@
+"""Measures the throughput of the C++ code generation (in generated bytes per second) for
+a synthetic class diagram with many classes."""
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")))
+
+ATTRIBUTE_TYPES = [ "bool", "int", "string" ]
+
+def class_diagram(classes_count, attributes_count):
+    """Returns JSON text of a class diagram with the classes in a single namespace."""
+    classes = []
+    for class_no in range(classes_count):
+        attributes = []
+        for attribute_no in range(attributes_count):
+            attributes.append({
+                "type": "codemodel.classdiagram.Attribute",
+                "attrs": {
+                    "type": [ ATTRIBUTE_TYPES[attribute_no % len(ATTRIBUTE_TYPES)] ],
+                    "name": "field{}".format(attribute_no),
+                    "is_repeated": attribute_no % 2 == 1
+                }
+            })
+        #endfor
+        classes.append({
+            "type": "codemodel.classdiagram.Class",
+            "attrs": { "name": "Type{}".format(class_no) },
+            "nodes": attributes
+        })
+    #endfor
+
+    return json.dumps({
+        "type": "codemodel.classdiagram.Package",
+        "nodes": [ {
+            "type": "codemodel.classdiagram.Package",
+            "attrs": { "name": "bench" },
+            "nodes": classes
+        } ]
+    })
+#enddef
+
+if __name__ == "__main__":
+    import argparse
+
+    args_parser = argparse.ArgumentParser(description="Measures the C++ code generation throughput.")
+    args_parser.add_argument("-c", "--classes", dest="classes", type=int, default=10000, help="number of classes (default 10000)")
+    args_parser.add_argument("-a", "--attributes", dest="attributes", type=int, default=6, help="number of attributes of every class (default 6)")
+    args_parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3, help="number of measured runs (default 3)")
+
+    args = args_parser.parse_args()
+
+    import codemodel
+    from codegen.cpp import Generator
+    from codegen.driver import create_args_parser
+
+    # Types of the classes aren't in any index, don't report them.
+    logging.basicConfig(level=logging.ERROR)
+
+    raw_data = class_diagram(args.classes, args.attributes)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_base = os.path.join(output_dir, "bench")
+        generator_args = create_args_parser().parse_args([ "-o", output_base, "--deterministic-header" ])
+
+        durations = []
+        for _ in range(args.repeat):
+            # Parsing of the input isn't measured.
+            class_diag = codemodel.from_json(raw_data)
+            start_time = time.perf_counter()
+            Generator().run(class_diag, generator_args)
+            durations.append(time.perf_counter() - start_time)
+        #endfor
+
+        output_size = sum(os.path.getsize(output_base + ext) for ext in [ ".hpp", ".cpp" ])
+    #endwith
+
+    duration = min(durations)
+    print("{} classes, {} attributes each: {} bytes in {:.3f} s (best of {}), {:.0f} bytes/s".format(
+            args.classes, args.attributes, output_size, duration, args.repeat, output_size / duration))
+
+#endif __main__
@@ -0,0 +1,109 @@
+"""Measures the C++ code generation for a class diagram with deeply nested namespaces, where
+the attributes refer to classes of the enclosing namespaces by unqualified names, so resolution
+of their types has to search the enclosing scopes."""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")))
+
+def class_diagram(depth, classes_count, attributes_count):
+    """Returns JSON text of a class diagram with the namespaces nested to the depth. Every
+    namespace has the classes, their attributes refer to the classes of the enclosing
+    namespaces."""
+    package = None
+    for level in reversed(range(depth)):
+        nodes = []
+        for class_no in range(classes_count):
+            attributes = []
+            for attribute_no in range(attributes_count):
+                # The outermost namespaces are the farthest to find, the outermost classes can
+                # refer only to a fundamental type.
+                attribute_type = "L{}Type{}".format(attribute_no % level, class_no) if level else "int"
+                attributes.append({
+                    "type": "codemodel.classdiagram.Attribute",
+                    "attrs": {
+                        "type": [ attribute_type ],
+                        "name": "field{}".format(attribute_no),
+                        "is_repeated": False
+                    }
+                })
+            #endfor
+            nodes.append({
+                "type": "codemodel.classdiagram.Class",
+                "attrs": { "name": "L{}Type{}".format(level, class_no) },
+                "nodes": attributes
+            })
+        #endfor
+        # The classes are registered as they are visited, so the nested namespace goes last.
+        if package is not None:
+            nodes.append(package)
+
+        package = {
+            "type": "codemodel.classdiagram.Package",
+            "attrs": { "name": "ns{}".format(level) },
+            "nodes": nodes
+        }
+    #endfor
+
+    return json.dumps({ "type": "codemodel.classdiagram.Package", "nodes": [ package ] })
+#enddef
+
+def index_entries(depth, classes_count):
+    """Returns index entries of the classes of the class diagram, types of the attributes are
+    resolved by them."""
+    entries = {}
+    for level in range(depth):
+        namespace = ".".join("ns{}".format(l) for l in range(level + 1))
+        for class_no in range(classes_count):
+            entries["{}.L{}Type{}".format(namespace, level, class_no)] = { "cpp": { "include": "\"bench.hpp\"" } }
+    #endfor
+    return entries
+#enddef
+
+if __name__ == "__main__":
+    import argparse
+
+    args_parser = argparse.ArgumentParser(description="Measures the C++ code generation with deeply nested namespaces.")
+    args_parser.add_argument("-d", "--depth", dest="depth", type=int, default=20, help="depth of the namespaces (default 20)")
+    args_parser.add_argument("-c", "--classes", dest="classes", type=int, default=50, help="number of classes in every namespace (default 50)")
+    args_parser.add_argument("-a", "--attributes", dest="attributes", type=int, default=10, help="number of attributes of every class (default 10)")
+    args_parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=3, help="number of measured runs (default 3)")
+
+    args = args_parser.parse_args()
+
+    import codemodel
+    import tempfile
+    from codegen.cpp import Generator, IndexContext
+    from codegen.driver import create_args_parser
+
+    raw_data = class_diagram(args.depth, args.classes, args.attributes)
+    # The output isn't of interest, it's discarded.
+    generator_args = create_args_parser().parse_args([ "-oh", os.devnull, "-os", os.devnull, "--deterministic-header" ])
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        index_filepath = os.path.join(index_dir, "index.json")
+        with open(index_filepath, "w") as index_file:
+            json.dump(index_entries(args.depth, args.classes), index_file)
+
+        with IndexContext(index_filepath, read_only=True) as index_context:
+            durations = []
+            for _ in range(args.repeat):
+                # Parsing of the input isn't measured.
+                class_diag = codemodel.from_json(raw_data)
+                start_time = time.perf_counter()
+                Generator().run(class_diag, generator_args, index_context)
+                durations.append(time.perf_counter() - start_time)
+            #endfor
+        #endwith
+    #endwith
+
+    types_count = args.depth * args.classes * args.attributes
+    duration = min(durations)
+    print("Depth {}, {} classes with {} attributes each: {} attribute types in {:.3f} s (best of {}), {:.0f} types/s".format(
+            args.depth, args.depth * args.classes, args.attributes, types_count, duration, args.repeat,
+            types_count / duration))
+
+#endif __main__
@@ -0,0 +1,56 @@
+"""Measures the import time of the command line tools using 'python -X importtime' and checks
+it against a budget. Exits with a non-zero status if a tool exceeds the budget."""
+
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+COMMANDS = [
+    [ "-m", "codegen", "--help" ],
+    [ "-m", "codegen.index", "--help" ]
+]
+
+def import_time(command):
+    """Returns the total import time (in microseconds) reported for the command."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ SRC_DIR ] + [ p for p in [ env.get("PYTHONPATH", "") ] if p ])
+    result = subprocess.run([ sys.executable, "-X", "importtime" ] + command, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    # Lines look like "import time: <self us> | <cumulative us> | <module>", the header excluded.
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_time = line[len("import time:"):].split("|")[0].strip()
+        if self_time.isdigit():
+            total += int(self_time)
+    #endfor
+    return total
+#enddef
+
+if __name__ == "__main__":
+    import argparse
+
+    args_parser = argparse.ArgumentParser(description="Checks the startup time of the codegen command line tools.")
+    args_parser.add_argument("-b", "--budget", dest="budget", type=float, default=100.0, help="maximum median import time in milliseconds (default 100)")
+    args_parser.add_argument("-r", "--repeat", dest="repeat", type=int, default=7, help="number of measured runs of every command (default 7)")
+
+    args = args_parser.parse_args()
+
+    exceeded = False
+    for command in COMMANDS:
+        times = [ import_time(command) / 1000.0 for _ in range(args.repeat) ]
+        median = statistics.median(times)
+        within = median <= args.budget
+        exceeded = exceeded or not within
+        print("{:<30} median {:7.1f} ms, min {:7.1f} ms, budget {:.1f} ms{}".format(
+                " ".join(command), median, min(times), args.budget, "" if within else " EXCEEDED"))
+    #endfor
+
+    sys.exit(1 if exceeded else 0)
+
+#endif __main__
@@ -1,4 +1,9 @@
 from __future__ import absolute_import
 
-from . import cpp
-from . import index
+def __getattr__(name):
+    # Backends and the index are imported on first use to keep the startup fast.
+    if name in [ "cpp", "index" ]:
+        import importlib
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+#enddef
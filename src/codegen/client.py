@@ -0,0 +1,39 @@
+"""Thin client sending code generation requests to the server (see codegen.server).
+
+Usage: python -m codegen.client SOCKET [codegen arguments...]"""
+
+import json
+import os
+import socket
+import sys
+
+def request(socket_path, argv, cwd=None):
+    """Sends a code generation request to the server, returns the response."""
+    request = { "argv": list(argv), "cwd": cwd if cwd is not None else os.getcwd() }
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        s.shutdown(socket.SHUT_WR)
+
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    #endwith
+
+    return json.loads(b"".join(chunks).decode("utf-8"))
+#enddef
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m codegen.client SOCKET [codegen arguments...]", file=sys.stderr)
+        sys.exit(2)
+
+    response = request(sys.argv[1], sys.argv[2:])
+    sys.stdout.write(response.get("stdout", ""))
+    sys.stderr.write(response.get("stderr", ""))
+    sys.exit(response.get("status", 1))
+#endif __main__
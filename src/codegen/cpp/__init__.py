@@ -1,3 +1,11 @@
 from __future__ import absolute_import
 
 from .generator import *
+
+def __getattr__(name):
+    # The generator visitor depends on codemodel, import it only when really needed.
+    if name == "Generator":
+        from .visitor import Generator
+        return Generator
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+#enddef
@@ -1,19 +1,30 @@
 import codegen.index
-import codemodel
 
-from contextlib import contextmanager
 import copy
 import logging
+import os
 import sys
 
 _version_major = 0
 _version_minor = 1
 
-# This is a workaround for 'nullcontext' missing in the 'contextlib' module. It was introduced
-# only in Python version 3.7.
-@contextmanager
-def nullcontext():
-    yield
+def write_if_changed(filepath, content):
+    """Writes the content into the file unless the file already has the same content, so its
+    modification time changes only if necessary. The file is replaced atomically, readers
+    never see it partially written."""
+    data = content.encode("utf-8")
+
+    try:
+        with open(filepath, "rb") as f:
+            if f.read() == data:
+                logging.debug("File '{}' is up to date.".format(filepath))
+                return False
+    except FileNotFoundError:
+        pass
+
+    codegen.index.atomic_write(filepath, data)
+    logging.debug("File '{}' written.".format(filepath))
+    return True
 #enddef
 
 class Options(object):
@@ -52,30 +63,62 @@ class Options(object):
             return filepath
     #enddef
 
-#enddef
+    def deterministic_header(self):
+        """Whether the header of the generated files has to be the same for the same input."""
+        return bool(getattr(self.args, "deterministic_header", False))
+    #enddef
 
-PHASE_NONE = -1
+    def stamp_filepath(self):
+        """Path of the up-to-date stamp file or empty if stamps aren't used. Stamps require both
+        outputs to be files."""
+        if not getattr(self.args, "stamp", False):
+            return ""
 
-PHASE_HEADER_GEN = 0
-PHASE_SOURCE_GEN = 1
+        header_filepath = self.header_output_filepath()
+        if not header_filepath or not self.source_output_filepath():
+            return ""
 
-PHASE_CLASS             = 10
-PHASE_CLASS_DECL        = PHASE_CLASS + 1
-PHASE_CLASS_IMPL        = PHASE_CLASS + 2
-PHASE_CLASS_PIMPL_DECL  = PHASE_CLASS + 3
-PHASE_CLASS_PIMPL_IMPL  = PHASE_CLASS + 4
+        return (self.args.output if self.args.output else header_filepath) + ".stamp"
+    #enddef
+
+    def fingerprint(self):
+        """Returns a string identifying options which affect the generated code."""
+        import json
+        return json.dumps({
+            "header": self.header_output_filepath(),
+            "source": self.source_output_filepath(),
+            "index": self.args.index,
+            "deterministic_header": self.deterministic_header(),
+            "depfile": self.depfile_filepath(),
+            "include_dirs": self.include_dirs()
+        }, sort_keys=True)
+    #enddef
 
-PHASE_CLASS_MEMBER                    = 20
-PHASE_CLASS_MEMBER_INIT               = PHASE_CLASS_MEMBER + 1
-PHASE_CLASS_MEMBER_GETTER             = PHASE_CLASS_MEMBER + 2
-PHASE_CLASS_MEMBER_CONST_GETTER       = PHASE_CLASS_MEMBER + 3
-PHASE_CLASS_MEMBER_SETTER             = PHASE_CLASS_MEMBER + 4
-PHASE_CLASS_MEMBER_PUBLIC_VARIABLE    = PHASE_CLASS_MEMBER + 5
-PHASE_CLASS_MEMBER_PROTECTED_VARIABLE = PHASE_CLASS_MEMBER + 6
-PHASE_CLASS_MEMBER_PRIVATE_VARIABLE   = PHASE_CLASS_MEMBER + 7
+    def input_filepath(self):
+        """Path of the processed input file or empty if it's not known or it's the stdin."""
+        filepath = getattr(self.args, "input_file", "")
+        return filepath if filepath and filepath.strip() != "-" else ""
+    #enddef
 
-PRINTER_FINISHED = 1
-PRINTER_NOT_FINISHED = 0
+    def depfile_filepath(self):
+        return getattr(self.args, "depfile", "") or ""
+    #enddef
+
+    def resolve_filepath(self, filepath):
+        """Returns the path the file has to be accessed by (see codegen.driver.resolve_filepath()),
+        the file paths returned by the options are as provided."""
+        from codegen.driver import resolve_filepath
+        return resolve_filepath(self.args, filepath)
+    #enddef
+
+    def include_dirs(self):
+        return list(getattr(self.args, "include_dirs", None) or [])
+    #enddef
+
+#enddef
+
+PHASE_HEADER_GEN = 0
+PHASE_SOURCE_GEN = 1
 
 TYPE_TREATMENT_VALUE = "value_type"
 TYPE_TREATMENT_REFERENCE = "reference_type"
@@ -128,6 +171,8 @@ to_cpp_type_map_qt = {
 # TODO This should be done through some option.
 to_cpp_type_map = to_cpp_type_map_qt
 
+# Builtin types, they are never modified. Types known in a code generation run are provided by
+# the TypeRegistry of its context.
 cpp_types = {
     "mad::codegen::CompositeProperty" : {
         "include" : "<mad/codegen/compositeproperty.hpp>"
@@ -163,7 +208,24 @@ cpp_types = {
     }
 }
 
+# Normalized spellings of the fundamental types, i.e. the values of cpp_fundamental_types.
+cpp_fundamental_spellings = frozenset(cpp_fundamental_types.values())
+
+# Results of refine_cpp_type() by the type parts. Non-fundamental types map to None.
+_refined_cpp_types = {}
+
 def refine_cpp_type(cpp_type):
+    """Returns the normalized spelling of a fundamental type (e.g. 'unsigned int' for 'uint'
+    or 'int unsigned') or the provided type parts if the type isn't fundamental. The results
+    are computed only once for every distinct type."""
+    key = tuple(cpp_type)
+    refined_type = _refined_cpp_types.get(key, False)
+    if refined_type is False:
+        refined_type = _refined_cpp_types[key] = _refine_cpp_type(key)
+    return refined_type if refined_type is not None else cpp_type
+#enddef
+
+def _refine_cpp_type(cpp_type):
     is_fundamental = True
     refined_parts = []
     if len(cpp_type) == 1:
@@ -176,7 +238,7 @@ def refine_cpp_type(cpp_type):
                 break
 
             if part == "signed" or part == "unsigned":
-                refined_parts.insert(part, 0)
+                refined_parts.insert(0, part)
             else:
                 refined_parts.append(part)
         #endfor
@@ -190,180 +252,577 @@ def refine_cpp_type(cpp_type):
             raise RuntimeError("Failed to refine C++ type ({})".format(cpp_type[0]))
         return refined_type
     else:
-        return cpp_type
+        return None
 #enddef
 
+class CppType(object):
+    """Interned C++ type, there's a single instance for every distinct type in a code generation
+    run (see TypeRegistry.intern()), so it can be compared and hashed by identity. The spelling
+    is computed only once, the information from the registry once unless the type is updated."""
+
+    __slots__ = ("parts", "spelling", "is_fundamental", "_registry", "_info")
+
+    def __init__(self, registry, parts, is_fundamental=False):
+        self.parts = parts
+        self.spelling = "::".join(parts)
+        self.is_fundamental = is_fundamental
+        self._registry = registry
+        self._info = None
+    #enddef
+
+    @property
+    def info(self):
+        """Information about the type from the registry, empty if the type isn't known."""
+        if self._info is None:
+            self._info = self._registry.get(self.spelling, {})
+        return self._info
+    #enddef
+
+    @property
+    def treatment(self):
+        if self.is_fundamental:
+            return TYPE_TREATMENT_VALUE
+        return self.info.get("treatment", TYPE_TREATMENT_REFERENCE)
+    #enddef
+
+    @property
+    def include(self):
+        return self.info.get("include", "")
+    #enddef
+
+    def __str__(self):
+        return self.spelling
+    #enddef
+
+    def __repr__(self):
+        return "CppType('{}')".format(self.spelling)
+    #enddef
+
+#endclass
+
+class TypeRegistry(object):
+    """C++ types known in a single code generation run. The builtin types and the types from
+    the index are shared read-only layers, the builtin types take precedence. Modifications
+    (e.g. type treatments from the 'using' attribute) are copied on write into the registry's
+    own overlay, so runs in one process don't affect each other and can run concurrently."""
+
+    def __init__(self, index_types=None, type_map=None):
+        self.__index_types = index_types if index_types is not None else {}
+        self.__type_map = type_map if type_map is not None else to_cpp_type_map
+        self.__overlay = {}
+        self.__interned = {}
+    #enddef
+
+    def intern(self, type_parts):
+        """Returns the single CppType instance for the type parts."""
+        key = tuple(type_parts)
+        cpp_type = self.__interned.get(key, None)
+        if cpp_type is None:
+            is_fundamental = len(key) == 1 and key[0] in cpp_fundamental_spellings
+            cpp_type = self.__interned[key] = CppType(self, key, is_fundamental)
+        return cpp_type
+    #enddef
+
+    def refine(self, cpp_type):
+        """Returns the CppType for the type parts from the class diagram, fundamental types are
+        normalized (see refine_cpp_type())."""
+        refined_type = refine_cpp_type(cpp_type)
+        return self.intern((refined_type,) if isinstance(refined_type, str) else refined_type)
+    #enddef
+
+    def get(self, cpp_type_str, default=None):
+        """Returns information about the type (don't modify it, use update()) or the default
+        if the type isn't known."""
+        info = self.__overlay.get(cpp_type_str, None)
+        if info is None:
+            info = cpp_types.get(cpp_type_str, None)
+            if info is None:
+                info = self.__index_types.get(cpp_type_str, default)
+        return info
+    #enddef
+
+    def __contains__(self, cpp_type_str):
+        return self.get(cpp_type_str) is not None
+    #enddef
+
+    def depends_on_index(self, cpp_type_str):
+        """Whether information about the type (or its absence) comes from the index."""
+        return cpp_type_str not in cpp_types
+    #enddef
+
+    def update(self, cpp_type_str, **info):
+        """Updates information about a known type in this registry only."""
+        current_info = self.get(cpp_type_str)
+        if current_info is None:
+            raise RuntimeError("Can't update unknown type '{}'.".format(cpp_type_str))
+
+        updated_info = dict(current_info)
+        updated_info.update(info)
+        self.__overlay[cpp_type_str] = updated_info
+
+        cpp_type = self.__interned.get(tuple(cpp_type_str.split("::")), None)
+        if cpp_type is not None:
+            cpp_type._info = None
+    #enddef
+
+    def map_basic(self, cpp_type):
+        """Returns the C++ type used for a basic type like 'string' or the type itself if it isn't
+        a basic type."""
+        basic_type_parts = self.__type_map.get(cpp_type.spelling, None)
+        return self.intern(basic_type_parts) if basic_type_parts is not None else cpp_type
+    #enddef
+
+#endclass
+
+class IndexTypes(object):
+    """Types from the index, they're looked up in the index only when needed and memoized, so
+    the cost is proportional to the number of types used, not to the size of the index. It's
+    read-only and can be shared by multiple code generation runs."""
+
+    def __init__(self, index):
+        self.__index = index
+        self.__types = {}
+        self.__hits = 0
+        self.__misses = 0
+    #enddef
+
+    def get(self, cpp_type_str, default=None):
+        info = self.__types.get(cpp_type_str, False)
+        if info is False:
+            # Entries without a C++ include (e.g. with data for other languages only) are misses.
+            value = self.__index.get(tuple(cpp_type_str.split("::")), None)
+            include = value.get("cpp", {}).get("include", None) if value is not None else None
+            info = {"include": include} if include is not None else None
+            self.__types[cpp_type_str] = info
+            if info is not None:
+                self.__hits += 1
+            else:
+                self.__misses += 1
+        #endif
+        return info if info is not None else default
+    #enddef
+
+    def __contains__(self, cpp_type_str):
+        return self.get(cpp_type_str) is not None
+    #enddef
+
+    def debug(self):
+        logging.debug("Index lookups: {} hits, {} misses.".format(self.__hits, self.__misses))
+    #enddef
+
+#endclass
+
+class Scope(object):
+    """Node of the scopes trie. A scope is a namespace or a class, it's identified by the names
+    leading to it from the global scope. Every scope caches resolutions of the types used in it,
+    see SymbolTable."""
+
+    def __init__(self, parent=None, name=""):
+        self.parent = parent
+        self.parts = parent.parts + (name,) if parent is not None else ()
+        self.resolved = {}
+        self.__children = {}
+    #enddef
+
+    def child(self, name):
+        scope = self.__children.get(name, None)
+        if scope is None:
+            scope = self.__children[name] = Scope(self, name)
+        return scope
+    #enddef
+
+    def __str__(self):
+        return "::".join(self.parts)
+    #enddef
+
+#endclass
+
+class SymbolTable(object):
+    """Scopes of a single code generation run and resolution of types in them. A type is
+    resolved in the innermost enclosing scope where it's known, the result is memoized for
+    every (scope, type) pair, so each candidate type is looked up only once per run."""
+
+    def __init__(self, find_type):
+        self.__find_type = find_type
+        self.__root = Scope()
+        self.__lookups = 0
+        self.__hits = 0
+    #enddef
+
+    @property
+    def root(self):
+        return self.__root
+    #enddef
+
+    def scope(self, parts):
+        scope = self.__root
+        for part in parts:
+            scope = scope.child(part)
+        return scope
+    #enddef
+
+    def resolve(self, scope, type_parts):
+        """Returns the full parts of the type as seen from the scope or None if the type isn't
+        known. The type parts have to be a tuple."""
+        self.__lookups += 1
+        full_type_parts = scope.resolved.get(type_parts, False)
+        if full_type_parts is not False:
+            self.__hits += 1
+            return full_type_parts
+
+        candidate = scope.parts + type_parts
+        if self.__find_type("::".join(candidate)) is not None:
+            full_type_parts = candidate
+        elif scope.parent is not None:
+            full_type_parts = self.resolve(scope.parent, type_parts)
+        else:
+            full_type_parts = None
+
+        scope.resolved[type_parts] = full_type_parts
+        return full_type_parts
+    #enddef
+
+    def debug(self):
+        logging.debug("Type resolution: {} lookups, {} cache hits.".format(self.__lookups, self.__hits))
+    #enddef
+
+#endclass
+
 class IncludeTypesRegister(object):
+    """Types used by the generated code, includes are generated for them. Registrations are
+    deduplicated by the type and the scope in which the type is used, so every distinct pair
+    is resolved only once. The resolution is shared with the printers through the symbol
+    table."""
 
-    def __init__(self):
-        self._register = []
+    def __init__(self, context):
+        self._context = context
+        # Maps (type, scope) to the class name of the printer which registered the type first,
+        # the printer itself isn't kept.
+        self._register = {}
     #enddef
 
     def add(self, t, p=None):
-        logging.debug("IncludeTypesRegister.add() type='{}' printer='{}'".format(t, p))
-        self._register.append({ "type": t, "printer": p })
+        # Note that the type could be relative.
+        # TODO Add support for absolute types starting with '::'.
+        types = self._context.types
+        cpp_type = t if isinstance(t, CppType) else types.intern(t)
+
+        # Support some basic types like 'string'.
+        cpp_type = types.map_basic(cpp_type)
+
+        key = (cpp_type, p.scope if p is not None else self._context.symbols.root)
+        if key not in self._register:
+            logging.debug("IncludeTypesRegister.add() type='{}' printer='{}'".format(t, p))
+            self._register[key] = type(p).__name__ if p is not None else None
     #enddef
 
     def resolve(self):
+        """Returns the set of the used types (CppType instances) resolved to the full types."""
         ret = set()
-        for entry in self._register:
-            # Convert the type to string. Note that it could be relative.
-            # TODO Add support for absolute types starting with '::'.
-            type_parts = entry["type"]
-            type_str = "::".join(type_parts)
-
-            # Support some basic types like 'string'.
-            if type_str in to_cpp_type_map:
-                type_parts = to_cpp_type_map[type_str]
-                type_str = "::".join(type_parts)
-
-            # Get the namespace in which the type was introduced.
-            context_ns = []
-            printer = entry["printer"]
-            while printer is not None:
-                        # TODO Do some hierarchy for the class printers.
-                if isinstance(printer, NamespacePrinter) \
-                        or isinstance(printer, ClassPrinterAsComposite) \
-                        or isinstance(printer, ClassPrinter):
-                    name = printer.node.attributes.get("name", "")
-                    if name:
-                        context_ns.insert(0, name)
-                printer = printer.parent
-            #endwhile
-
-            # Resolve the type, it has to be registered in advance.
-            full_type_str = ""
-            for i in reversed(range(len(context_ns) + 1)):
-                tmp = "::".join(context_ns[0:i] + [ type_str ])
-                if tmp in cpp_types:
-                    full_type_str = tmp
-                    break
-            #endfor
-
-            if not full_type_str:
-                raise RuntimeError("Cannot resolve '{}' type in '{}' namespace.".format(type_str, "::".join(context_ns)))
-
-            logging.debug("Resolved '{}' type in '{}' namespace to '{}'.".format(type_str, "::".join(context_ns), full_type_str))
-            ret.add(full_type_str)
+        symbols = self._context.symbols
+        types = self._context.types
+        for cpp_type, scope in self._register:
+            # Resolve the type in the scope in which it was introduced, it has to be registered
+            # in advance.
+            full_type_parts = symbols.resolve(scope, cpp_type.parts)
+            if full_type_parts is None:
+                raise RuntimeError("Cannot resolve '{}' type in '{}' namespace.".format(cpp_type, scope))
+
+            ret.add(types.intern(full_type_parts))
         #endfor
 
         return ret
     #enddef
 
     def debug(self):
-        if self._register:
+        if self._register and logging.getLogger().isEnabledFor(logging.DEBUG):
             logging.debug(">>>>>>>>>> Include types register content")
-            for entry in self._register:
-                logging.debug("type: {} printer: {}".format(entry["type"], str(entry["printer"])))
+            for (cpp_type, scope), printer in self._register.items():
+                logging.debug("type: {} scope: {} printer: {}".format(cpp_type, scope, str(printer)))
             logging.debug("<<<<<<<<<<")
     #enddef
 
 #endclass
 
-class Context(object):
-
-    def __init__(self, options):
-        self.__options = options
-        self.__out = None
-        self.__out_close = None
-        self._printers_data = {}
-        self.__phases_stack = []
-        self.__namespaces_stack = []
-        self.__used_types = IncludeTypesRegister()
+class IndexContext(object):
+    """Owns the index for one or more code generation runs. The index is loaded on enter under
+    a shared lock, which is released right away, so code generations don't block each other.
+    Sharing a single instance between multiple runs (batch processing) loads the index only
+    once.
+
+    On exit, if the index changed and no error occurred, the changes are applied to the current
+    content of the index file (it could be modified by others in the meantime) and saved under
+    an exclusive lock. In the read only mode the index is never saved, changes are kept in
+    memory and it's up to the caller to persist them. If a lock timeout (in seconds) is
+    provided, loading or saving the index fails if it can't be locked in time.
+
+    If an index cache is provided, the index is taken from it instead of being loaded whenever
+    the index file didn't change since the last time."""
+
+    def __init__(self, index_filepath, read_only=False, cache=None, lock_timeout=None):
+        self.__index_filepath = index_filepath
+        self.__read_only = read_only
+        self.__cache = cache
+        self.__lock_timeout = lock_timeout
         self.__index = None
-        self.__index_lock = None
-        self.__tempting_writes_buffer = []
+        self.__types = None
+        self.__lock_wait_time = 0.0
     #enddef
 
     def __enter__(self):
         self.__prepare_index()
-
         return self
     #enddef
 
     def __exit__(self, exc_type, exc_value, traceback):
-        # Persist changes in the index.
-        self.__save_index()
+        # Persist changes in the index, but only if the code generation succeeded.
+        if exc_type is None:
+            self.__save_index()
 
-        # Unlock the index.
-  # FIXME Noticed that the index is written even on error and even if not changed (first codegen fails).
-        if self.__index_lock is not None:
-            self.__index_lock.__exit__(exc_type, exc_value, traceback)
-            self.__index_lock = None
+        if self.__types is not None:
+            self.__types.debug()
+        logging.debug("Index lock waits: {:.3f} s.".format(self.__lock_wait_time))
 
-        self.__index == None
+        self.__index = None
+        self.__types = None
+    #enddef
 
-        self.__close_output()
+    @property
+    def index_filepath(self):
+        return self.__index_filepath
+    #enddef
 
-        # TODO Errors handling etc.
+    @property
+    def index(self):
+        assert self.__index is not None
+        return self.__index
     #enddef
 
     @property
-    def options(self):
-        return self.__options
+    def types(self):
+        """Types found in the index as loaded (see IndexTypes)."""
+        assert self.__types is not None
+        return self.__types
+    #enddef
+
+    def __prepare_index(self):
+        assert self.__index is None
+
+        # Try to load index file if specified.
+        if self.__index_filepath:
+            try:
+                index_file = codegen.index.open_index_file(self.__index_filepath)
+                with index_file.lock(shared=True, timeout=self.__lock_timeout) as lock:
+                    self.__lock_wait_time += lock.wait_time
+                    self.__index = index_file.load_snapshot() if self.__cache is None else self.__cache.load(index_file)
+            except FileNotFoundError:
+                pass
+
+        # Start with empty index if we don't have an index file.
+        if self.__index is None:
+            self.__index = codegen.index.Index()
+
+        # Types from the index are shared by all the runs using this context.
+        self.__types = IndexTypes(self.__index)
+    #enddef
+
+    def __save_index(self):
+        if self.__index is None or not self.__index_filepath or self.__read_only:
+            return
+
+        changes = self.__index.changes()
+        if not changes:
+            return
+
+        index_file = codegen.index.open_index_file(self.__index_filepath)
+        with index_file.lock(timeout=self.__lock_timeout) as lock:
+            self.__lock_wait_time += lock.wait_time
+            # The index file could be modified since the index was loaded.
+            index = index_file.load()
+            index.apply_changes(changes)
+            if index.dirty:
+                logging.debug("Saving {} changed entries into index file '{}'.".format(len(changes), self.__index_filepath))
+                index_file.save(index)
+            if self.__cache is not None:
+                self.__cache.update(index_file, index)
+        #endwith
+    #enddef
+
+#endclass
+
+class Stamp(object):
+    """Up-to-date stamp of generated outputs. It's stored next to the outputs and records
+    a digest of the input, the generator version and the options together with the index
+    entries the generation depended on. If none of these changed since the stamp was saved,
+    the outputs don't need to be generated again."""
+
+    def __init__(self, options, input_data):
+        """The input data can be a string, bytes or an iterable of bytes chunks."""
+        import hashlib
+
+        self.__options = options
+        self.__filepath = options.resolve_filepath(options.stamp_filepath())
+        assert self.__filepath
+
+        digest = hashlib.sha256()
+        digest.update("{}.{}\n".format(_version_major, _version_minor).encode("utf-8"))
+        digest.update(options.fingerprint().encode("utf-8"))
+        digest.update(b"\n")
+        if isinstance(input_data, str):
+            input_data = [ input_data.encode("utf-8") ]
+        elif isinstance(input_data, bytes):
+            input_data = [ input_data ]
+        for chunk in input_data:
+            digest.update(chunk)
+        self.__digest = digest.hexdigest()
     #enddef
 
     @property
-    def out(self):
-        if self.__out is None:
-            self.__open_output()
+    def filepath(self):
+        return self.__filepath
+    #enddef
+
+    def is_up_to_date(self, index):
+        """Checks whether the outputs are up to date with respect to the stamp."""
+        import json
+        import os
 
-        assert self.__out
-        return self.__out
+        try:
+            with open(self.__filepath, "r") as f:
+                stamp = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        if stamp.get("digest", None) != self.__digest:
+            return False
+
+        for key, value in stamp.get("index", {}).items():
+            if index.get(key, None) != value:
+                logging.debug("Index entry '{}' changed since the stamp '{}' was saved.".format(key, self.__filepath))
+                return False
+
+        return os.path.exists(self.__options.resolve_filepath(self.__options.header_output_filepath())) \
+                and os.path.exists(self.__options.resolve_filepath(self.__options.source_output_filepath()))
     #enddef
 
-    def __open_output(self):
-        self.__close_output()
-        assert self.__out is None
+    def invalidate(self):
+        """Removes the stamp, it has to be done before the outputs are regenerated."""
+        import os
 
-        if self.in_phase(PHASE_HEADER_GEN):
-            fp = self.options.header_output_filepath()
-            if fp:
-                logging.debug("Opening header file '{}' for output.".format(fp))
-                self.__out, self.__out_close = (open(fp, "w"), lambda f: f.close())
-        elif self.in_phase(PHASE_SOURCE_GEN):
-            fp = self.options.source_output_filepath()
-            if fp:
-                logging.debug("Opening source file '{}' for output.".format(fp))
-                self.__out, self.__out_close = (open(fp, "w"), lambda f: f.close())
+        try:
+            os.remove(self.__filepath)
+        except FileNotFoundError:
+            pass
+    #enddef
+
+    def save(self, index, index_lookups):
+        """Saves the stamp. Index lookups are C++ types whose lookup depended on the index."""
+        import json
+
+        index_entries = {}
+        for cpp_type_str in index_lookups:
+            key = ".".join(cpp_type_str.split("::"))
+            index_entries[key] = index.get(key, None)
+
+        with open(self.__filepath, "w") as f:
+            json.dump({ "digest": self.__digest, "index": index_entries }, f, sort_keys=True)
+        logging.debug("Saved stamp '{}'.".format(self.__filepath))
+    #enddef
+
+#endclass
+
+class Context(object):
+
+    def __init__(self, options, index_context=None, stamp=None):
+        self.__options = options
+        self.__outputs = {}
+        self.__output_size = 0
+        self.__namespaces_stack = []
+        self.__used_types = IncludeTypesRegister(self)
+        self.__symbols = SymbolTable(self.find_type)
+        self.__types = None
+        self.__index_context = index_context
+        self.__own_index_context = None
+        self.__index_lookups = set()
+        self.__includes = set()
+        self.__stamp = stamp
+    #enddef
+
+    def __enter__(self):
+        # Use own index context unless a shared one was provided.
+        if self.__index_context is None:
+            self.__own_index_context = IndexContext(self.__options.resolve_filepath(self.__options.args.index), # TODO Don't use args in options.
+                    lock_timeout=getattr(self.__options.args, "lock_timeout", None))
+            self.__index_context = self.__own_index_context.__enter__()
 
-        if self.__out is None:
-            self.__out, self.__out_close = (sys.stdout, None)
+        self.__types = TypeRegistry(self.__index_context.types)
+        return self
     #enddef
 
-    def __close_output(self):
-        if self.__out is not None and self.__out_close is not None:
-            self.__out_close(self.__out)
-        self.__out = None
-        self.__out_close = None
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__symbols.debug()
+
+        # Outputs which weren't closed are incomplete (generation failed or didn't need them).
+        self.__outputs.clear()
+
+        # Record the dependencies and the stamp only if the outputs were generated successfully.
+        if exc_type is None and self.__options.depfile_filepath():
+            self.__write_depfile()
+        if exc_type is None and self.__stamp is not None:
+            self.__stamp.save(self.index, self.__index_lookups)
+
+        if self.__own_index_context is not None:
+            self.__own_index_context.__exit__(exc_type, exc_value, traceback)
+            self.__own_index_context = None
+            self.__index_context = None
+
+        # TODO Errors handling etc.
     #enddef
 
     @property
-    def printers_data(self):
-        return self._printers_data
+    def options(self):
+        return self.__options
     #enddef
 
-    def begin_phase(self, phase):
-        logging.debug(">>>>>>>>>> Phase {}.".format(phase))
-        self.__phases_stack.append(phase)
+    def output(self, phase):
+        """Returns the sink of the output generated in the phase (PHASE_HEADER_GEN or
+        PHASE_SOURCE_GEN). The output is buffered and written at once when closed."""
+        assert phase in [ PHASE_HEADER_GEN, PHASE_SOURCE_GEN ]
+        sink = self.__outputs.get(phase, None)
+        if sink is None:
+            sink = self.__outputs[phase] = Sink()
+        return sink
     #enddef
 
-    def end_phase(self, phase):
-        logging.debug("<<<<<<<<<< Phase {}.".format(phase))
-        assert self.__phases_stack
-        popped_phase = self.__phases_stack.pop()
-        assert popped_phase == phase
-        if popped_phase == PHASE_HEADER_GEN or popped_phase == PHASE_SOURCE_GEN:
-            self.__close_output()
+    def close_output(self, phase):
+        """Writes the output generated in the phase to its file or to the standard output."""
+        sink = self.__outputs.pop(phase, None)
+        if sink is None:
+            return
+
+        fp = ""
+        if phase == PHASE_HEADER_GEN:
+            fp = self.options.header_output_filepath()
+        elif phase == PHASE_SOURCE_GEN:
+            fp = self.options.source_output_filepath()
+
+        content = sink.getvalue()
+        self.__output_size += len(content)
+        if fp:
+            logging.debug("Writing output file '{}'.".format(fp))
+            write_if_changed(self.options.resolve_filepath(fp), content)
+        else:
+            sys.stdout.write(content)
     #enddef
 
-    @property
-    def current_phase(self):
-        return PHASE_NONE if not self.__phases_stack else self.__phases_stack[-1]
+    def discard_output(self, phase):
+        self.__outputs.pop(phase, None)
     #enddef
 
-    def in_phase(self, phase):
-        return phase in self.__phases_stack
+    @property
+    def output_size(self):
+        """Number of characters written to all the closed outputs."""
+        return self.__output_size
     #enddef
 
     def begin_namespace(self, ns):
@@ -386,80 +845,199 @@ class Context(object):
         return self.__used_types
     #enddef
 
-    def __prepare_index(self):
-        assert self.__index is None
-
-        # Try to load index file if specified through an option.
-        if self.__options.args.index: # TODO Don't use args in options.
-            try:
-                index_file = codegen.index.IndexFile(self.__options.args.index)
-                self.__index_lock = index_file.lock()
-                self.__index_lock.__enter__()
-                self.__index = index_file.load()
-            except FileNotFoundError:
-                pass
+    @property
+    def symbols(self):
+        return self.__symbols
+    #enddef
 
-        # Start with empty index if we don't have an index file.
-        if self.__index is None:
-            self.__index = codegen.index.Index()
+    @property
+    def types(self):
+        assert self.__types is not None
+        return self.__types
+    #enddef
 
-        # Load index into cpp_types.
-        if self.__index:
-            logging.debug(">>>>>>>>>> Index file '{}' content".format(self.__options.args.index))
-            for key, value in self.__index.items():
-                logging.debug("Found '{}' in index file '{}'".format(key, value))
-                cpp_key = "::".join(key.split(".")) # TODO Do it in a better way after fixing the index iteration. cpp_types maybe can use tuples too after the fix.
-                if cpp_key not in cpp_types:
-                    cpp_types[cpp_key] = {"include": value["cpp"]["include"]} # TODO Careful with the access here.
-                else:
-                    assert key not in cpp_types
-            logging.debug("<<<<<<<<<<")
+    @property
+    def index(self):
+        assert self.__index_context is not None
+        return self.__index_context.index
+    #enddef
+
+    def add_include(self, include):
+        """Records an include of the generated code, it's used to determine dependencies."""
+        self.__includes.add(include)
+    #enddef
+
+    def __write_depfile(self):
+        """Writes a Make/Ninja depfile listing everything the outputs depend on, i.e. the input,
+        the index (with its journal) and the included headers found in the include
+        directories."""
+        targets = [ fp for fp in [ self.__options.header_output_filepath(),
+                                   self.__options.source_output_filepath() ] if fp ]
+        if not targets:
+            logging.warning("Not writing depfile, there are no output files.")
+            return
+
+        deps = []
+        if self.__options.input_filepath():
+            deps.append(self.__options.input_filepath())
+        if self.__options.args.index:
+            index_file = codegen.index.open_index_file(self.__options.args.index)
+            for filepath in [ index_file.filepath, index_file.journal_filepath ]:
+                if os.path.exists(self.__options.resolve_filepath(filepath)):
+                    deps.append(filepath)
         #endif
+
+        header_dir = os.path.dirname(self.__options.header_output_filepath())
+        for include in sorted(self.__includes):
+            name = include[1:-1]
+            search_dirs = self.__options.include_dirs()
+            if include.startswith('"'):
+                search_dirs = [ header_dir ] + search_dirs
+            for search_dir in search_dirs:
+                filepath = os.path.join(search_dir, name)
+                if os.path.isfile(self.__options.resolve_filepath(filepath)):
+                    deps.append(filepath)
+                    break
+        #endfor
+
+        def escape(filepath):
+            return filepath.replace(" ", "\\ ").replace("#", "\\#").replace("$", "$$")
+        #enddef
+
+        content = " ".join(escape(fp) for fp in targets) + ":"
+        for dep in deps:
+            content += " \\\n  " + escape(dep)
+        content += "\n"
+
+        write_if_changed(self.__options.resolve_filepath(self.__options.depfile_filepath()), content)
+    #enddef
+
+    def find_type(self, cpp_type_str):
+        """Returns information about a known C++ type or None if the type isn't known. Lookups
+        whose result depends on the index are recorded for the up-to-date stamp."""
+        if self.types.depends_on_index(cpp_type_str):
+            self.__index_lookups.add(cpp_type_str)
+        return self.types.get(cpp_type_str)
+    #enddef
+
+#endclass
+
+class Sink(object):
+    """Buffer of generated text kept as a list of chunks, the chunks are joined only when the
+    content is needed. Besides regular writes it supports tempting writes (see TemptingWrite)."""
+
+    WRITE_FLAG_TEMPTING = 1
+
+    WRITE_MODE_DEFAULT = 0
+    WRITE_MODE_TEMPTING = WRITE_MODE_DEFAULT | WRITE_FLAG_TEMPTING
+
+    __slots__ = ("__chunks", "__tempting_offset")
+
+    def __init__(self):
+        self.__chunks = []
+        self.__tempting_offset = None
     #enddef
 
     @property
-    def index(self):
-        assert self.__index is not None
-        return self.__index
+    def empty(self):
+        return not self.__chunks
     #enddef
 
-    def __save_index(self):
-        # TODO Work with index more nicely. Save it only if there are some changes.
-        if self.__index is not None and self.__options.args.index:
-            index_file = codegen.index.IndexFile(self.__options.args.index)
-            index_file.save(self.__index)
+    def write(self, *args, mode=WRITE_MODE_DEFAULT):
+        """Writes the arguments converted to strings. Tempting writes return a TemptingWrite to
+        be used as a context manager."""
+        return self.__write(args, False, mode)
+    #enddef
+
+    def writeln(self, *args, mode=WRITE_MODE_DEFAULT):
+        return self.__write(args, True, mode)
     #enddef
 
-    @contextmanager
-    def tempting_writes_buffer_append(self, write):
-        logging.debug("Appending tempting write {}.".format(len(self.__tempting_writes_buffer)))
-        clear = bool(not self.__tempting_writes_buffer)
-        self.__tempting_writes_buffer.append(write)
-        yield
-        if clear:
-            self.clear_tempting_writes()
+    def write_sink(self, sink):
+        """Writes the content of another sink. It's a regular write unless the sink is empty."""
+        assert sink.__tempting_offset is None
+        if sink.__chunks:
+            self.__tempting_offset = None
+            self.__chunks.extend(sink.__chunks)
     #enddef
 
-    def flush_tempting_writes(self):
-        logging.debug("Flushing {} tempting writes.".format(len(self.__tempting_writes_buffer)))
-        tempting_writes_buffer = self.__tempting_writes_buffer
-        self.__tempting_writes_buffer = []
-        for write in tempting_writes_buffer:
-            write()
+    def getvalue(self):
+        """Returns the content without the pending tempting writes."""
+        chunks = self.__chunks
+        if self.__tempting_offset is not None:
+            chunks = chunks[:self.__tempting_offset]
+        return "".join(chunks)
     #enddef
 
-    def clear_tempting_writes(self):
-        del self.__tempting_writes_buffer[:]
+    def is_tempting_write_pending(self, offset):
+        return self.__tempting_offset is not None and self.__tempting_offset <= offset
+    #enddef
+
+    def rollback_tempting_writes(self, offset):
+        """Drops the pending tempting writes if the first of them starts at the offset."""
+        if self.__tempting_offset is None or self.__tempting_offset != offset:
+            return False
+
+        del self.__chunks[offset:]
+        self.__tempting_offset = None
+        return True
+    #enddef
+
+    def __write(self, args, newline, mode):
+        chunks = self.__chunks
+        tempting_write = None
+        if mode & Sink.WRITE_FLAG_TEMPTING:
+            offset = len(chunks)
+            if self.__tempting_offset is None:
+                self.__tempting_offset = offset
+            tempting_write = TemptingWrite(self, offset)
+        else:
+            # A regular write commits all the pending tempting writes.
+            self.__tempting_offset = None
+
+        chunks.extend(map(str, args))
+        if newline:
+            chunks.append("\n")
+
+        return tempting_write
     #enddef
 
 #endclass
 
-class Printer(object):
+class TemptingWrite(object):
+    """Text written to a sink only if anything else gets written to it before the tempting write
+    is exited (used as a context manager). The text is appended to the sink immediately and
+    rolled back on exit if it wasn't committed in the meantime. Nested tempting writes are
+    committed or rolled back together with the outermost pending one."""
 
-    WRITE_FLAG_TEMPTING = 1
+    __slots__ = ("__sink", "__offset", "__rolled_back")
 
-    WRITE_MODE_DEFAULT = 0
-    WRITE_MODE_TEMPTING = WRITE_MODE_DEFAULT | WRITE_FLAG_TEMPTING
+    def __init__(self, sink, offset):
+        self.__sink = sink
+        self.__offset = offset
+        self.__rolled_back = False
+    #enddef
+
+    @property
+    def committed(self):
+        return not self.__rolled_back and not self.__sink.is_tempting_write_pending(self.__offset)
+    #enddef
+
+    def __enter__(self):
+        return self
+    #enddef
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__sink.rollback_tempting_writes(self.__offset):
+            self.__rolled_back = True
+    #enddef
+
+#endclass
+
+class Printer(object):
+
+    # Whether the printer introduces a scope (namespace or class) named after its node.
+    introduces_scope = False
 
     def __init__(self, context, parent_printer):
         self.__context = context
@@ -467,6 +1045,8 @@ class Printer(object):
         if parent_printer is not None:
             parent_printer.add_printer(self)
         self.__parent = parent_printer
+        self.__scope = None
+        self.__declaration = None
 
         assert(self.__context)
     #enddef
@@ -486,11 +1066,34 @@ class Printer(object):
         self.__printers.append(printer)
     #enddef
 
+    def finish(self):
+        """Builds the declaration of the printer right away and releases the child printers,
+        only the declaration is kept (see declaration()). The printer mustn't be needed for
+        building anything else but its parent's declaration afterwards."""
+        self.__declaration = self.build()
+        self.__printers = []
+    #enddef
+
+    def declaration(self):
+        """Returns the declaration (code model) built by finish() or builds it now."""
+        return self.__declaration if self.__declaration is not None else self.build()
+    #enddef
+
     @property
     def parent(self):
         return self.__parent
     #enddef
 
+    @property
+    def scope(self):
+        """Scope in which the content of the printer is generated."""
+        if self.__scope is None:
+            scope = self.__parent.scope if self.__parent is not None else self.__context.symbols.root
+            name = self.node.attributes.get("name", "") if self.introduces_scope else ""
+            self.__scope = scope.child(name) if name else scope
+        return self.__scope
+    #enddef
+
     def find_parent(self, cond):
         parent = self.parent
         while parent is not None:
@@ -509,46 +1112,9 @@ class Printer(object):
                 "." if self_type.__module__ else "", self_type.__name__)
     #enddef
 
-    def write(self, *args, mode=WRITE_MODE_DEFAULT, after_write=None):
-        def write_args():
-            for arg in args:
-                self.__context.out.write(str(arg))
-
-            if after_write:
-                after_write()
-        #enddef
-
-        if mode & Printer.WRITE_FLAG_TEMPTING:
-            return self.context.tempting_writes_buffer_append(write_args)
-        else:
-            self.context.flush_tempting_writes()
-            write_args()
-    #enddef
-
-    def writeln(self, *args, mode=WRITE_MODE_DEFAULT, after_write=None):
-        def write_args():
-            if logging.getLogger().level <= logging.DEBUG:
-                debug_line = ""
-                for arg in args:
-                    debug_line += str(arg)
-                logging.debug("writeln('{}'). (tempting={})".format(debug_line, mode & Printer.WRITE_FLAG_TEMPTING))
-
-            self.write(*args)
-            print(file=self.__context.out)
-
-            if after_write:
-                after_write()
-        #enddef
-
-        if mode & Printer.WRITE_FLAG_TEMPTING:
-            return self.context.tempting_writes_buffer_append(write_args)
-        else:
-            self.context.flush_tempting_writes()
-            write_args()
-    #enddef
-
     def resolve_type(self, type_str_or_parts, scope=None):
-        """Resolves the provided type in the scope of this printer."""
+        """Resolves the provided type in the scope of this printer (or the provided printer).
+        Returns the full type as a CppType."""
 
         def type_to_parts(what):
             """Splits the input into parts. The input can be an iterable in which case it's expected
@@ -581,44 +1147,22 @@ class Printer(object):
             return type_parts
         #enddef
 
-        type_parts = type_to_parts(type_str_or_parts)
-        type_str = "::".join(type_parts)
+        types = self.context.types
+        if isinstance(type_str_or_parts, CppType):
+            cpp_type = type_str_or_parts
+        else:
+            cpp_type = types.intern(type_to_parts(type_str_or_parts))
 
         # Support some basic types like 'string'.
-        if type_str in to_cpp_type_map:
-            type_parts = to_cpp_type_map[type_str]
-            type_str = "::".join(type_parts)
-
-        # Get the namespace in which the type was introduced.
-        context_ns = []
-        printer = scope if scope is not None else self
-        while printer is not None:
-            # TODO It would be safer to have deterministically specified if a printer introduces a namespace.
-            if isinstance(printer, NamespacePrinter) \
-                    or isinstance(printer, ClassPrinterAsComposite) \
-                    or isinstance(printer, ClassPrinter):
-                name = printer.node.attributes.get("name", "")
-                if name:
-                    context_ns.insert(0, name)
-            printer = printer.parent
-        #endwhile
-
-        logging.debug("Resolving '{}' in namespace '{}'.".format(type_str, "::".join(context_ns)))
-
-        full_type_parts = []
-        for i in reversed(range(len(context_ns) + 1)):
-            tmp = context_ns[0:i] + type_parts
-            tmp_str = "::".join(tmp)
-            logging.debug("Resolving '{}', trying if '{}' is a known type.".format(type_str, tmp_str))
-            if tmp_str in cpp_types:
-                full_type_parts = tmp
-                break
-        #endfor
+        cpp_type = types.map_basic(cpp_type)
 
-        if not full_type_parts:
-            raise RuntimeError("Cannot resolve '{}' type in '{}' namespace.".format(type_str, "::".join(context_ns)))
+        # Resolve the type in the scope in which it was introduced.
+        scope = (scope if scope is not None else self).scope
+        full_type_parts = self.context.symbols.resolve(scope, cpp_type.parts)
+        if full_type_parts is None:
+            raise RuntimeError("Cannot resolve '{}' type in '{}' namespace.".format(cpp_type, scope))
 
-        return tuple(full_type_parts)
+        return types.intern(full_type_parts)
     #enddef
 
 #endclass
@@ -637,6 +1181,11 @@ class NodePrinter(Printer):
         return self.__node
     #enddef
 
+    def finish(self):
+        super(NodePrinter, self).finish()
+        self.__node = None
+    #enddef
+
     def get_node_attribute(self, attr_path, default=None):
         attr_path_parts = attr_path.split(".")
         attrs_view = self.__node.attributes
@@ -653,52 +1202,43 @@ class FileHeaderPrinter(Printer):
         super(FileHeaderPrinter, self).__init__(context, parent_printer)
     #enddef
 
-    def generate(self):
-
-        if self.context.in_phase(PHASE_HEADER_GEN):
-            self.writeln("#pragma once")
-
-        def print_header(lines):
-            width = max(len(ln) for ln in lines)
-            self.writeln("// ", "=" * width)
-            for ln in lines:
-                self.writeln("// ", ln)
-            self.writeln("// ", "=" * width)
-        #enddef
+    def build(self):
+        from . import ir
 
-        header_lines = []
-        header_lines.append("Generated by codegen cpp generator ver. {}.{}.".format(_version_major, _version_minor))
-        from datetime import datetime
-        header_lines.append(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-        print_header(header_lines)
+        lines = []
+        lines.append("Generated by codegen cpp generator ver. {}.{}.".format(_version_major, _version_minor))
+        if not self.context.options.deterministic_header():
+            from datetime import datetime
+            lines.append(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
-        if self.context.in_phase(PHASE_HEADER_GEN):
-            self._generate_header_includes()
-        elif self.context.in_phase(PHASE_SOURCE_GEN):
-            self._generate_source_includes()
-        return PRINTER_FINISHED
+        return ir.FileHeader(lines, self._header_includes(), self._source_includes())
     #enddef
 
-    def _generate_header_includes(self):
+    def _header_includes(self):
+        from . import ir
+
         self.context.used_types.debug()
         used_types = self.context.used_types.resolve()
         includes = set()
         for used_type in used_types:
-            assert used_type in cpp_types
-            include = cpp_types[used_type].get("include", "")
+            assert used_type.spelling in self.context.types
+            include = used_type.include
             if include:
                 includes.add(include)
 
-        for include in sorted(includes):
-            assert include
-            self.write("#include ")
-            self.writeln(include)
+        for include in includes:
+            self.context.add_include(include)
+
+        return [ ir.Include(include) for include in sorted(includes) ]
     #enddef
 
-    def _generate_source_includes(self):
+    def _source_includes(self):
+        from . import ir
+
         header_output_filepath = self.context.options.header_output_filepath()
         if header_output_filepath:
-            self.writeln('#include "' + header_output_filepath  + '"')
+            return [ ir.Include('"' + header_output_filepath  + '"') ]
+        return []
     #enddef
 
 #endclass
@@ -711,28 +1251,27 @@ class NamespacePrinter(NodePrinter):
     # needs to be closed.
     # XXX
 
+    introduces_scope = True
+
     def __init__(self, node, context, parent_printer):
         super(NamespacePrinter, self).__init__(node, context, parent_printer)
     #enddef
 
-    def generate(self):
-        finished_flag = PRINTER_FINISHED
+    def build(self):
+        from . import ir
 
         # TODO Do a special node for the root node.
         name = self.node.attributes.get("name", "")
         if name:
-            self.writeln("namespace ", name, " {")
             self.context.begin_namespace(self.node)
 
-        # TODO Move this to the base where printers property will be better encapsulated.
-        for printer in self.printers:
-            finished_flag &= printer.generate()
+        full_name = "::".join(ns.attributes["name"] for ns in self.context.open_namespaces)
+        namespace = ir.Namespace(name, full_name, [ printer.declaration() for printer in self.printers ])
 
         if name:
-            self.writeln("} // namespace ", "::".join(ns.attributes["name"] for ns in self.context.open_namespaces))
             self.context.end_namespace(self.node)
 
-        return finished_flag
+        return namespace
     #enddef
 
 #endclass
@@ -749,283 +1288,59 @@ class ClassPrinterAsComposite(NodePrinter):
     # part we are generating.
     # XXX
 
+    introduces_scope = True
+
     def __init__(self, node, context, parent_printer):
         super(ClassPrinterAsComposite, self).__init__(node, context, parent_printer)
 
         # Determine the base type. If base is provided explicitly, resolve it in the parent scope,
         # the base type can't be in the scope of this class.
         base_str = node.attributes.get("base", "")
-        base_parts = []
         if base_str:
-            base_parts = self.resolve_type(base_str, self.parent)
-            base_str = "::".join(base_parts)
+            base_type = self.resolve_type(base_str, self.parent)
         else:
-            base_parts = ["mad", "codegen", "tree", "CompositeNode"]
-            base_str = "::".join(base_parts)
+            base_type = self.context.types.intern(("mad", "codegen", "tree", "CompositeNode"))
 
-        self.__base_str = base_str
+        self.__base_str = base_type.spelling
 
         # Add the base to the used types so an include will be generated.
-        self.context.used_types.add(base_parts, self)
+        self.context.used_types.add(base_type, self)
 
         # Check the type is known, i.e. present in the index.
-        full_name = []
-        printer = self
-        while printer is not None:
-            # TODO Make this more robust.
-            if isinstance(printer, NamespacePrinter) \
-                    or isinstance(printer, ClassPrinterAsComposite) \
-                    or isinstance(printer, ClassPrinter):
-                name = printer.node.attributes.get("name", "")
-                if name:
-                    full_name.insert(0, name)
-            printer = printer.parent
-        #endwhile
-
-        full_name_str = "::".join(full_name)
-        if full_name_str not in cpp_types:
+        full_name_str = str(self.scope)
+        if full_name_str not in self.context.types:
             logging.warning("Type '{}' not found in index.".format(full_name_str))
     #enddef
 
-    def generate(self):
-
-        SECTION_NONE = 0
-        SECTION_PUBLIC = 1
-        SECTION_PROTECTED = 2
-        SECTION_PRIVATE = 3
-
-        class data:
-            finished_flag = PRINTER_FINISHED
-            section = SECTION_NONE
+    def build(self):
+        from . import ir
 
-            class node_attrs:
-                name = self.node.attributes.get("name", "")
-                is_struct = self.node.attributes.get("is_struct", False)
-
-                class cpp:
-                    pimpl = self.node.attributes.get("cpp", {}).get("pimpl", False)
-                #endclass
-            #endclass
-        #endclass
-
-        if not data.node_attrs.name:
+        name = self.node.attributes.get("name", "")
+        if not name:
             raise RuntimeError("Missing or empty 'name' attribute of a 'class' node")
 
+        pimpl = self.node.attributes.get("cpp", {}).get("pimpl", False)
         for printer in self.printers:
-            data.node_attrs.cpp.pimpl |= printer.node.attributes.get("cpp", {}).get("pimpl", False)
-
-        def switch_section(section):
-            tempting_section = nullcontext()
-
-            if data.section == section:
-                pass
-            elif section == SECTION_NONE:
-                data.section = SECTION_NONE
-            elif section in [SECTION_PUBLIC, SECTION_PROTECTED, SECTION_PRIVATE]:
-                # Note that the section variable has to be updated only after the write actually
-                # happens, otherwise it would be misleading.
-                def set_section():
-                    data.seciton = section
-                #enddef
-
-                if section == SECTION_PUBLIC:
-                    logging.debug("Switching section to public.")
-                    tempting_section = self.writeln("public:",
-                            mode=Printer.WRITE_MODE_TEMPTING,
-                            after_write=set_section)
-                elif section == SECTION_PROTECTED:
-                    logging.debug("Switching section to protected.")
-                    tempting_section = self.writeln("protected:",
-                            mode=Printer.WRITE_MODE_TEMPTING,
-                            after_write=set_section)
-                elif section == SECTION_PRIVATE:
-                    logging.debug("Switching section to private.")
-                    tempting_section = self.writeln("private:",
-                            mode=Printer.WRITE_MODE_TEMPTING,
-                            after_write=set_section)
-            else:
-                raise Exception("Invalid section ({}), need one of SECTION_NONE, SECTION_PUBLIC, SECTION_PROTECTED or SECTION_PRIVATE.".format(section))
-
-            return tempting_section
-        #enddef
-
-        def generate_content(phases):
-            for phase in phases:
-                self.context.begin_phase(phase)
-
-                tempting_section = nullcontext()
-
-                if self.context.in_phase(PHASE_CLASS_DECL) or self.context.in_phase(PHASE_CLASS_PIMPL_DECL):
-                    if phase == PHASE_CLASS_MEMBER_PUBLIC_VARIABLE:
-                        tempting_section = switch_section(SECTION_PUBLIC)
-                    elif phase == PHASE_CLASS_MEMBER_PROTECTED_VARIABLE:
-                        tempting_section = switch_section(SECTION_PROTECTED)
-                    elif phase == PHASE_CLASS_MEMBER_PRIVATE_VARIABLE:
-                        tempting_section = switch_section(SECTION_PRIVATE)
-                #endif
-
-                with tempting_section:
-                    for printer in self.printers:
-                            # FIXME This isn't sufficient, members will indicate that they didn't
-                            # finished in the very beginning and it will be carried over through
-                            # the whole process in the return value.
-                            data.finished_flag &= printer.generate()
-                #endwith
-
-                self.context.end_phase(phase)
-        #enddef
+            pimpl |= printer.node.attributes.get("cpp", {}).get("pimpl", False)
 
         # TODO Structs isn't supported properly, generated as classes at the moment.
-
-        if self.context.in_phase(PHASE_HEADER_GEN):
-
-            # Start class/struct.
-            self.context.begin_phase(PHASE_CLASS_DECL)
-            self.writeln("class {} : public {}".format(data.node_attrs.name, self.__base_str))
-            self.writeln("{")
-
-            # Constructor & move constructor.
-            with switch_section(SECTION_PUBLIC):
-                self.writeln("  {class_name}();".format(class_name=data.node_attrs.name))
-                self.writeln("  {class_name}({class_name}&& other);".format(class_name=data.node_attrs.name))
-
-            # Generate methods.
-            generate_content([ PHASE_CLASS_MEMBER_GETTER,
-                               PHASE_CLASS_MEMBER_CONST_GETTER,
-                               PHASE_CLASS_MEMBER_SETTER ])
-
-            # Put member variables in a seperate public/protected/private sections.
-            with switch_section(SECTION_NONE):
-                pass
-
-            # Generate member variables.
-            generate_content([ PHASE_CLASS_MEMBER_PUBLIC_VARIABLE,
-                               PHASE_CLASS_MEMBER_PROTECTED_VARIABLE,
-                               PHASE_CLASS_MEMBER_PRIVATE_VARIABLE ])
-
-            # Add private implementation member if needed.
-            if data.node_attrs.cpp.pimpl:
-                with switch_section(SECTION_PRIVATE):
-                    self.writeln("  class Impl;")
-                    self.writeln("  Impl* m_impl = nullptr;")
-
-            self.writeln("};")
-            self.context.end_phase(PHASE_CLASS_DECL)
-            data.finished_flag = PRINTER_NOT_FINISHED
+        cls = ir.Class(name, self.__base_str, False, pimpl)
+        cls.members = [ printer.declaration() for printer in self.printers ]
+        initializers = [ member.initializer for member in cls.members if member.initializer is not None ]
+
+        # Constructor & move constructor.
+        if pimpl:
+            # FIXME The move constructor isn't implemented and the destructor isn't declared.
+            cls.constructors.append(ir.Constructor(initializers=initializers + [ "m_impl(new Impl)" ]))
+            cls.constructors.append(ir.Constructor("{}&& other".format(name), defined=False))
+            cls.destructor = ir.Destructor(body=[ "delete m_impl;", "m_impl = nullptr;" ], declared=False)
+        else:
+            cls.constructors.append(ir.Constructor(initializers=initializers))
+            cls.constructors.append(ir.Constructor("{}&& other".format(name),
+                    [ "{}(std::move(other))".format(self.__base_str) ] + initializers))
         #endif
 
-        # Reset section before source generation starts.
-        with switch_section(SECTION_NONE):
-            pass
-
-        if self.context.in_phase(PHASE_SOURCE_GEN):
-            if data.node_attrs.cpp.pimpl:
-                # Declare pimpl class.
-                self.context.begin_phase(PHASE_CLASS_PIMPL_DECL)
-                self.writeln("class ", data.node_attrs.name, "::Impl")
-                self.writeln("{")
-
-                generate_content([ PHASE_CLASS_MEMBER_GETTER,
-                                   PHASE_CLASS_MEMBER_CONST_GETTER,
-                                   PHASE_CLASS_MEMBER_SETTER ])
-
-                with switch_section(SECTION_NONE):
-                    pass
-
-                generate_content([ PHASE_CLASS_MEMBER_PUBLIC_VARIABLE,
-                                   PHASE_CLASS_MEMBER_PROTECTED_VARIABLE,
-                                   PHASE_CLASS_MEMBER_PRIVATE_VARIABLE ])
-
-                self.writeln("};")
-                self.context.end_phase(PHASE_CLASS_PIMPL_DECL)
-
-                # Implement pimpl class methods.
-                self.context.begin_phase(PHASE_CLASS_PIMPL_IMPL)
-
-                generate_content([ PHASE_CLASS_MEMBER_GETTER,
-                                   PHASE_CLASS_MEMBER_CONST_GETTER,
-                                   PHASE_CLASS_MEMBER_SETTER ])
-
-                self.context.end_phase(PHASE_CLASS_PIMPL_IMPL)
-            #endif
-
-            self.context.begin_phase(PHASE_CLASS_IMPL)
-
-            # Constructor & destructor.
-            if data.node_attrs.cpp.pimpl:
-                self.writeln("{class_name}::{class_name}()".format(class_name=data.node_attrs.name))
-
-                self.context.begin_phase(PHASE_CLASS_MEMBER_INIT)
-                written = False
-                def set_written():
-                    nonlocal written
-                    written = True
-                #enddef
-                with self.write("  : ", mode=Printer.WRITE_MODE_TEMPTING, after_write=set_written):
-                    for printer in self.printers:
-                        with self.write(",\n    ", mode=Printer.WRITE_MODE_TEMPTING) if written else nullcontext():
-                            # TODO Update finished flag.
-                            printer.generate()
-                    with self.write(",\n    ", mode=Printer.WRITE_MODE_TEMPTING) if written else nullcontext():
-                        self.writeln("m_impl(new Impl)")
-                #endwith
-                self.context.end_phase(PHASE_CLASS_MEMBER_INIT)
-
-                self.writeln("{")
-                self.writeln("}")
-                self.writeln("{name}::~{name}()".format(name=data.node_attrs.name))
-                self.writeln("{")
-                self.writeln("  delete m_impl;")
-                self.writeln("  m_impl = nullptr;")
-                self.writeln("}")
-            else:
-                # Constructor.
-                self.writeln("{class_name}::{class_name}()".format(class_name=data.node_attrs.name))
-
-                self.context.begin_phase(PHASE_CLASS_MEMBER_INIT)
-                written = False
-                def set_written():
-                    nonlocal written
-                    written = True
-                #enddef
-                with self.write("  : ", mode=Printer.WRITE_MODE_TEMPTING, after_write=set_written):
-                    for printer in self.printers:
-                        with self.write(",\n    ", mode=Printer.WRITE_MODE_TEMPTING) if written else nullcontext():
-                            # TODO Update finished flag.
-                            printer.generate()
-                #endwith
-                self.context.end_phase(PHASE_CLASS_MEMBER_INIT)
-
-                if written:
-                    self.writeln()
-
-                self.writeln("{")
-                self.writeln("}")
-
-                # Move constructor.
-                self.writeln("{class_name}::{class_name}({class_name}&& other)".format(class_name=data.node_attrs.name))
-                self.write("  : {base_class}(std::move(other))".format(base_class=self.__base_str))
-
-                self.context.begin_phase(PHASE_CLASS_MEMBER_INIT)
-                for printer in self.printers:
-                    with self.write(",\n    ", mode=Printer.WRITE_MODE_TEMPTING):
-                        # TODO Update finished flag.
-                        printer.generate()
-                self.context.end_phase(PHASE_CLASS_MEMBER_INIT)
-
-                self.writeln()
-
-                self.writeln("{")
-                self.writeln("}")
-            #endif
-
-            generate_content([ PHASE_CLASS_MEMBER_GETTER,
-                               PHASE_CLASS_MEMBER_CONST_GETTER,
-                               PHASE_CLASS_MEMBER_SETTER ])
-
-            self.context.end_phase(PHASE_CLASS_IMPL)
-
-        return data.finished_flag
+        return cls
     #enddef
 
 #endclass
@@ -1042,261 +1357,53 @@ class ClassPrinter(NodePrinter):
     # part we are generating.
     # XXX
 
+    introduces_scope = True
+
     def __init__(self, node, context, parent_printer):
         super(ClassPrinter, self).__init__(node, context, parent_printer)
 
         # Check the type is known, i.e. present in the index.
-        full_name = []
-        printer = self
-        while printer is not None:
-            if isinstance(printer, NamespacePrinter) \
-                    or isinstance(printer, ClassPrinterAsComposite) \
-                    or isinstance(printer, ClassPrinter):
-                name = printer.node.attributes.get("name", "")
-                if name:
-                    full_name.insert(0, name)
-            printer = printer.parent
-        #endwhile
-
-        full_name_str = "::".join(full_name)
-        if full_name_str not in cpp_types:
+        full_name_str = str(self.scope)
+        if full_name_str not in self.context.types:
             logging.warning("Type '{}' not present in index.".format(full_name_str))
     #enddef
 
-    def generate(self):
-
-        SECTION_NONE = 0
-        SECTION_PUBLIC = 1
-        SECTION_PROTECTED = 2
-        SECTION_PRIVATE = 3
-
-        class data:
-            finished_flag = PRINTER_FINISHED
-            section = SECTION_NONE
-
-            class node_attrs:
-                name = self.node.attributes.get("name", "")
-                is_struct = self.node.attributes.get("is_struct", False)
-
-                class cpp:
-                    pimpl = self.node.attributes.get("cpp", {}).get("pimpl", False)
-                #endclass
-            #endclass
-        #endclass
+    def build(self):
+        from . import ir
 
-        if not data.node_attrs.name:
+        name = self.node.attributes.get("name", "")
+        if not name:
             raise RuntimeError("Missing or empty 'name' attribute of a 'class' node")
 
+        pimpl = self.node.attributes.get("cpp", {}).get("pimpl", False)
         for printer in self.printers:
-            data.node_attrs.cpp.pimpl |= printer.node.attributes.get("cpp", {}).get("pimpl", False)
-
-        def switch_section(section):
-            tempting_section = nullcontext()
-
-            if data.section == section:
-                pass
-            elif section == SECTION_NONE:
-                data.section = SECTION_NONE
-            elif section in [SECTION_PUBLIC, SECTION_PROTECTED, SECTION_PRIVATE]:
-                # Note that the section variable has to be updated only after the write actually
-                # happens, otherwise it would be misleading.
-                def set_section():
-                    data.seciton = section
-                #enddef
-
-                if section == SECTION_PUBLIC:
-                    logging.debug("Switching section to public.")
-                    tempting_section = self.writeln("public:",
-                            mode=Printer.WRITE_MODE_TEMPTING,
-                            after_write=set_section)
-                elif section == SECTION_PROTECTED:
-                    logging.debug("Switching section to protected.")
-                    tempting_section = self.writeln("protected:",
-                            mode=Printer.WRITE_MODE_TEMPTING,
-                            after_write=set_section)
-                elif section == SECTION_PRIVATE:
-                    logging.debug("Switching section to private.")
-                    tempting_section = self.writeln("private:",
-                            mode=Printer.WRITE_MODE_TEMPTING,
-                            after_write=set_section)
-            else:
-                raise Exception("Invalid section ({}), need one of SECTION_NONE, SECTION_PUBLIC, SECTION_PROTECTED or SECTION_PRIVATE.".format(section))
-
-            return tempting_section
-        #enddef
-
-        def generate_content(phases):
-            for phase in phases:
-                self.context.begin_phase(phase)
-
-                tempting_section = nullcontext()
-
-                if self.context.in_phase(PHASE_CLASS_DECL) or self.context.in_phase(PHASE_CLASS_PIMPL_DECL):
-                    if phase == PHASE_CLASS_MEMBER_PUBLIC_VARIABLE:
-                        tempting_section = switch_section(SECTION_PUBLIC)
-                    elif phase == PHASE_CLASS_MEMBER_PROTECTED_VARIABLE:
-                        tempting_section = switch_section(SECTION_PROTECTED)
-                    elif phase == PHASE_CLASS_MEMBER_PRIVATE_VARIABLE:
-                        tempting_section = switch_section(SECTION_PRIVATE)
-                #endif
-
-                with tempting_section:
-                    for printer in self.printers:
-                            # FIXME This isn't sufficient, members will indicate that they didn't
-                            # finished in the very beginning and it will be carried over through
-                            # the whole process in the return value.
-                            data.finished_flag &= printer.generate()
-                #endwith
-
-                self.context.end_phase(phase)
-        #enddef
-
-        # TODO Structs isn't supported properly, generated as classes at the moment.
-
-        if self.context.in_phase(PHASE_HEADER_GEN):
-
-            # Start class/struct.
-            self.context.begin_phase(PHASE_CLASS_DECL)
-            self.writeln("struct " if data.node_attrs.is_struct else "class ", data.node_attrs.name)
-            self.writeln("{")
-
-            # Constructor & destructor.
-            with switch_section(SECTION_PUBLIC):
-                self.writeln("  {}();".format(data.node_attrs.name))
-                self.writeln("  virtual ~{}();".format(data.node_attrs.name))
-
-            # Generate methods.
-            generate_content([ PHASE_CLASS_MEMBER_GETTER,
-                               PHASE_CLASS_MEMBER_CONST_GETTER,
-                               PHASE_CLASS_MEMBER_SETTER ])
+            pimpl |= printer.node.attributes.get("cpp", {}).get("pimpl", False)
 
-            # Put member variables in a seperate public/protected/private sections.
-            with switch_section(SECTION_NONE):
-                pass
-
-            # Generate member variables.
-            generate_content([ PHASE_CLASS_MEMBER_PUBLIC_VARIABLE,
-                               PHASE_CLASS_MEMBER_PROTECTED_VARIABLE,
-                               PHASE_CLASS_MEMBER_PRIVATE_VARIABLE ])
-
-            # Add private implementation member if needed.
-            if data.node_attrs.cpp.pimpl:
-                with switch_section(SECTION_PRIVATE):
-                    self.writeln("  class Impl;")
-                    self.writeln("  Impl* m_impl = nullptr;")
-
-            self.writeln("};")
-            self.context.end_phase(PHASE_CLASS_DECL)
-            data.finished_flag = PRINTER_NOT_FINISHED
-
-            full_name = []
-            ns_or_class_cond = \
-                    lambda p: isinstance(p, NamespacePrinter) or isinstance(p, ClassPrinter)
-            ns_or_class = self
-            while ns_or_class:
-                name = ns_or_class.node.attributes.get("name", "")
-                assert name
-                full_name.insert(0, name)
-                ns_or_class = ns_or_class.find_parent(ns_or_class_cond)
-            # FIXME Is the following okay? Also ns_or_class_cond is wrong.
-            self.context.index["::".join(full_name)] = self.context.options.header_output_filepath()
-        #endif
-
-        # Reset section before source generation starts.
-        with switch_section(SECTION_NONE):
-            pass
-
-        if self.context.in_phase(PHASE_SOURCE_GEN):
-            if data.node_attrs.cpp.pimpl:
-                # Declare pimpl class.
-                self.context.begin_phase(PHASE_CLASS_PIMPL_DECL)
-                self.writeln("class ", data.node_attrs.name, "::Impl")
-                self.writeln("{")
-
-                generate_content([ PHASE_CLASS_MEMBER_GETTER,
-                                   PHASE_CLASS_MEMBER_CONST_GETTER,
-                                   PHASE_CLASS_MEMBER_SETTER ])
-
-                with switch_section(SECTION_NONE):
-                    pass
-
-                generate_content([ PHASE_CLASS_MEMBER_PUBLIC_VARIABLE,
-                                   PHASE_CLASS_MEMBER_PROTECTED_VARIABLE,
-                                   PHASE_CLASS_MEMBER_PRIVATE_VARIABLE ])
-
-                self.writeln("};")
-                self.context.end_phase(PHASE_CLASS_PIMPL_DECL)
-
-                # Implement pimpl class methods.
-                self.context.begin_phase(PHASE_CLASS_PIMPL_IMPL)
-
-                generate_content([ PHASE_CLASS_MEMBER_GETTER,
-                                   PHASE_CLASS_MEMBER_CONST_GETTER,
-                                   PHASE_CLASS_MEMBER_SETTER ])
-
-                self.context.end_phase(PHASE_CLASS_PIMPL_IMPL)
-            #endif
+        cls = ir.Class(name, None, self.node.attributes.get("is_struct", False), pimpl)
+        cls.members = [ printer.declaration() for printer in self.printers ]
+        initializers = [ member.initializer for member in cls.members if member.initializer is not None ]
 
-            self.context.begin_phase(PHASE_CLASS_IMPL)
-
-            # Constructor & destructor.
-            if data.node_attrs.cpp.pimpl:
-                self.writeln("{name}::{name}()".format(name=data.node_attrs.name))
-
-                self.context.begin_phase(PHASE_CLASS_MEMBER_INIT)
-                written = False
-                def set_written():
-                    nonlocal written
-                    written = True
-                #enddef
-                with self.write("  : ", mode=Printer.WRITE_MODE_TEMPTING, after_write=set_written):
-                    for printer in self.printers:
-                        with self.write(",\n    ", mode=Printer.WRITE_MODE_TEMPTING) if written else nullcontext():
-                            # TODO Update finished flag.
-                            printer.generate()
-                    with self.write(",\n    ", mode=Printer.WRITE_MODE_TEMPTING) if written else nullcontext():
-                        self.writeln("m_impl(new Impl)")
-                #endwith
-                self.context.end_phase(PHASE_CLASS_MEMBER_INIT)
-
-                self.writeln("{")
-                self.writeln("}")
-                self.writeln("{name}::~{name}()".format(name=data.node_attrs.name))
-                self.writeln("{")
-                self.writeln("  delete m_impl;")
-                self.writeln("  m_impl = nullptr;")
-                self.writeln("}")
-            else:
-                self.writeln("{name}::{name}()".format(name=data.node_attrs.name))
-
-                self.context.begin_phase(PHASE_CLASS_MEMBER_INIT)
-                written = False
-                def set_written():
-                    nonlocal written
-                    written = True
-                #enddef
-                with self.write("  : ", mode=Printer.WRITE_MODE_TEMPTING, after_write=set_written):
-                    for printer in self.printers:
-                        with self.write(",\n    ", mode=Printer.WRITE_MODE_TEMPTING) if written else nullcontext():
-                            # TODO Update finished flag.
-                            printer.generate()
-                #endwith
-                self.context.end_phase(PHASE_CLASS_MEMBER_INIT)
-
-                self.writeln("{")
-                self.writeln("}")
-                self.writeln("{name}::~{name}()".format(name=data.node_attrs.name))
-                self.writeln("{")
-                self.writeln("}")
-            #endif
-
-            generate_content([ PHASE_CLASS_MEMBER_GETTER,
-                               PHASE_CLASS_MEMBER_CONST_GETTER,
-                               PHASE_CLASS_MEMBER_SETTER ])
+        # Constructor & destructor.
+        if pimpl:
+            cls.constructors.append(ir.Constructor(initializers=initializers + [ "m_impl(new Impl)" ]))
+            cls.destructor = ir.Destructor(True, [ "delete m_impl;", "m_impl = nullptr;" ])
+        else:
+            cls.constructors.append(ir.Constructor(initializers=initializers))
+            cls.destructor = ir.Destructor(True)
 
-            self.context.end_phase(PHASE_CLASS_IMPL)
+        full_name = []
+        ns_or_class_cond = \
+                lambda p: isinstance(p, NamespacePrinter) or isinstance(p, ClassPrinter)
+        ns_or_class = self
+        while ns_or_class:
+            name = ns_or_class.node.attributes.get("name", "")
+            assert name
+            full_name.insert(0, name)
+            ns_or_class = ns_or_class.find_parent(ns_or_class_cond)
+        # FIXME Is the following okay? Also ns_or_class_cond is wrong.
+        self.context.index["::".join(full_name)] = self.context.options.header_output_filepath()
 
-        return data.finished_flag
+        return cls
     #enddef
 
 #endclass
@@ -1311,18 +1418,11 @@ class ClassMemberPrinter(NodePrinter):
     def __init__(self, node, context, parent_printer):
         super(ClassMemberPrinter, self).__init__(node, context, parent_printer)
 
-        self._base_type = refine_cpp_type(node.attributes.get("type", []))
-        self._base_type_is_fundamental = isinstance(self._base_type, str)
+        self._base_type = self.context.types.refine(node.attributes.get("type", []))
+        self._base_type_is_fundamental = self._base_type.is_fundamental
         self._full_type = self._base_type if self._base_type_is_fundamental else self.resolve_type(self._base_type)
-        def determine_type_treatment():
-            if self._base_type_is_fundamental:
-                return TYPE_TREATMENT_VALUE
-            else:
-                full_type_str = "::".join(self._full_type)
-                assert full_type_str in cpp_types
-                return cpp_types[full_type_str].get("treatment", TYPE_TREATMENT_REFERENCE)
-        #enddef
-        self._type_treatment = determine_type_treatment()
+        assert self._full_type.spelling in self.context.types or self._base_type_is_fundamental
+        self._type_treatment = self._full_type.treatment
         self._is_repeated = node.attributes.get("is_repeated", False)
         self._is_ref = node.attributes.get("is_ref", False)
     #enddef
@@ -1337,13 +1437,7 @@ class ClassMemberPrinter_Property(ClassMemberPrinter):
         if not self._base_type_is_fundamental:
             self.context.used_types.add(self._base_type, self)
 
-        if isinstance(self._base_type, str):
-            base_type_str = self._base_type
-        else:
-            base_type_str = "::".join(self._base_type)
-            if base_type_str in to_cpp_type_map:
-                base_type_str = "::".join(to_cpp_type_map[base_type_str])
-        #endif
+        base_type_str = self.context.types.map_basic(self._base_type).spelling
 
         if self._type_treatment == TYPE_TREATMENT_VALUE:
             if self._is_repeated:
@@ -1374,29 +1468,12 @@ class ClassMemberPrinter_Property(ClassMemberPrinter):
                         self._type_treatment, self._is_repeated))
     #enddef
 
-    def generate(self):
-        finished_flag = PRINTER_FINISHED
-
-        def generate_class_decl():
-            if self.context.in_phase(PHASE_CLASS_MEMBER_PUBLIC_VARIABLE):
-                # TODO Initialization (default value).
-                self.writeln("  {} {};".format(self._type_str, self.node.attributes.get("name", "")))
-        #enddef
-
-        def generate_class_impl():
-            if self._is_ref:
-              return
-
-            if self.context.in_phase(PHASE_CLASS_MEMBER_INIT):
-                self.write('{0}(*this, "{0}")'.format(self.node.attributes.get("name", "")))
-        #enddef
-
-        if self.context.in_phase(PHASE_CLASS_DECL):
-            generate_class_decl()
-        elif self.context.in_phase(PHASE_CLASS_IMPL):
-            generate_class_impl()
+    def build(self):
+        from . import ir
 
-        return finished_flag
+        name = self.node.attributes.get("name", "")
+        initializer = None if self._is_ref else '{0}(*this, "{0}")'.format(name)
+        return ir.Property(name, self._type_str, initializer)
     #enddef
 
 #endclass
@@ -1406,8 +1483,8 @@ class ClassMemberPrinter_GetterSetter(ClassMemberPrinter):
     def __init__(self, node, context, parent_printer):
         super(ClassMemberPrinter_GetterSetter, self).__init__(node, context, parent_printer)
 
-        base_type_is_fundamental = isinstance(self._base_type, str) # TODO Test the string properly for Python 2 and 3
-        base_type_str = self._base_type if base_type_is_fundamental else "::".join(self._base_type)
+        base_type_is_fundamental = self._base_type_is_fundamental
+        base_type_str = self._base_type.spelling
         self._type_is_fundamental = not self._is_repeated and base_type_is_fundamental
         self._type_str = "std::vector<{}>".format(base_type_str) if self._is_repeated else base_type_str
         self._default_value = "" if not self._type_is_fundamental else "false" if self._type_str == "bool" else "0"
@@ -1418,321 +1495,15 @@ class ClassMemberPrinter_GetterSetter(ClassMemberPrinter):
             self.context.used_types.add([ "std", "vector" ])
     #enddef
 
-    def generate(self):
-        finished_flag = PRINTER_FINISHED
+    def build(self):
+        from . import ir
 
         pimpl = self.node.attributes.get("cpp", {}).get("pimpl", None)
         if pimpl is None:
             pimpl = self.parent.node.attributes.get("cpp", {}).get("pimpl", False)
 
-        def generate_class_decl():
-            if self._type_is_fundamental:
-                if self.context.current_phase == PHASE_CLASS_MEMBER_GETTER:
-                    pass
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_CONST_GETTER:
-                    # TODO Use format() in a better way (arguments could be preparend in advance).
-                    # TODO Use ''' style string.
-                    self.writeln("  {} {}() const;".format(self._type_str, self.node.attributes.get("name", "")))
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_SETTER:
-                    # TODO Also consider R-value for move semantic.
-                    self.writeln("  void {}({} value);".format(self.node.attributes.get("name", ""), self._type_str))
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_PRIVATE_VARIABLE:
-                    if not pimpl:
-                        # TODO Initialization (default value).
-                        self.write("  {} m_{}".format(self._type_str, self.node.attributes.get("name", "")))
-                        if self._default_value:
-                            self.write(" = {}".format(self._default_value))
-                        self.writeln(";")
-                else:
-                    raise Exception("ClassMemberPrinter_GetterSetter used in unsupported phase ({})".format(self.context.current_phase))
-            else:
-                if self.context.current_phase == PHASE_CLASS_MEMBER_GETTER:
-                    # TODO Use format() in a better way (arguments could be preparend in advance).
-                    # TODO Use ''' style string.
-                    self.writeln("  {}& {}();".format(self._type_str, self.node.attributes.get("name", "")))
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_CONST_GETTER:
-                    self.writeln("  const {}& {}() const;".format(self._type_str, self.node.attributes.get("name", "")))
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_SETTER:
-                    # TODO Also consider R-value for move semantic.
-                    self.writeln("  void {}({} value);".format(self.node.attributes.get("name", ""), self._type_str))
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_PRIVATE_VARIABLE:
-                    if not pimpl:
-                        # TODO Initialization (default value).
-                        self.writeln("  {} m_{};".format(self._type_str, self.node.attributes.get("name", "")))
-                else:
-                    raise Exception("ClassMemberPrinter_GetterSetter used in unsupported phase ({})".format(self.context.current_phase))
-        #enddef
-
-        def generate_class_impl():
-            if self._type_is_fundamental:
-                if self.context.current_phase == PHASE_CLASS_MEMBER_GETTER:
-                    pass
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_CONST_GETTER:
-                    # TODO Distinguish between types ('value' vs. 'reference' type).
-                    # TODO Use format() in a better way (arguments could be preparend in advance).
-                    # TODO Use ''' style string.
-                    self.writeln("{} {}::{}() const".format(self._type_str, self.parent.node.attributes.get("name", ""), self.node.attributes.get("name", "")))
-                    self.writeln("{")
-                    if not pimpl:
-                        self.writeln("  return m_{};".format(self.node.attributes.get("name", "")))
-                    else:
-                        self.writeln("  return m_impl->{}();".format(self.node.attributes.get("name", "")))
-                    self.writeln("}")
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_SETTER:
-                    # TODO Also consider R-value for move semantic.
-                    self.writeln("void {}::{}({} value)".format(self.parent.node.attributes.get("name", ""), self.node.attributes.get("name", ""), self._type_str))
-                    self.writeln("{")
-                    if not pimpl:
-                        self.writeln("  m_{} = value;".format(self.node.attributes.get("name", "")))
-                    else:
-                        self.writeln("  m_impl->{}(value);".format(self.node.attributes.get("name", "")))
-                    self.writeln("}")
-                else:
-                    raise Exception("ClassMemberPrinter_GetterSetter used in unsupported phase ({})".format(self.context.current_phase))
-            else:
-                if self.context.current_phase == PHASE_CLASS_MEMBER_GETTER:
-                    # TODO Distinguish between types ('value' vs. 'reference' type).
-                    # TODO Use format() in a better way (arguments could be preparend in advance).
-                    # TODO Use ''' style string.
-                    self.writeln("{}& {}::{}()".format(self._type_str, self.parent.node.attributes.get("name", ""), self.node.attributes.get("name", "")))
-                    self.writeln("{")
-                    if not pimpl:
-                        self.writeln("  return m_{};".format(self.node.attributes.get("name", "")))
-                    else:
-                        self.writeln("  return m_impl->{}();".format(self.node.attributes.get("name", "")))
-                    self.writeln("}")
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_CONST_GETTER:
-                    self.writeln("const {}& {}::{}() const".format(self._type_str, self.parent.node.attributes.get("name", ""), self.node.attributes.get("name", "")))
-                    self.writeln("{")
-                    if not pimpl:
-                        self.writeln("  return m_{};".format(self.node.attributes.get("name", "")))
-                    else:
-                        self.writeln("  return m_impl->{}();".format(self.node.attributes.get("name", "")))
-                    self.writeln("}")
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_SETTER:
-                    # TODO Also consider R-value for move semantic.
-                    self.writeln("void {}::{}({} value)".format(self.parent.node.attributes.get("name", ""), self.node.attributes.get("name", ""), self._type_str))
-                    self.writeln("{")
-                    if not pimpl:
-                        self.writeln("  m_{} = std::move(value);".format(self.node.attributes.get("name", "")))
-                    else:
-                        self.writeln("  m_impl->{}(std::move(value));".format(self.node.attributes.get("name", "")))
-                    self.writeln("}")
-                else:
-                    raise Exception("ClassMemberPrinter_GetterSetter used in unsupported phase ({})".format(self.context.current_phase))
-        #enddef
-
-        def generate_pimpl_decl():
-            if not pimpl:
-                return
-
-            if self._type_is_fundamental:
-                if self.context.current_phase == PHASE_CLASS_MEMBER_GETTER:
-                    pass
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_CONST_GETTER:
-                    self.writeln("  {} {}() const;".format(self._type_str, self.node.attributes.get("name", "")))
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_SETTER:
-                    self.writeln("  void {}({} value);".format(self.node.attributes.get("name", ""), self._type_str))
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_PRIVATE_VARIABLE:
-                    self.write("  {} m_{}".format(self._type_str, self.node.attributes.get("name", "")))
-                    if self._default_value:
-                        self.write(" = {}".format(self._default_value))
-                    self.writeln(";")
-                else:
-                    raise Exception("ClassMemberPrinter_GetterSetter used in unsupported phase ({})".format(self.context.current_phase))
-            else:
-                if self.context.current_phase == PHASE_CLASS_MEMBER_GETTER:
-                    self.writeln("  {}& {}();".format(self._type_str, self.node.attributes.get("name", "")))
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_CONST_GETTER:
-                    pass
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_SETTER:
-                    self.writeln("  void {}({} value);".format(self.node.attributes.get("name", ""), self._type_str))
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_PRIVATE_VARIABLE:
-                    self.writeln("  {} m_{};".format(self._type_str, self.node.attributes.get("name", "")))
-                else:
-                    raise Exception("ClassMemberPrinter_GetterSetter used in unsupported phase ({})".format(self.context.current_phase))
-        #enddef
-
-        def generate_pimpl_impl():
-            if not pimpl:
-                return
-
-            if self._type_is_fundamental:
-                if self.context.current_phase == PHASE_CLASS_MEMBER_GETTER:
-                    pass
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_CONST_GETTER:
-                    self.writeln("{} {}::Impl::{}() const".format(self._type_str, self.parent.node.attributes.get("name", ""), self.node.attributes.get("name", "")))
-                    self.writeln("{")
-                    self.writeln("  return m_{};".format(self.node.attributes.get("name", "")))
-                    self.writeln("}")
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_SETTER:
-                    self.writeln("void {}::Impl::{}({} value)".format(self.parent.node.attributes.get("name", ""), self.node.attributes.get("name", ""), self._type_str))
-                    self.writeln("{")
-                    self.writeln("  m_{} = value;".format(self.node.attributes.get("name", "")))
-                    self.writeln("}")
-                else:
-                    raise Exception("ClassMemberPrinter_GetterSetter used in unsupported phase ({})".format(self.context.current_phase))
-            else:
-                if self.context.current_phase == PHASE_CLASS_MEMBER_GETTER:
-                    self.writeln("{}& {}::Impl::{}()".format(self._type_str, self.parent.node.attributes.get("name", ""), self.node.attributes.get("name", "")))
-                    self.writeln("{")
-                    self.writeln("  return m_{};".format(self.node.attributes.get("name", "")))
-                    self.writeln("}")
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_CONST_GETTER:
-                    pass
-                elif self.context.current_phase == PHASE_CLASS_MEMBER_SETTER:
-                    self.writeln("void {}::Impl::{}({} value)".format(self.parent.node.attributes.get("name", ""), self.node.attributes.get("name", ""), self._type_str))
-                    self.writeln("{")
-                    self.writeln("  m_{} = std::move(value);".format(self.node.attributes.get("name", "")))
-                    self.writeln("}")
-                else:
-                    raise Exception("ClassMemberPrinter_GetterSetter used in unsupported phase ({})".format(self.context.current_phase))
-        #enddef
-
-        if self.context.in_phase(PHASE_CLASS_DECL):
-            generate_class_decl()
-        elif self.context.in_phase(PHASE_CLASS_IMPL):
-            generate_class_impl()
-        elif self.context.in_phase(PHASE_CLASS_PIMPL_DECL):
-            generate_pimpl_decl()
-        elif self.context.in_phase(PHASE_CLASS_PIMPL_IMPL):
-            generate_pimpl_impl()
-
-        return finished_flag
-    #enddef
-
-#endclass
-
-class Generator(codemodel.ClassDiagramVisitor):
-
-    class RootPrinter(Printer):
-
-        def __init__(self, context):
-            super(Generator.RootPrinter, self).__init__(context, None)
-        #enddef
-
-        def generate(self):
-            if self.printers:
-                for phase in [ PHASE_HEADER_GEN, PHASE_SOURCE_GEN ]:
-
-                    finished_flag = PRINTER_FINISHED
-
-                    self.context.begin_phase(phase)
-
-                    for printer in self.printers:
-                        finished_flag &= printer.generate()
-
-                    self.context.end_phase(phase)
-
-                    if finished_flag == PRINTER_FINISHED:
-                        break
-                #endfor
-            #endif
-
-            return PRINTER_FINISHED
-        #enddef
-
-    #endclass
-
-    def __init__(self):
-        super(Generator, self).__init__()
-
-        self.__context = None
-        self.__printers_stack = []
-    #enddef
-
-    def run(self, node, args=None):
-        with self.__ensure_context(args):
-            logging.info("Processing class diagram, creating printers tree...")
-            node.accept(self)
-            logging.info("Printers tree created.")
-
-            assert len(self.__printers_stack) == 1
-            root_printer = self.__printers_stack.pop()
-            assert isinstance(root_printer, Generator.RootPrinter)
-            logging.info("Generating code...")
-            root_printer.generate()
-            logging.info("Code generation finished.")
-    #enddef
-
-    def visit_package(self, node):
-
-        # Package doesn't have to have name, it can only serve the purpose of encapsulating
-        # a bunch of nodes into a logical unit (as in the case of a top-level packages).
-        if node.attributes.get("name", ""):
-            self.__ensure_root_printer()
-
-            assert self.__top_printer()
-            printer = NamespacePrinter(node, self.__context, self.__top_printer())
-
-            self.__printers_stack.append(printer)
-            super(Generator, self).visit_package(node)
-            self.__printers_stack.pop()
-        else:
-            def create_root_printer():
-                root_printer = self.__create_root_printer()
-                FileHeaderPrinter(self.__context, root_printer)
-                return root_printer
-            #enddef
-
-            # Get into about types used in the class diagram.
-            for cm_full_type, cm_info in node.attributes.get("using", {}).items():
-                cpp_full_type = "::".join(cm_full_type.split("."))
-                if cpp_full_type in cpp_types:
-                    cpp_info = cpp_types[cpp_full_type]
-                    if "treatment" in cm_info:
-                        cpp_info["treatment"] = cm_info["treatment"]
-            #endfor
-
-            self.__ensure_root_printer(create_root_printer)
-            super(Generator, self).visit_package(node)
-    #enddef
-
-    def visit_class(self, node):
-        self.__ensure_root_printer()
-
-        assert self.__top_printer()
-        printer = ClassPrinterAsComposite(node, self.__context, self.__top_printer())
-
-        self.__printers_stack.append(printer)
-        super(Generator, self).visit_class(node)
-        self.__printers_stack.pop()
-    #enddef
-
-    def visit_attribute(self, node):
-        self.__ensure_root_printer()
-
-        assert self.__top_printer()
-        # FIXME This won't be always true. Parent printer probablu know what printer
-        # to instanitate.
-        printer = ClassMemberPrinter_Property(node, self.__context, self.__top_printer())
-
-        self.__printers_stack.append(printer)
-        super(Generator, self).visit_attribute(node)
-        self.__printers_stack.pop()
-    #enddef
-
-    @contextmanager
-    def __ensure_context(self, args):
-        with Context(Options(args)) as context:
-            self.__context = context
-            yield
-            self.__context = None
-    #enddef
-
-    def __ensure_root_printer(self, root_printer_create=None):
-        if not self.__printers_stack:
-            root_printer = root_printer_create() if root_printer_create is not None \
-                    else self.__create_root_printer()
-            self.__printers_stack.append(root_printer)
-    #enddef
-
-    def __create_root_printer(self):
-        return Generator.RootPrinter(self.__context)
-    #enddef
-
-    def __top_printer(self):
-        return self.__printers_stack[-1] if self.__printers_stack else None
+        return ir.Accessors(self.node.attributes.get("name", ""), self._type_str,
+                self._type_is_fundamental, self._default_value, pimpl)
     #enddef
 
 #endclass
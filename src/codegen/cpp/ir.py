@@ -0,0 +1,102 @@
+"""Intermediate representation of the generated C++ code.
+
+Printers build the representation from the class diagram, i.e. they resolve the types, collect
+the includes and make all the decisions about what is generated. The representation is then
+turned into text by codegen.cpp.render. Declarations are plain data objects, the C++ specific
+texts (types, initializers) are already prepared by the printers."""
+
+class FileHeader(object):
+    """Banner and includes at the beginning of the header and the source."""
+
+    def __init__(self, lines, header_includes, source_includes):
+        self.lines = lines
+        self.header_includes = header_includes
+        self.source_includes = source_includes
+    #enddef
+
+#endclass
+
+class Include(object):
+
+    def __init__(self, path):
+        # Path including the quotes or the angle brackets.
+        self.path = path
+    #enddef
+
+#endclass
+
+class Namespace(object):
+    """Namespace and its declarations. A namespace without name only groups the declarations."""
+
+    def __init__(self, name, full_name, declarations=None):
+        self.name = name
+        self.full_name = full_name
+        self.declarations = declarations if declarations is not None else []
+    #enddef
+
+#endclass
+
+class Class(object):
+
+    def __init__(self, name, base=None, is_struct=False, pimpl=False):
+        self.name = name
+        self.base = base
+        self.is_struct = is_struct
+        self.pimpl = pimpl
+        self.constructors = []
+        self.destructor = None
+        self.members = []
+    #enddef
+
+#endclass
+
+class Constructor(object):
+
+    def __init__(self, parameters="", initializers=None, declared=True, defined=True):
+        self.parameters = parameters
+        self.initializers = initializers if initializers is not None else []
+        self.declared = declared
+        self.defined = defined
+    #enddef
+
+#endclass
+
+class Destructor(object):
+
+    def __init__(self, is_virtual=False, body=None, declared=True, defined=True):
+        self.is_virtual = is_virtual
+        self.body = body if body is not None else []
+        self.declared = declared
+        self.defined = defined
+    #enddef
+
+#endclass
+
+class Property(object):
+    """Public member variable of a property type (for example mad::codegen::ValueProperty<int>).
+    The initializer is None if the property isn't initialized by the constructors."""
+
+    def __init__(self, name, type_str, initializer=None):
+        self.name = name
+        self.type_str = type_str
+        self.initializer = initializer
+    #enddef
+
+#endclass
+
+class Accessors(object):
+    """Private member variable with a getter and a setter. Fundamental types are returned by
+    value and have only the const getter. If pimpl is used, the variable and the accessors'
+    implementation are in the private implementation class."""
+
+    initializer = None
+
+    def __init__(self, name, type_str, is_fundamental, default_value="", pimpl=False):
+        self.name = name
+        self.type_str = type_str
+        self.is_fundamental = is_fundamental
+        self.default_value = default_value
+        self.pimpl = pimpl
+    #enddef
+
+#endclass
@@ -0,0 +1,406 @@
+"""Rendering of the intermediate representation (see codegen.cpp.ir) into C++ text."""
+
+from . import ir
+from .generator import Sink
+
+# Parts of a class the fragments are emitted into.
+PART_CLASS_DECL = 1
+PART_CLASS_IMPL = 2
+PART_PIMPL_DECL = 3
+PART_PIMPL_IMPL = 4
+
+# Kinds of the fragments, the fragments of a kind are put together in a part of a class.
+FRAGMENT_GETTER = 1
+FRAGMENT_CONST_GETTER = 2
+FRAGMENT_SETTER = 3
+FRAGMENT_PUBLIC_VARIABLE = 4
+FRAGMENT_PROTECTED_VARIABLE = 5
+FRAGMENT_PRIVATE_VARIABLE = 6
+
+SECTION_NONE = 0
+SECTION_PUBLIC = 1
+SECTION_PROTECTED = 2
+SECTION_PRIVATE = 3
+
+METHOD_KINDS = [ FRAGMENT_GETTER,
+                 FRAGMENT_CONST_GETTER,
+                 FRAGMENT_SETTER ]
+
+VARIABLE_KINDS = [ FRAGMENT_PUBLIC_VARIABLE,
+                   FRAGMENT_PROTECTED_VARIABLE,
+                   FRAGMENT_PRIVATE_VARIABLE ]
+
+# Sections of the variables of the fragment kinds in the class declaration.
+VARIABLE_SECTIONS = { FRAGMENT_PUBLIC_VARIABLE: SECTION_PUBLIC,
+                      FRAGMENT_PROTECTED_VARIABLE: SECTION_PROTECTED,
+                      FRAGMENT_PRIVATE_VARIABLE: SECTION_PRIVATE }
+
+SECTION_LABELS = { SECTION_PUBLIC: "public:",
+                   SECTION_PROTECTED: "protected:",
+                   SECTION_PRIVATE: "private:" }
+
+class NoSwitch(object):
+    """Context manager of a section switch which doesn't write anything."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+    #enddef
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+    #enddef
+
+#endclass
+
+NO_SWITCH = NoSwitch()
+
+class Sections(object):
+    """Access section of the class being rendered. Switching to another section writes its
+    label as a tempting write, so the label stays only if anything is written in the section
+    (see TemptingWrite). The section changes only if the label stays. The object itself is the
+    context manager of the pending switch, so nothing is allocated per switch besides the
+    tempting write."""
+
+    __slots__ = ("__section", "__tempting_write", "__pending_section")
+
+    def __init__(self):
+        self.__section = SECTION_NONE
+        self.__tempting_write = None
+        self.__pending_section = SECTION_NONE
+    #enddef
+
+    def reset(self):
+        assert self.__tempting_write is None
+        self.__section = SECTION_NONE
+    #enddef
+
+    def switch(self, out, section):
+        """Returns a context manager, the content of the section has to be written within it."""
+        assert self.__tempting_write is None
+        if section == self.__section:
+            return NO_SWITCH
+
+        self.__tempting_write = out.writeln(SECTION_LABELS[section], mode=Sink.WRITE_MODE_TEMPTING)
+        self.__pending_section = section
+        return self
+    #enddef
+
+    def __enter__(self):
+        return self
+    #enddef
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        tempting_write, self.__tempting_write = self.__tempting_write, None
+        tempting_write.__exit__(exc_type, exc_value, traceback)
+        if tempting_write.committed:
+            self.__section = self.__pending_section
+    #enddef
+
+#endclass
+
+class ClassFragments(object):
+    """Fragments of a class generated by its members. Every member emits all its fragments in
+    a single pass, each of them into a sink identified by the part of the class (for example
+    PART_CLASS_DECL) and the kind of the fragment (for example FRAGMENT_GETTER). The class is
+    then put together from the fragments in the right order."""
+
+    def __init__(self):
+        self.__sinks = {}
+    #enddef
+
+    def sink(self, part, kind):
+        key = (part, kind)
+        sink = self.__sinks.get(key, None)
+        if sink is None:
+            sink = self.__sinks[key] = Sink()
+        return sink
+    #enddef
+
+    def get(self, part, kind):
+        """Returns the sink of the fragment or None if nothing was emitted into it."""
+        return self.__sinks.get((part, kind), None)
+    #enddef
+
+#endclass
+
+class Renderer(object):
+    """Renders declarations into the header and the source sinks."""
+
+    def __init__(self, header, source):
+        self.__header = header
+        self.__source = source
+        self.__renderers = {
+            ir.FileHeader: self.__render_file_header,
+            ir.Namespace: self.__render_namespace,
+            ir.Class: self.__render_class
+        }
+        self.__member_renderers = {
+            ir.Property: self.__render_property,
+            ir.Accessors: self.__render_accessors
+        }
+        self.__sections = Sections()
+    #enddef
+
+    def render(self, declarations):
+        """Renders the declarations. Returns whether the source is needed, i.e. whether there
+        is anything to implement."""
+        source_needed = False
+        for declaration in declarations:
+            source_needed |= self.__renderers[type(declaration)](declaration)
+        return source_needed
+    #enddef
+
+    def __render_file_header(self, file_header):
+        header, source = self.__header, self.__source
+
+        header.writeln("#pragma once")
+
+        width = max(len(ln) for ln in file_header.lines)
+        for out in [ header, source ]:
+            out.writeln("// ", "=" * width)
+            for ln in file_header.lines:
+                out.writeln("// ", ln)
+            out.writeln("// ", "=" * width)
+        #endfor
+
+        for include in file_header.header_includes:
+            header.writeln("#include ", include.path)
+        for include in file_header.source_includes:
+            source.writeln("#include ", include.path)
+
+        return False
+    #enddef
+
+    def __render_namespace(self, namespace):
+        header, source = self.__header, self.__source
+
+        if namespace.name:
+            header.writeln("namespace ", namespace.name, " {")
+            source.writeln("namespace ", namespace.name, " {")
+
+        source_needed = self.render(namespace.declarations)
+
+        if namespace.name:
+            header.writeln("} // namespace ", namespace.full_name)
+            source.writeln("} // namespace ", namespace.full_name)
+
+        return source_needed
+    #enddef
+
+    def __render_class(self, cls):
+        header, source = self.__header, self.__source
+
+        sections = self.__sections
+        sections.reset()
+
+        # Every member emits all its fragments in a single pass.
+        fragments = ClassFragments()
+        for member in cls.members:
+            self.__member_renderers[type(member)](member, cls, fragments)
+
+        def write_fragments(out, part, kinds):
+            declaration = part == PART_CLASS_DECL or part == PART_PIMPL_DECL
+            for kind in kinds:
+                fragment = fragments.get(part, kind)
+                if fragment is None:
+                    continue
+
+                section = VARIABLE_SECTIONS.get(kind, SECTION_NONE) if declaration else SECTION_NONE
+                if section == SECTION_NONE:
+                    out.write_sink(fragment)
+                else:
+                    with sections.switch(out, section):
+                        out.write_sink(fragment)
+            #endfor
+        #enddef
+
+        # Declaration.
+        header.write("struct " if cls.is_struct else "class ", cls.name)
+        if cls.base:
+            header.write(" : public ", cls.base)
+        header.writeln()
+        header.writeln("{")
+
+        with sections.switch(header, SECTION_PUBLIC):
+            for constructor in cls.constructors:
+                if constructor.declared:
+                    header.writeln("  {}({});".format(cls.name, constructor.parameters))
+            if cls.destructor is not None and cls.destructor.declared:
+                header.writeln("  {}~{}();".format("virtual " if cls.destructor.is_virtual else "", cls.name))
+        #endwith
+
+        write_fragments(header, PART_CLASS_DECL, METHOD_KINDS)
+
+        # Put member variables in a seperate public/protected/private sections.
+        sections.reset()
+
+        write_fragments(header, PART_CLASS_DECL, VARIABLE_KINDS)
+
+        # Add private implementation member if needed.
+        if cls.pimpl:
+            with sections.switch(header, SECTION_PRIVATE):
+                header.writeln("  class Impl;")
+                header.writeln("  Impl* m_impl = nullptr;")
+
+        header.writeln("};")
+
+        # Reset section before the source part starts.
+        sections.reset()
+
+        if cls.pimpl:
+            # Declare pimpl class.
+            source.writeln("class ", cls.name, "::Impl")
+            source.writeln("{")
+
+            write_fragments(source, PART_PIMPL_DECL, METHOD_KINDS)
+
+            sections.reset()
+
+            write_fragments(source, PART_PIMPL_DECL, VARIABLE_KINDS)
+
+            source.writeln("};")
+
+            # Implement pimpl class methods.
+            write_fragments(source, PART_PIMPL_IMPL, METHOD_KINDS)
+        #endif
+
+        # Constructors & destructor.
+        for constructor in cls.constructors:
+            if not constructor.defined:
+                continue
+
+            source.writeln("{0}::{0}({1})".format(cls.name, constructor.parameters))
+            if constructor.initializers:
+                source.writeln("  : ", ",\n    ".join(constructor.initializers))
+            source.writeln("{")
+            source.writeln("}")
+        #endfor
+
+        if cls.destructor is not None and cls.destructor.defined:
+            source.writeln("{0}::~{0}()".format(cls.name))
+            source.writeln("{")
+            for ln in cls.destructor.body:
+                source.writeln("  ", ln)
+            source.writeln("}")
+        #endif
+
+        write_fragments(source, PART_CLASS_IMPL, METHOD_KINDS)
+
+        return True
+    #enddef
+
+    def __render_property(self, prop, cls, fragments):
+        # TODO Initialization (default value).
+        fragments.sink(PART_CLASS_DECL, FRAGMENT_PUBLIC_VARIABLE) \
+                .writeln("  {} {};".format(prop.type_str, prop.name))
+    #enddef
+
+    def __render_accessors(self, accessors, cls, fragments):
+        name = accessors.name
+        type_str = accessors.type_str
+        pimpl = accessors.pimpl
+
+        def render_class_decl(sink):
+            if accessors.is_fundamental:
+                sink(FRAGMENT_CONST_GETTER).writeln("  {} {}() const;".format(type_str, name))
+                # TODO Also consider R-value for move semantic.
+                sink(FRAGMENT_SETTER).writeln("  void {}({} value);".format(name, type_str))
+                if not pimpl:
+                    variable = sink(FRAGMENT_PRIVATE_VARIABLE)
+                    variable.write("  {} m_{}".format(type_str, name))
+                    if accessors.default_value:
+                        variable.write(" = {}".format(accessors.default_value))
+                    variable.writeln(";")
+            else:
+                sink(FRAGMENT_GETTER).writeln("  {}& {}();".format(type_str, name))
+                sink(FRAGMENT_CONST_GETTER).writeln("  const {}& {}() const;".format(type_str, name))
+                # TODO Also consider R-value for move semantic.
+                sink(FRAGMENT_SETTER).writeln("  void {}({} value);".format(name, type_str))
+                if not pimpl:
+                    sink(FRAGMENT_PRIVATE_VARIABLE).writeln("  {} m_{};".format(type_str, name))
+        #enddef
+
+        def render_class_impl(sink):
+            # TODO Distinguish between types ('value' vs. 'reference' type).
+            if not accessors.is_fundamental:
+                getter = sink(FRAGMENT_GETTER)
+                getter.writeln("{}& {}::{}()".format(type_str, cls.name, name))
+                getter.writeln("{")
+                if not pimpl:
+                    getter.writeln("  return m_{};".format(name))
+                else:
+                    getter.writeln("  return m_impl->{}();".format(name))
+                getter.writeln("}")
+            #endif
+
+            const_getter = sink(FRAGMENT_CONST_GETTER)
+            if accessors.is_fundamental:
+                const_getter.writeln("{} {}::{}() const".format(type_str, cls.name, name))
+            else:
+                const_getter.writeln("const {}& {}::{}() const".format(type_str, cls.name, name))
+            const_getter.writeln("{")
+            if not pimpl:
+                const_getter.writeln("  return m_{};".format(name))
+            else:
+                const_getter.writeln("  return m_impl->{}();".format(name))
+            const_getter.writeln("}")
+
+            # TODO Also consider R-value for move semantic.
+            value = "value" if accessors.is_fundamental else "std::move(value)"
+            setter = sink(FRAGMENT_SETTER)
+            setter.writeln("void {}::{}({} value)".format(cls.name, name, type_str))
+            setter.writeln("{")
+            if not pimpl:
+                setter.writeln("  m_{} = {};".format(name, value))
+            else:
+                setter.writeln("  m_impl->{}({});".format(name, value))
+            setter.writeln("}")
+        #enddef
+
+        def render_pimpl_decl(sink):
+            if accessors.is_fundamental:
+                sink(FRAGMENT_CONST_GETTER).writeln("  {} {}() const;".format(type_str, name))
+            else:
+                sink(FRAGMENT_GETTER).writeln("  {}& {}();".format(type_str, name))
+            sink(FRAGMENT_SETTER).writeln("  void {}({} value);".format(name, type_str))
+
+            variable = sink(FRAGMENT_PRIVATE_VARIABLE)
+            variable.write("  {} m_{}".format(type_str, name))
+            if accessors.is_fundamental and accessors.default_value:
+                variable.write(" = {}".format(accessors.default_value))
+            variable.writeln(";")
+        #enddef
+
+        def render_pimpl_impl(sink):
+            if accessors.is_fundamental:
+                const_getter = sink(FRAGMENT_CONST_GETTER)
+                const_getter.writeln("{} {}::Impl::{}() const".format(type_str, cls.name, name))
+                const_getter.writeln("{")
+                const_getter.writeln("  return m_{};".format(name))
+                const_getter.writeln("}")
+            else:
+                getter = sink(FRAGMENT_GETTER)
+                getter.writeln("{}& {}::Impl::{}()".format(type_str, cls.name, name))
+                getter.writeln("{")
+                getter.writeln("  return m_{};".format(name))
+                getter.writeln("}")
+            #endif
+
+            value = "value" if accessors.is_fundamental else "std::move(value)"
+            setter = sink(FRAGMENT_SETTER)
+            setter.writeln("void {}::Impl::{}({} value)".format(cls.name, name, type_str))
+            setter.writeln("{")
+            setter.writeln("  m_{} = {};".format(name, value))
+            setter.writeln("}")
+        #enddef
+
+        render_class_decl(lambda kind: fragments.sink(PART_CLASS_DECL, kind))
+        render_class_impl(lambda kind: fragments.sink(PART_CLASS_IMPL, kind))
+        if pimpl:
+            render_pimpl_decl(lambda kind: fragments.sink(PART_PIMPL_DECL, kind))
+            render_pimpl_impl(lambda kind: fragments.sink(PART_PIMPL_IMPL, kind))
+    #enddef
+
+#endclass
@@ -0,0 +1,182 @@
+import codemodel
+
+from contextlib import contextmanager
+import logging
+import time
+
+from .generator import Context, Options, Printer, \
+        FileHeaderPrinter, NamespacePrinter, ClassPrinterAsComposite, ClassMemberPrinter_Property, \
+        PHASE_HEADER_GEN, PHASE_SOURCE_GEN
+from .render import Renderer
+
+class Generator(codemodel.ClassDiagramVisitor):
+
+    class RootPrinter(Printer):
+
+        def __init__(self, context):
+            super(Generator.RootPrinter, self).__init__(context, None)
+        #enddef
+
+        def generate(self):
+            if self.printers:
+                # Build the code model first, then render it into the header and the source.
+                start_time = time.perf_counter()
+                declarations = [ printer.declaration() for printer in self.printers ]
+                build_duration = time.perf_counter() - start_time
+
+                start_time = time.perf_counter()
+                header = self.context.output(PHASE_HEADER_GEN)
+                source = self.context.output(PHASE_SOURCE_GEN)
+                source_needed = Renderer(header, source).render(declarations)
+                render_duration = time.perf_counter() - start_time
+
+                logging.info("Code model built in {:.3f} s, rendered in {:.3f} s.".format(build_duration, render_duration))
+
+                self.context.close_output(PHASE_HEADER_GEN)
+
+                # The source is written only if there is anything to implement.
+                if source_needed:
+                    self.context.close_output(PHASE_SOURCE_GEN)
+                else:
+                    self.context.discard_output(PHASE_SOURCE_GEN)
+            #endif
+        #enddef
+
+    #endclass
+
+    def __init__(self):
+        super(Generator, self).__init__()
+
+        self.__context = None
+        self.__printers_stack = []
+        self.__streamed_package = None
+        self.__streamed_nodes = None
+    #enddef
+
+    def run(self, node, args=None, index_context=None, stamp=None, nodes=None):
+        """Generates code for the class diagram node. If nodes are provided, the node has to be
+        a package and the nodes (typically an iterator reading them incrementally) are visited
+        as its content after its own child nodes. The nodes are (node, nodes) tuples, where
+        the nodes are provided the same way for packages and are None otherwise."""
+        with self.__ensure_context(args, index_context, stamp):
+            logging.info("Processing class diagram, creating printers tree...")
+            self.__accept_streamed(node, nodes)
+            logging.info("Printers tree created.")
+
+            assert len(self.__printers_stack) == 1
+            root_printer = self.__printers_stack.pop()
+            assert isinstance(root_printer, Generator.RootPrinter)
+            logging.info("Generating code...")
+            start_time = time.perf_counter()
+            root_printer.generate()
+            duration = time.perf_counter() - start_time
+            logging.info("Code generation finished. ({} characters in {:.3f} s, {:.0f} characters/s)"
+                    .format(self.__context.output_size, duration,
+                            self.__context.output_size / duration if duration > 0 else 0))
+    #enddef
+
+    def visit_package(self, node):
+
+        # Package doesn't have to have name, it can only serve the purpose of encapsulating
+        # a bunch of nodes into a logical unit (as in the case of a top-level packages).
+        if node.attributes.get("name", ""):
+            self.__ensure_root_printer()
+
+            assert self.__top_printer()
+            printer = NamespacePrinter(node, self.__context, self.__top_printer())
+
+            self.__printers_stack.append(printer)
+            self.__visit_package_content(node)
+            self.__printers_stack.pop()
+        else:
+            def create_root_printer():
+                root_printer = self.__create_root_printer()
+                FileHeaderPrinter(self.__context, root_printer)
+                return root_printer
+            #enddef
+
+            # Get into about types used in the class diagram.
+            for cm_full_type, cm_info in node.attributes.get("using", {}).items():
+                cpp_full_type = "::".join(cm_full_type.split("."))
+                cpp_info = self.__context.find_type(cpp_full_type)
+                if cpp_info is not None:
+                    if "treatment" in cm_info:
+                        self.__context.types.update(cpp_full_type, treatment=cm_info["treatment"])
+            #endfor
+
+            self.__ensure_root_printer(create_root_printer)
+            self.__visit_package_content(node)
+    #enddef
+
+    def visit_class(self, node):
+        self.__ensure_root_printer()
+
+        assert self.__top_printer()
+        printer = ClassPrinterAsComposite(node, self.__context, self.__top_printer())
+
+        self.__printers_stack.append(printer)
+        super(Generator, self).visit_class(node)
+        self.__printers_stack.pop()
+
+        # Only the declaration of the complete class is kept, so the class node and its
+        # printers aren't held until the end (that matters when the input is streamed).
+        printer.finish()
+    #enddef
+
+    def visit_attribute(self, node):
+        self.__ensure_root_printer()
+
+        assert self.__top_printer()
+        # FIXME This won't be always true. Parent printer probablu know what printer
+        # to instanitate.
+        printer = ClassMemberPrinter_Property(node, self.__context, self.__top_printer())
+
+        self.__printers_stack.append(printer)
+        super(Generator, self).visit_attribute(node)
+        self.__printers_stack.pop()
+    #enddef
+
+    def __visit_package_content(self, node):
+        super(Generator, self).visit_package(node)
+
+        if node is self.__streamed_package:
+            nodes = self.__streamed_nodes
+            self.__streamed_package = None
+            self.__streamed_nodes = None
+            for child_node, child_nodes in nodes:
+                self.__accept_streamed(child_node, child_nodes)
+    #enddef
+
+    def __accept_streamed(self, node, nodes):
+        if nodes is not None:
+            self.__streamed_package = node
+            self.__streamed_nodes = nodes
+        node.accept(self)
+        if self.__streamed_package is not None:
+            raise RuntimeError("Visiting nodes of a non-package node isn't supported.")
+    #enddef
+
+    @contextmanager
+    def __ensure_context(self, args, index_context, stamp):
+        with Context(Options(args), index_context, stamp) as context:
+            self.__context = context
+            yield
+            self.__context = None
+    #enddef
+
+    def __ensure_root_printer(self, root_printer_create=None):
+        if not self.__printers_stack:
+            root_printer = root_printer_create() if root_printer_create is not None \
+                    else self.__create_root_printer()
+            self.__printers_stack.append(root_printer)
+    #enddef
+
+    def __create_root_printer(self):
+        return Generator.RootPrinter(self.__context)
+    #enddef
+
+    def __top_printer(self):
+        return self.__printers_stack[-1] if self.__printers_stack else None
+    #enddef
+
+#endclass
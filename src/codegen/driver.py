@@ -0,0 +1,297 @@
+import copy
+import logging
+import os
+import sys
+
+LOG_FORMAT = "%(levelname)s %(message)s"
+
+def create_args_parser():
+    import argparse
+
+    args_parser = argparse.ArgumentParser(description="Generate code based on the input.")
+    args_parser.add_argument("-o",  "--output", dest="output", default="", help="output file base name or empty (default) for stdout")
+    args_parser.add_argument("-oh", "--output-header", dest="output_header", default="", help="output header file name (overrides -o)")
+    args_parser.add_argument("-os", "--output-source", dest="output_source", default="", help="output source file name (overrides -o)")
+    args_parser.add_argument("-i",  "--index", dest="index", default="", help="path to the index file, a SQLite database if the extension is .db, .sqlite or .sqlite3")
+    args_parser.add_argument("--lock-timeout", dest="lock_timeout", type=float, default=None, help="maximum time in seconds to wait for the index lock, waits indefinitely by default")
+    args_parser.add_argument("-l",  "--loglevel", dest="loglevel", default="WARNING", help="minimum logging level (DEBUG|INFO|WARNING|ERROR|CRITICAL)")
+    args_parser.add_argument("-b",  "--batch", dest="batch", action="store_true", help="generate separate outputs for every input file, the output base name is the input file name without extension placed in the -o directory (if provided) or next to the input")
+    args_parser.add_argument("-m",  "--manifest", dest="manifest", default="", help="file with input files to process ('-' for stdin), one per line optionally followed by an output base name (implies --batch)")
+    args_parser.add_argument("-j",  "--jobs", dest="jobs", type=int, default=1, help="number of worker processes used in the batch mode, 0 for the number of CPUs (default 1)")
+    args_parser.add_argument("-s",  "--stamp", dest="stamp", action="store_true", help="record a stamp next to the output files and skip the generation if the input, the used index entries, the generator version and the options didn't change since then")
+    args_parser.add_argument("--deterministic-header", dest="deterministic_header", action="store_true", help="don't put the generation time into the generated files, so the same input always produces the same output")
+    args_parser.add_argument("-d",  "--depfile", dest="depfile", default="", help="write a Make/Ninja depfile listing the dependencies of the output files (not available in the batch mode)")
+    args_parser.add_argument("-I",  "--include-dir", dest="include_dirs", action="append", default=[], help="directory where included headers are searched for when writing the depfile, can be repeated")
+    args_parser.add_argument("--stream", dest="stream", action="store_true", help="parse the input incrementally, the nodes of the packages are parsed and processed one by one to reduce memory usage")
+    args_parser.add_argument("input_files", metavar="INPUT_FILE", nargs="*")
+
+    return args_parser
+#enddef
+
+def check_args(args):
+    """Checks and completes the parsed arguments. Returns an error message if they are invalid."""
+    assert args.loglevel
+    if args.loglevel.upper() not in ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]:
+        return "Invalid log level, has to be on of DEBUG, INFO, WARNING, ERROR, CRITICAL."
+
+    if args.manifest:
+        args.batch = True
+
+    if args.batch and (args.output_header or args.output_source):
+        return "Options -oh and -os can't be used in the batch mode."
+
+    if args.batch and args.depfile:
+        return "Option -d can't be used in the batch mode."
+
+    if args.jobs != 1 and not args.batch:
+        return "Option -j can be used only in the batch mode."
+
+    if args.lock_timeout is not None and args.lock_timeout < 0:
+        return "Option --lock-timeout can't be negative."
+
+    return None
+#enddef
+
+def loglevel(args):
+    loglevel = getattr(logging, args.loglevel.upper(), None)
+    assert loglevel is not None
+    return loglevel
+#enddef
+
+def resolve_filepath(args, filepath):
+    """Returns the path the file has to be accessed by, relative paths are relative to args.cwd
+    if provided (see codegen.server) instead of the working directory of the process."""
+    cwd = getattr(args, "cwd", "")
+    return os.path.join(cwd, filepath) if cwd and filepath else filepath
+#enddef
+
+def read_manifest(f):
+    """Reads a batch manifest, every record (see codegen.index.read_records()) contains an input
+    file path optionally followed by an output base name. Returns a list of (input file path,
+    output base name or None) pairs."""
+    from codegen.index import read_records
+
+    entries = []
+    for line_no, parts in read_records(f):
+        if len(parts) > 2 or not all(parts):
+            raise RuntimeError("Invalid manifest entry on line {}, expecting an input file optionally followed by an output base name. ('{}')".format(line_no, "\t".join(parts)))
+
+        entries.append((parts[0], parts[1] if len(parts) > 1 else None))
+    #endfor
+
+    return entries
+#enddef
+
+def default_output_base(input_filepath, output_dir):
+    """Output base name used in the batch mode if not provided explicitly. It's the input file
+    name without extension placed in the output directory or next to the input."""
+    if input_filepath.strip() == "-":
+        return ""
+
+    name = os.path.splitext(os.path.basename(input_filepath))[0]
+    return os.path.join(output_dir if output_dir else os.path.dirname(input_filepath), name)
+#enddef
+
+def make_job_args(args, input_filepath, output_base=None):
+    """Creates arguments for processing a single input file. In the batch mode every input
+    gets its own output pair, otherwise the outputs are shared as specified."""
+    job_args = copy.copy(args)
+    job_args.input_file = input_filepath
+    if args.batch:
+        job_args.output = output_base if output_base is not None \
+                else default_output_base(input_filepath, args.output)
+        job_args.output_header = ""
+        job_args.output_source = ""
+    return job_args
+#enddef
+
+def collect_jobs(args):
+    """Returns a list of arguments for every input file to process."""
+    entries = []
+    if args.manifest:
+        if args.manifest.strip() == "-":
+            entries.extend(read_manifest(sys.stdin))
+        else:
+            with open(resolve_filepath(args, args.manifest), "r") as f:
+                entries.extend(read_manifest(f))
+    #endif
+
+    entries.extend((input_filepath, None) for input_filepath in args.input_files)
+
+    if not entries:
+        entries.append(("-", None))
+
+    if args.batch and [input_filepath for input_filepath, _ in entries].count("-") > 1:
+        raise RuntimeError("The standard input can be processed at most once.")
+
+    return [make_job_args(args, input_filepath, output_base) for input_filepath, output_base in entries]
+#enddef
+
+def read_chunks(filepath, chunk_size=1 << 20):
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+#enddef
+
+def prepare_stamp(args, index_context, input_data):
+    """Returns the up-to-date stamp for the input (or None if stamps aren't used) and whether
+    the outputs are up to date. The input data can be provided in chunks."""
+    if not getattr(args, "stamp", False):
+        return None, False
+
+    from codegen.cpp import Options, Stamp
+    options = Options(args)
+    if not options.stamp_filepath():
+        return None, False
+
+    stamp = Stamp(options, input_data)
+    if index_context is not None and stamp.is_up_to_date(index_context.index):
+        logging.info("Outputs of '{}' are up to date.".format(args.input_file))
+        return stamp, True
+
+    stamp.invalidate()
+    return stamp, False
+#enddef
+
+def process_input_data(raw_data, args, index_context=None, stamp=None):
+    # Read codemodel's class diagram from the input.
+    import codemodel
+
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Input data: " + raw_data)
+    class_diag = codemodel.from_json(raw_data)
+
+    # Run a code generator (only C++ for now).
+    from codegen.cpp import Generator as CppGenerator
+    CppGenerator().run(class_diag, args, index_context, stamp)
+#enddef
+
+def process_input_stream(f, args, index_context=None, stamp=None):
+    """Processes the input incrementally, the packages' nodes are parsed one by one and visited
+    by the generator as they come."""
+    import codemodel
+    import json
+    from codegen.jsonstream import PackageReader
+
+    package, raw_nodes = PackageReader(f).read()
+    class_diag = codemodel.from_json(json.dumps(package))
+
+    def nodes(raw_nodes):
+        for raw_node, raw_child_nodes in raw_nodes:
+            if raw_child_nodes is None:
+                yield codemodel.from_json(raw_node), None
+            else:
+                yield codemodel.from_json(json.dumps(raw_node)), nodes(raw_child_nodes)
+        #endfor
+    #enddef
+
+    # Run a code generator (only C++ for now).
+    from codegen.cpp import Generator as CppGenerator
+    CppGenerator().run(class_diag, args, index_context, stamp, nodes(raw_nodes))
+#enddef
+
+def process_input(args, index_context=None):
+    input_filepath = args.input_file
+    from_stdin = input_filepath.strip() == "-"
+    if not from_stdin:
+        logging.debug("Processing input file '{}'.".format(input_filepath))
+
+    # The input is hashed for the stamp in advance when streamed, it's possible only for files.
+    if getattr(args, "stream", False) and not (from_stdin and getattr(args, "stamp", False)):
+        stamp = None
+        if not from_stdin:
+            stamp, up_to_date = prepare_stamp(args, index_context, read_chunks(resolve_filepath(args, input_filepath)))
+            if up_to_date:
+                return
+
+        if from_stdin:
+            process_input_stream(sys.stdin, args, index_context)
+        else:
+            with open(resolve_filepath(args, input_filepath), "r") as f:
+                process_input_stream(f, args, index_context, stamp)
+        return
+    #endif
+
+    if from_stdin:
+        raw_data = sys.stdin.read()
+    else:
+        with open(resolve_filepath(args, input_filepath), "r") as f:
+            raw_data = f.read()
+
+    stamp, up_to_date = prepare_stamp(args, index_context, raw_data)
+    if up_to_date:
+        return
+
+    process_input_data(raw_data, args, index_context, stamp)
+#enddef
+
+# Index context of a worker process used in the parallel mode. The index snapshot is loaded
+# only once per worker and shared by all the jobs the worker processes.
+_worker_index_context = None
+
+def _init_worker(loglevel, index_filepath, lock_timeout):
+    logging.basicConfig(stream=sys.stderr, level=loglevel, format=LOG_FORMAT)
+
+    from codegen.cpp import IndexContext
+    global _worker_index_context
+    _worker_index_context = IndexContext(index_filepath, read_only=True, lock_timeout=lock_timeout).__enter__()
+#enddef
+
+def _process_job(job_args):
+    """Processes a single input in a worker process. Returns changes made to the index."""
+    assert _worker_index_context is not None
+    index = _worker_index_context.index
+    index.clear_changes()
+    process_input(job_args, _worker_index_context)
+    return index.changes()
+#enddef
+
+def run_parallel(jobs, index_filepath, jobs_count, lock_timeout=None):
+    """Processes the inputs in a pool of worker processes. Workers read the index without
+    holding the lock, their changes are merged and saved at once when all of them are done."""
+    if any(job_args.input_file.strip() == "-" for job_args in jobs):
+        raise RuntimeError("The standard input can't be processed in the parallel mode.")
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    logging.info("Processing {} inputs using {} worker processes...".format(len(jobs), jobs_count))
+    changes = {}
+    with ProcessPoolExecutor(max_workers=jobs_count, initializer=_init_worker,
+            initargs=(logging.getLogger().level, index_filepath, lock_timeout)) as executor:
+        futures = [executor.submit(_process_job, job_args) for job_args in jobs]
+        for job_args, future in zip(jobs, futures):
+            try:
+                changes.update(future.result())
+            except Exception:
+                logging.error("Processing input file '{}' failed.".format(job_args.input_file))
+                for pending in futures:
+                    pending.cancel()
+                raise
+    #endwith
+
+    if changes and index_filepath:
+        import codegen.index
+        index_file = codegen.index.open_index_file(index_filepath)
+        with index_file.lock(timeout=lock_timeout):
+            index = index_file.load()
+            index.apply_changes(changes)
+            if index.dirty:
+                index_file.save(index)
+        logging.debug("Merged {} changed entries into index file '{}'.".format(len(changes), index_filepath))
+#enddef
+
+def run(args, index_cache=None):
+    """Processes all the inputs. The index is loaded and locked only once for all of them. If
+    an index cache is provided, the index is loaded only if it changed since the last time."""
+    jobs = collect_jobs(args)
+
+    jobs_count = min(args.jobs if args.jobs > 0 else (os.cpu_count() or 1), len(jobs))
+    if jobs_count > 1:
+        run_parallel(jobs, resolve_filepath(args, args.index), jobs_count, args.lock_timeout)
+        return
+
+    from codegen.cpp import IndexContext
+    with IndexContext(resolve_filepath(args, args.index), cache=index_cache, lock_timeout=args.lock_timeout) as index_context:
+        for job_args in jobs:
+            process_input(job_args, index_context)
+#enddef
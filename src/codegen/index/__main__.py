@@ -1,58 +1,138 @@
+import logging
+
 from .module import *
 
+def set_cpp_include(index, command_args):
+    if len(command_args) != 2:
+        raise RuntimeError("The 'set_cpp_include' command expects exactly two arguments, full type and the source where to find it.")
+
+    full_type_str = command_args[0]
+    include = command_args[1]
+
+    d = index.ensure(full_type_str, "cpp")
+    if "include" not in d:
+        d["include"] = include
+    elif d["include"] != include:
+        raise RuntimeError("C++ include already present in index for type '{}' and differs. ('{}' != '{}')".format(full_type_str, include, d["include"]))
+#enddef
+
+def clear(index, command_args):
+    if command_args:
+        raise RuntimeError("The 'clear' command doesn't expect any arguments.")
+
+    index.clear()
+#enddef
+
+# Commands modifying the loaded index, they can be used in the batch mode too.
+index_commands = {
+    "set_cpp_include": set_cpp_include,
+    "clear": clear
+}
+
+def read_batch(f):
+    """Reads commands for the batch mode, every record (see read_records()) contains a command
+    followed by its arguments. Returns a list of (line number, command, arguments) tuples."""
+    commands = []
+    for line_no, parts in read_records(f):
+        if parts[0] not in index_commands:
+            raise RuntimeError("Invalid command '{}' on line {}, the batch mode supports: {}.".format(parts[0], line_no, ", ".join(index_commands)))
+
+        commands.append((line_no, parts[0], parts[1:]))
+    #endfor
+
+    return commands
+#enddef
+
+def batch(index, commands):
+    """Applies the commands read by read_batch() to the index. Commands which fail (e.g. due to
+    a conflicting include) are skipped and the errors are returned together at the end."""
+    errors = []
+    for line_no, command, command_args in commands:
+        try:
+            index_commands[command](index, command_args)
+        except RuntimeError as e:
+            errors.append("Line {}: {}".format(line_no, e))
+    #endfor
+
+    return errors
+#enddef
+
+def apply_command(index_file, command, timeout=None, journal=False):
+    """Runs the command on the loaded index and persists the changes. Returns the command's
+    result. In the journal mode the changes are appended to the journal under the shared lock,
+    otherwise the index file is rewritten under the exclusive lock."""
+    if not journal:
+        with index_file.lock(timeout=timeout):
+            index = index_file.load()
+            result = command(index)
+            if index.dirty:
+                index_file.save(index)
+        return result
+
+    with index_file.lock(shared=True, timeout=timeout):
+        index = index_file.load_snapshot()
+        result = command(index)
+        index_file.append(index.changes())
+
+    # Compact the journal if it grew too much, but only if nobody else holds the lock.
+    if index_file.journal_size() > JOURNAL_COMPACT_SIZE:
+        try:
+            with index_file.lock(timeout=0):
+                index_file.compact()
+        except LockTimeoutError:
+            logging.debug("Index file '{}' is locked, the journal isn't compacted.".format(index_file.filepath))
+
+    return result
+#enddef
+
 if __name__ == "__main__":
     import argparse
+    import sys
 
     args_parser = argparse.ArgumentParser(description="Utility for maintaining a codegen index.")
-    args_parser.add_argument("index", metavar="INDEX", help="Path to the index file.")
-    args_parser.add_argument("command", metavar="COMMAND", help="Available commands: add_cpp_include, clear.")
+    args_parser.add_argument("index", metavar="INDEX", help="Path to the index file, SQLite database if the extension is .db, .sqlite or .sqlite3.")
+    args_parser.add_argument("command", metavar="COMMAND", help="Available commands: set_cpp_include, touch, clear, batch, compact. The 'batch' command reads set_cpp_include and clear commands (one per line) from the file provided as the argument or from the standard input and applies all of them at once. The 'compact' command folds the journal into the index file.")
     args_parser.add_argument("command_args", metavar="COMMAND_ARG", nargs="*")
+    args_parser.add_argument("-J", "--journal", dest="journal", action="store_true", help="Append the changes to the index journal instead of rewriting the index file, concurrent writers don't block each other then. Note that conflicting includes set concurrently aren't detected.")
+    args_parser.add_argument("-t", "--timeout", dest="timeout", type=float, default=None, help="Maximum time in seconds to wait for the index lock, waits indefinitely by default.")
 
     args = args_parser.parse_args()
 
-    command = None
+    index_file = open_index_file(args.index)
 
-    if args.command == "set_cpp_include":
+    if args.command == "touch":
+        with index_file.lock(timeout=args.timeout):
+            index_file.touch()
 
-        def set_cpp_include(index_file, command_args):
-            if len(command_args) != 2:
-                raise RuntimeError("The 'set_cpp_include' command expects exactly two arguments, full type and the source where to find it.")
+    elif args.command == "compact":
+        if args.command_args:
+            raise RuntimeError("The 'compact' command doesn't expect any arguments.")
 
-            full_type_str = command_args[0]
-            include = command_args[1]
+        with index_file.lock(timeout=args.timeout):
+            index_file.compact()
 
-            index = index_file.load()
-            d = index.ensure(full_type_str, "cpp")
-            if "include" not in d:
-                d["include"] = include
-                index_file.save(index)
-            elif d["include"] != include:
-                raise RuntimeError("C++ include already present in index for type '{}' and differs. ('{}' != '{}')".format(full_type_str, include, d["include"]))
-        #enddef
-        command = set_cpp_include
+    elif args.command == "batch":
+        if len(args.command_args) > 1:
+            raise RuntimeError("The 'batch' command expects at most one argument, file with the commands.")
 
-    elif args.command == "touch":
+        # Read the commands before locking the index, so the lock isn't held while waiting for
+        # the input.
+        batch_filepath = args.command_args[0] if args.command_args else "-"
+        if batch_filepath.strip() == "-":
+            commands = read_batch(sys.stdin)
+        else:
+            with open(batch_filepath, "r") as f:
+                commands = read_batch(f)
 
-        def touch(index_file, command_args):
-            index_file.touch()
-        #enddef
-        command = touch
+        errors = apply_command(index_file, lambda index: batch(index, commands), args.timeout, args.journal)
+        if errors:
+            raise RuntimeError("{} of {} commands failed:\n{}".format(len(errors), len(commands), "\n".join(errors)))
 
-    elif args.command == "clear":
-
-        def clear(index_file, command_args):
-            if index_file.load():
-                index_file.save(Index())
-        #enddef
-        command = clear
+    elif args.command in index_commands:
+        command = index_commands[args.command]
+        apply_command(index_file, lambda index: command(index, args.command_args), args.timeout, args.journal)
 
     else:
         raise RuntimeError("Invalid command '{}'.".format(args.command))
 
-    assert command is not None
-
-    index_file = IndexFile(args.index)
-    with index_file.lock():
-        command(index_file, args.command_args)
-
 #endif __main__
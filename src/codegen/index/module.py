@@ -1,36 +1,249 @@
+import copy
+import functools
 import logging
+import struct
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, the PID based lock file is used instead.
+    fcntl = None
+
+class LockTimeoutError(RuntimeError):
+    """Raised when a lock isn't acquired in time."""
+    pass
+#endclass
 
 class LockFile(object):
+    """Inter-process lock held on a lock file, shared (for readers) or exclusive (for writers).
+
+    The lock is taken using flock(), so it's released by the system when its holder terminates
+    and waiters are woken up immediately when it's released. The lock file is left in place.
+
+    Where flock() isn't available (or isn't supported by the file system), the lock is held by
+    exclusively creating the lock file with the PID of its holder, shared locks are exclusive
+    then. A lock file left behind by a process which doesn't run anymore is considered stale
+    and removed.
 
-    def __init__(self, filepath, ):
+    If a timeout (in seconds) is provided, LockTimeoutError is raised if the lock isn't acquired
+    in time. The waiting is then done by polling with a short backoff."""
+
+    def __init__(self, filepath, shared=False, timeout=None):
         self.__filepath = filepath
-        self.__file = None
+        self.__shared = shared
+        self.__timeout = timeout
+        self.__fd = None
+        self.__flock = False
+        self.__wait_time = 0.0
+    #enddef
+
+    @property
+    def filepath(self):
+        return self.__filepath
+    #enddef
+
+    @property
+    def shared(self):
+        return self.__shared
+    #enddef
+
+    @property
+    def wait_time(self):
+        """Time in seconds spent waiting for the lock when it was acquired the last time."""
+        return self.__wait_time
     #enddef
 
     def __enter__(self):
         import time
 
-        while self.__file is None:
-            try:
-                self.__file = open(self.__filepath, "x")
-                logging.debug("Created lock file '{}'".format(self.__filepath))
-            except Exception as e:
-                time.sleep(.2)
+        assert self.__fd is None
+        start = time.monotonic()
+        if not (fcntl is not None and self.__acquire_flock(start)):
+            self.__acquire_pid_file(start)
+        self.__wait_time = time.monotonic() - start
 
+        logging.debug("Acquired {} lock '{}' after {:.3f} s."
+                .format("shared" if self.__shared and self.__flock else "exclusive",
+                        self.__filepath, self.__wait_time))
         return self
     #enddef
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self.__file is not None:
-            self.__file.close()
-            self.__file = None
-            import os
+        import os
+
+        if self.__fd is None:
+            return
+
+        fd = self.__fd
+        self.__fd = None
+        if self.__flock:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        else:
+            os.close(fd)
             os.remove(self.__filepath)
-            logging.debug("Removed lock file '{}'".format(self.__filepath))
+        logging.debug("Released lock '{}'.".format(self.__filepath))
+    #enddef
+
+    def __acquire_flock(self, start):
+        """Acquires the lock using flock(), returns False if it isn't supported."""
+        import errno
+        import os
+        import time
+
+        fd = os.open(self.__filepath, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            operation = fcntl.LOCK_SH if self.__shared else fcntl.LOCK_EX
+            if self.__timeout is None:
+                fcntl.flock(fd, operation)
+            else:
+                delay = .001
+                while True:
+                    try:
+                        fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        self.__check_timeout(start)
+                        time.sleep(delay)
+                        delay = min(2 * delay, .05)
+                #endwhile
+            #endif
+        except OSError as e:
+            os.close(fd)
+            if e.errno in (errno.ENOLCK, errno.EOPNOTSUPP, errno.ENOTSUP):
+                logging.debug("Locking '{}' using flock() isn't supported. ({})".format(self.__filepath, e))
+                return False
+            raise
+        except BaseException:
+            os.close(fd)
+            raise
+
+        self.__fd = fd
+        self.__flock = True
+        return True
+    #enddef
+
+    def __acquire_pid_file(self, start):
+        """Acquires the lock by creating the lock file containing the PID of this process."""
+        import os
+        import time
+
+        # The lock file is linked from a complete temporary file, so it never appears without
+        # the PID.
+        pid = os.getpid()
+        tmp_filepath = "{}.{}.tmp".format(self.__filepath, pid)
+        with open(tmp_filepath, "w") as tmp_file:
+            tmp_file.write("{}\n".format(pid))
+
+        try:
+            delay = .001
+            while True:
+                try:
+                    os.link(tmp_filepath, self.__filepath)
+                    # Another process removing a stale lock could have taken this one away.
+                    if self.__read_holder()[0] == pid:
+                        break
+                    continue
+                except FileExistsError:
+                    pass
+
+                holder, holder_file = self.__read_holder()
+                if holder == -1:
+                    # Released in the meantime.
+                    continue
+                if holder is None or not _process_exists(holder):
+                    self.__remove_stale(holder, holder_file)
+                    continue
+                #endif
+
+                self.__check_timeout(start, holder)
+                time.sleep(delay)
+                delay = min(2 * delay, .05)
+            #endwhile
+        finally:
+            os.remove(tmp_filepath)
+
+        self.__fd = os.open(self.__filepath, os.O_RDONLY)
+        self.__flock = False
+    #enddef
+
+    def __remove_stale(self, holder, holder_file):
+        """Removes the lock file of the dead holder, holder_file identifies the file the holder
+        was read from. The file is moved away first and removed only if it's still the same
+        file with the same content, another process could have replaced it in the meantime (removing the same stale
+        lock file and acquiring the lock)."""
+        import os
+
+        stale_filepath = "{}.{}.stale".format(self.__filepath, os.getpid())
+        try:
+            os.rename(self.__filepath, stale_filepath)
+        except FileNotFoundError:
+            return
+
+        # The PID is compared too in case the inode got reused.
+        if self.__read_holder(stale_filepath) == (holder, holder_file):
+            os.remove(stale_filepath)
+            logging.warning("Removed stale lock file '{}'{}.".format(self.__filepath,
+                    " of process {}".format(holder) if holder is not None else ""))
+            return
+        #endif
+
+        # Put back the live lock file. If yet another process has acquired the lock in the
+        # meantime, two processes hold it and it can't be fixed here.
+        try:
+            os.link(stale_filepath, self.__filepath)
+        except FileExistsError:
+            raise RuntimeError("Lock file '{}' of a running process was replaced while being restored, the lock isn't exclusive anymore.".format(self.__filepath))
+        finally:
+            os.remove(stale_filepath)
+    #enddef
+
+    def __read_holder(self, filepath=None):
+        """Returns PID of the process holding the PID based lock, None if unknown (e.g. a lock
+        file left behind by an older version) and -1 if the lock isn't held anymore, together
+        with the (device, inode) pair identifying the lock file read (None if not held)."""
+        import os
+
+        try:
+            with open(filepath if filepath is not None else self.__filepath, "r") as f:
+                st = os.fstat(f.fileno())
+                holder_file = (st.st_dev, st.st_ino)
+                return int(f.read().strip()), holder_file
+        except FileNotFoundError:
+            return -1, None
+        except ValueError:
+            return None, holder_file
+    #enddef
+
+    def __check_timeout(self, start, holder=None):
+        import time
+
+        if self.__timeout is not None and time.monotonic() - start >= self.__timeout:
+            raise LockTimeoutError("Timed out after {} s waiting for lock file '{}'{}.".format(
+                    self.__timeout, self.__filepath,
+                    " held by process {}".format(holder) if holder is not None else ""))
     #enddef
 
 #endclass
 
+def _process_exists(pid):
+    """Returns whether a process with the PID runs. If it can't be determined (no POSIX
+    signals), the process is considered running."""
+    import os
+
+    if os.name != "posix":
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+#enddef
+
 def type_to_parts(what, ns_seps=["."]):
     """Splits the input into parts. The input can be an iterable in which case it's expected
     that the individual items are strings or something covnertible to string. The result
@@ -69,44 +282,108 @@ def validate_key(key, ns_seps=["."], res_sep="."):
     return res_sep.join(type_to_parts(key, ns_seps))
 #enddef
 
-from collections.abc import MutableMapping
+# Parts of the keys in the dot notation, see key_to_parts().
+# Maximum number of keys in the dot notation whose parts are memoized.
+KEY_PARTS_CACHE_SIZE = 1 << 16
+
+def key_to_parts(key):
+    """Returns the key (a string in the dot notation or a sequence of parts) as a tuple of
+    interned parts. Recently used keys in the dot notation are split and validated only once."""
+    if isinstance(key, str):
+        return _str_key_to_parts(key)
+
+    if isinstance(key, tuple) and all(isinstance(part, str) and part for part in key):
+        return key
+    return tuple(sys.intern(part) for part in type_to_parts(list(key)))
+#enddef
+
+@functools.lru_cache(maxsize=KEY_PARTS_CACHE_SIZE)
+def _str_key_to_parts(key):
+    return tuple(sys.intern(part) for part in type_to_parts(key))
+#enddef
+
+def _stored_key_to_parts(key):
+    # Keys from a storage are valid already.
+    return tuple(sys.intern(part) for part in key.split("."))
+#enddef
+
+from collections.abc import Mapping, MutableMapping
+
+# Marks entries of the base deleted in an index, see Index.
+_deleted = object()
 
 class Index(MutableMapping):
+    """Index of types. Entries are keyed by the type parts internally, keys can be provided as
+    strings in the dot notation or as sequences of parts. Iteration yields the keys in the dot
+    notation, which is also used by the storages.
+
+    Modifications are tracked, the original value of every entry is remembered when it's about
+    to be modified for the first time, so it's possible to tell which entries really changed
+    since the index was loaded.
+
+    The entries can be held in memory or looked up on demand in a read-only base mapping (see
+    load_base()), in which case only the modified entries are held in memory."""
 
     def __init__(self):
         self.__data = {}
-        self.__ns_seps = ["."]
+        self.__base = None
+        # Keys (parts) of the entries held in memory sorted for namespace queries, built when
+        # needed.
+        self.__sorted_keys = None
+        # Original values of the entries which might have been modified, None if missing.
+        self.__original = {}
     #enddef
 
     def __getitem__(self, key):
-        validated_key = validate_key(key, self.__ns_seps)
-        return self.__data[validated_key]
+        value = self.__lookup(key_to_parts(key))
+        if value is None:
+            raise KeyError(key)
+        return value
     #enddef
 
     def __setitem__(self, key, value):
-        validated_key = validate_key(key, self.__ns_seps)
-        self.__data[validated_key] = value
+        parts = key_to_parts(key)
+        self.__touch(parts)
+        self.__store(parts, value)
     #enddef
 
     def __delitem__(self, key):
-        validated_key = validate_key(key, self.__ns_seps)
-        del self.__data[validated_key]
+        parts = key_to_parts(key)
+        if self.__lookup(parts) is None:
+            raise KeyError(key)
+        self.__touch(parts)
+        if self.__base is not None and ".".join(parts) in self.__base:
+            self.__store(parts, _deleted)
+        else:
+            del self.__data[parts]
+            self.__sorted_keys = None
     #enddef
 
     def __iter__(self):
-        # FIXME When iterating the types will appear in form of a dot notation. Check mapping view in abc if it could be of any help.
-        return iter(self.__data)
+        for parts, value in self.__data.items():
+            if value is not _deleted:
+                yield ".".join(parts)
+        if self.__base is not None:
+            for key in self.__base:
+                if _stored_key_to_parts(key) not in self.__data:
+                    yield key
     #enddef
 
     def __len__(self):
-        return len(self.__data)
+        if self.__base is None:
+            return len(self.__data)
+        return sum(1 for key in self)
     #enddef
 
     def ensure(self, key, *path):
-        validated_key = validate_key(key, self.__ns_seps)
-        if validated_key not in self.__data:
-            self.__data[validated_key] = {}
-        d = self.__data[validated_key]
+        parts = key_to_parts(key)
+        # The returned dictionary can be modified by the caller.
+        self.__touch(parts)
+        d = self.__data.get(parts, None)
+        if d is None or d is _deleted:
+            d = self.__lookup(parts)
+            d = copy.deepcopy(d) if d is not None else {}
+            self.__store(parts, d)
         for part in path:
             if part not in d:
                 d[part] = {}
@@ -114,19 +391,278 @@ class Index(MutableMapping):
         return d
     #enddef
 
+    def clear(self):
+        # MutableMapping.clear() iterates from the beginning for every removed entry.
+        for key in list(self):
+            del self[key]
+    #enddef
+
+    def namespace_keys(self, namespace):
+        """Returns sorted keys (in the dot notation) of all the entries in the namespace (a key)
+        and its nested namespaces, the whole index for an empty namespace."""
+        import bisect
+
+        prefix = key_to_parts(namespace) if namespace else ()
+
+        keys = set()
+        if self.__base is not None:
+            if prefix:
+                prefix_str = ".".join(prefix) + "."
+                if hasattr(self.__base, "keys_with_prefix"):
+                    keys.update(self.__base.keys_with_prefix(prefix_str))
+                else:
+                    keys.update(key for key in self.__base if key.startswith(prefix_str))
+            else:
+                keys.update(self.__base)
+        #endif
+
+        if self.__sorted_keys is None:
+            self.__sorted_keys = sorted(self.__data)
+        for i in range(bisect.bisect_right(self.__sorted_keys, prefix), len(self.__sorted_keys)):
+            parts = self.__sorted_keys[i]
+            if parts[:len(prefix)] != prefix:
+                break
+            if self.__data[parts] is _deleted:
+                keys.discard(".".join(parts))
+            else:
+                keys.add(".".join(parts))
+        #endfor
+
+        return sorted(keys)
+    #enddef
+
+    @property
+    def dirty(self):
+        """Whether any entry changed since the index was created or loaded (or since the last
+        clear_changes() call)."""
+        return any(self.__lookup(parts) != original for parts, original in self.__original.items())
+    #enddef
+
+    def changes(self):
+        """Returns entries changed since the index was created or loaded (or since the last
+        clear_changes() call) as a dictionary keyed in the dot notation. Deleted entries have
+        None value."""
+        changes = {}
+        for parts, original in self.__original.items():
+            value = self.__lookup(parts)
+            if value != original:
+                changes[".".join(parts)] = value
+        return changes
+    #enddef
+
+    def clear_changes(self):
+        self.__original.clear()
+    #enddef
+
+    def apply_changes(self, changes):
+        """Applies changes obtained by changes() from another index."""
+        for key, value in changes.items():
+            if value is None:
+                if key in self:
+                    del self[key]
+            else:
+                self[key] = value
+    #enddef
+
     def load_json(self, f):
         import json
-        self.__data = json.load(f)
+        self.load_entries(json.load(f))
+    #enddef
+
+    def load_entries(self, entries):
+        """Replaces the content with the entries (a mapping or (key, value) pairs with keys in
+        the dot notation) loaded from a storage, they're considered unchanged."""
+        if isinstance(entries, Mapping):
+            entries = entries.items()
+        self.__data = { _stored_key_to_parts(key): value for key, value in entries }
+        self.__base = None
+        self.__sorted_keys = None
+        self.__original.clear()
+    #enddef
+
+    def load_base(self, base):
+        """Replaces the content with the base, a read-only mapping of the entries (keyed in
+        the dot notation) which are looked up only when accessed, they're considered
+        unchanged."""
+        self.__data = {}
+        self.__base = base
+        self.__sorted_keys = None
+        self.__original.clear()
     #enddef
 
     def dump_json(self, f):
         import json
-        json.dump(self.__data, f)
+        json.dump(dict(self.items()), f)
+    #enddef
+
+    def __lookup(self, parts):
+        """Returns the entry or None if it isn't present."""
+        value = self.__data.get(parts, None)
+        if value is None and self.__base is not None:
+            value = self.__base.get(".".join(parts), None)
+        return value if value is not _deleted else None
+    #enddef
+
+    def __store(self, parts, value):
+        if parts not in self.__data:
+            self.__sorted_keys = None
+        self.__data[parts] = value
+    #enddef
+
+    def __touch(self, parts):
+        """Remembers the original value of the entry before it's modified for the first time."""
+        if parts not in self.__original:
+            self.__original[parts] = copy.deepcopy(self.__lookup(parts))
+    #enddef
+
+#endclass
+
+class CompiledIndex(Mapping):
+    """Read-only index entries in a compiled binary file, see compile(). The file is memory
+    mapped and the entries are found by a binary search when looked up, so opening it takes
+    the same time regardless of the number of entries.
+
+    The file starts with a header (magic, format version, stamp of the source the entries were
+    compiled from and the number of entries) followed by a table of (key offset, key length,
+    value offset, value length) items sorted by the keys and finally the keys (UTF-8) and the
+    values (JSON)."""
+
+    MAGIC = b"CGIX"
+    VERSION = 1
+
+    HEADER = struct.Struct("<4sIqqI")
+    ITEM = struct.Struct("<IIII")
+
+    def __init__(self, filepath):
+        import mmap
+
+        with open(filepath, "rb") as f:
+            self.__data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if len(self.__data) < self.HEADER.size:
+                raise ValueError("Compiled index '{}' is truncated.".format(filepath))
+            magic, version, mtime_ns, size, self.__count = self.HEADER.unpack_from(self.__data, 0)
+            if magic != self.MAGIC or version != self.VERSION \
+                    or len(self.__data) < self.HEADER.size + self.__count * self.ITEM.size:
+                raise ValueError("Invalid compiled index '{}'.".format(filepath))
+        except:
+            self.__data.close()
+            raise
+
+        self.__source_stamp = (mtime_ns, size)
+    #enddef
+
+    @property
+    def source_stamp(self):
+        """Stamp of the source the entries were compiled from (see IndexFile.stamp())."""
+        return self.__source_stamp
+    #enddef
+
+    def close(self):
+        self.__data.close()
+    #enddef
+
+    def __getitem__(self, key):
+        import json
+
+        item = self.__find(key.encode("utf-8"))
+        if item is None:
+            raise KeyError(key)
+        _, _, value_offset, value_length = item
+        return json.loads(self.__data[value_offset:value_offset + value_length])
+    #enddef
+
+    def __contains__(self, key):
+        return self.__find(key.encode("utf-8")) is not None
+    #enddef
+
+    def __iter__(self):
+        for i in range(self.__count):
+            yield self.__key(self.__item(i)).decode("utf-8")
+    #enddef
+
+    def __len__(self):
+        return self.__count
+    #enddef
+
+    def keys_with_prefix(self, prefix):
+        """Yields the keys starting with the prefix in the sorted order."""
+        prefix = prefix.encode("utf-8")
+        for i in range(self.__lower_bound(prefix), self.__count):
+            key = self.__key(self.__item(i))
+            if not key.startswith(prefix):
+                break
+            yield key.decode("utf-8")
+    #enddef
+
+    def __item(self, i):
+        return self.ITEM.unpack_from(self.__data, self.HEADER.size + i * self.ITEM.size)
+    #enddef
+
+    def __key(self, item):
+        return self.__data[item[0]:item[0] + item[1]]
+    #enddef
+
+    def __lower_bound(self, key):
+        """Returns position of the first item with key not less than the key."""
+        lo, hi = 0, self.__count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__key(self.__item(mid)) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        #endwhile
+        return lo
+    #enddef
+
+    def __find(self, key):
+        i = self.__lower_bound(key)
+        if i < self.__count:
+            item = self.__item(i)
+            if self.__key(item) == key:
+                return item
+        return None
+    #enddef
+
+    @classmethod
+    def compile(cls, filepath, entries, source_stamp):
+        """Writes the entries (a mapping) into a compiled index file atomically."""
+        import json
+
+        items = sorted((key.encode("utf-8"), json.dumps(value, sort_keys=True).encode("utf-8"))
+                for key, value in entries.items())
+
+        table = bytearray()
+        blobs = []
+        offset = cls.HEADER.size + len(items) * cls.ITEM.size
+        for key, value in items:
+            table += cls.ITEM.pack(offset, len(key), offset + len(key), len(value))
+            blobs.append(key)
+            blobs.append(value)
+            offset += len(key) + len(value)
+        #endfor
+
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, source_stamp[0], source_stamp[1], len(items))
+        atomic_write(filepath, b"".join([ header, table ] + blobs))
     #enddef
 
 #endclass
 
+# Size of the index journal in bytes above which it's worth compacting.
+JOURNAL_COMPACT_SIZE = 1 << 20
+
 class IndexFile(object):
+    """Index stored in a JSON file. The whole file is loaded and rewritten on save.
+
+    For reading, the index file is compiled into a binary cache next to it (see CompiledIndex),
+    so the entries can be looked up without loading the whole file. The cache is rebuilt
+    whenever the modification time or size of the index file changes.
+
+    Changes can also be appended to a journal next to the index file (see append()) without
+    rewriting it. The journal is replayed whenever the index is loaded and it's folded into the
+    index file whenever the index is saved (see also compact())."""
 
     def __init__(self, filepath):
         super(IndexFile, self).__init__()
@@ -134,8 +670,19 @@ class IndexFile(object):
         self.__filepath = filepath
     #enddef
 
-    def lock(self):
-        return LockFile(self.__filepath + ".lock")
+    @property
+    def filepath(self):
+        return self.__filepath
+    #enddef
+
+    def lock(self, shared=False, timeout=None):
+        """Returns a lock of the index file (see LockFile), shared locks are meant for reading."""
+        return LockFile(self.__filepath + ".lock", shared, timeout)
+    #enddef
+
+    @property
+    def journal_filepath(self):
+        return self.__filepath + ".journal"
     #enddef
 
     def load(self):
@@ -147,12 +694,81 @@ class IndexFile(object):
         except FileNotFoundError:
             pass
 
+        self.__replay_journal(index)
+        return index
+    #enddef
+
+    def load_snapshot(self):
+        """Returns the index for reading, its entries are looked up in the compiled cache only
+        when accessed. The returned index can be modified, the changes are kept in memory."""
+        index = Index()
+        entries = self.__open_compiled()
+        if entries is not None:
+            index.load_base(entries)
+        self.__replay_journal(index)
         return index
     #enddef
 
     def save(self, index):
-        with open(self.__filepath, "w") as index_file:
-            index.dump_json(index_file)
+        """Saves the index atomically, i.e. readers see either the old or the new content. The
+        journal is emptied afterwards, so the index has to be loaded (with the journal) under
+        the exclusive lock. The empty journal is kept, so it can be listed as a dependency of
+        the generated files."""
+        import io
+
+        content = io.StringIO()
+        index.dump_json(content)
+        atomic_write(self.__filepath, content.getvalue())
+
+        # Replaying the journal over the saved index wouldn't change it, so it doesn't matter
+        # if the journal isn't emptied (e.g. due to a crash).
+        with open(self.journal_filepath, "w"):
+            pass
+    #enddef
+
+    def append(self, changes):
+        """Appends the changes (see Index.changes()) to the journal instead of rewriting the
+        index file. The records are appended atomically, so holding the shared lock is enough,
+        it only excludes saving of the index."""
+        import json
+        import os
+
+        if not changes:
+            return
+
+        # A single write, so records of concurrent writers don't interleave.
+        records = "".join(json.dumps({ "key": key, "value": value }, sort_keys=True) + "\n"
+                for key, value in changes.items())
+        try:
+            fd = os.open(self.journal_filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o666)
+            # Dependents of an index written before the journal existed don't list it yet,
+            # make them out of date through the index file.
+            if os.path.exists(self.__filepath):
+                os.utime(self.__filepath)
+        except FileExistsError:
+            fd = os.open(self.journal_filepath, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, records.encode("utf-8"))
+        finally:
+            os.close(fd)
+        logging.debug("Appended {} changed entries into index journal '{}'.".format(len(changes), self.journal_filepath))
+    #enddef
+
+    def journal_size(self):
+        """Returns size of the journal in bytes."""
+        stamp = _file_stamp(self.journal_filepath)
+        return stamp[1] if stamp is not None else 0
+    #enddef
+
+    def compact(self):
+        """Folds the journal into the index file, the exclusive lock has to be held. Returns
+        whether there was anything to fold."""
+        if not self.journal_size():
+            return False
+
+        self.save(self.load())
+        logging.debug("Compacted index journal '{}'.".format(self.journal_filepath))
+        return True
     #enddef
 
     def touch(self):
@@ -161,7 +777,308 @@ class IndexFile(object):
                 import os
                 os.utime(self.__filepath)
         except FileNotFoundError:
-            self.save(Index())
+            # There can be a journal already.
+            self.save(self.load())
+    #enddef
+
+    def stamp(self):
+        """Returns a value which changes whenever the stored index changes (modification time
+        and size of the file and the journal) or None if the index file doesn't exist."""
+        index_stamp = _file_stamp(self.__filepath)
+        journal_stamp = _file_stamp(self.journal_filepath)
+        if index_stamp is None and journal_stamp is None:
+            return None
+        return (index_stamp, journal_stamp)
+    #enddef
+
+    @property
+    def compiled_filepath(self):
+        return self.__filepath + ".cache"
+    #enddef
+
+    def __open_compiled(self):
+        """Opens the compiled cache, (re)builds it if it's out of date. Returns None if the
+        index file doesn't exist and the loaded entries if the cache can't be written."""
+        import json
+        import os
+
+        stamp = _file_stamp(self.__filepath)
+        if stamp is None:
+            return None
+
+        try:
+            compiled = CompiledIndex(self.compiled_filepath)
+            if compiled.source_stamp == stamp:
+                return compiled
+            compiled.close()
+        except (FileNotFoundError, ValueError):
+            pass
+
+        try:
+            with open(self.__filepath) as index_file:
+                st = os.fstat(index_file.fileno())
+                entries = json.load(index_file)
+        except FileNotFoundError:
+            return None
+
+        logging.debug("Compiling index file '{}' into '{}'.".format(self.__filepath, self.compiled_filepath))
+        try:
+            CompiledIndex.compile(self.compiled_filepath, entries, (st.st_mtime_ns, st.st_size))
+        except OSError as e:
+            logging.debug("Failed to compile index file '{}'. ({})".format(self.__filepath, e))
+            return entries
+        return CompiledIndex(self.compiled_filepath)
+    #enddef
+
+    def __replay_journal(self, index):
+        """Applies the changes recorded in the journal to the index, they're considered
+        unchanged."""
+        import json
+
+        try:
+            with open(self.journal_filepath, "r") as f:
+                lines = f.read().split("\n")
+        except FileNotFoundError:
+            return
+
+        # The last line is empty unless a record is being appended right now.
+        if lines[-1]:
+            logging.debug("Ignoring incomplete record at the end of index journal '{}'.".format(self.journal_filepath))
+
+        changes = {}
+        for line_no, line in enumerate(lines[:-1], 1):
+            try:
+                record = json.loads(line)
+                changes[record["key"]] = record["value"]
+            except (ValueError, KeyError, TypeError):
+                logging.warning("Ignoring invalid record on line {} of index journal '{}'.".format(line_no, self.journal_filepath))
+        #endfor
+
+        index.apply_changes(changes)
+        index.clear_changes()
+        logging.debug("Replayed {} changed entries from index journal '{}'.".format(len(changes), self.journal_filepath))
     #enddef
 
 #endclass
+
+class SqliteEntries(Mapping):
+    """Read-only entries of an index stored in a SQLite database, every entry is queried only
+    when looked up. In the snapshot mode all the queries see the database as it was when the
+    first one was made, otherwise they see the latest committed content."""
+
+    def __init__(self, connection, snapshot=False):
+        self.__connection = connection
+        if snapshot:
+            # The read transaction is kept open, so the WAL snapshot is preserved.
+            self.__connection.execute("BEGIN")
+            self.__connection.execute("SELECT 1 FROM entries LIMIT 1").fetchall()
+    #enddef
+
+    def close(self):
+        self.__connection.close()
+    #enddef
+
+    def __getitem__(self, key):
+        import json
+
+        row = self.__connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+    #enddef
+
+    def __contains__(self, key):
+        return self.__connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+    #enddef
+
+    def __iter__(self):
+        for row in self.__connection.execute("SELECT key FROM entries ORDER BY key").fetchall():
+            yield row[0]
+    #enddef
+
+    def __len__(self):
+        return self.__connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+    #enddef
+
+    def keys_with_prefix(self, prefix):
+        """Yields the keys starting with the prefix (ending with '.') in the sorted order."""
+        assert prefix.endswith(".")
+        # Keys are compared as UTF-8 bytes, '/' follows '.'.
+        rows = self.__connection.execute("SELECT key FROM entries WHERE key >= ? AND key < ? ORDER BY key",
+                (prefix, prefix[:-1] + "/")).fetchall()
+        for row in rows:
+            yield row[0]
+    #enddef
+
+#endclass
+
+class SqliteIndexFile(IndexFile):
+    """Index stored in a SQLite database. The database is used in the WAL mode, so readers
+    don't block each other nor the writer. Loaded indexes query the entries only when they're
+    looked up (see SqliteEntries), so the cost of an operation doesn't depend on the size of
+    the index. Only the entries which changed since the index was loaded (see Index.changes())
+    are written on save, in a single transaction. The index to save has to be loaded from the
+    same file, saving an unrelated index would only apply its changes. Writers are still
+    expected to hold the (exclusive) lock of the index file.
+
+    There's no journal, appended changes are written into the database directly."""
+
+    def load(self):
+        return self.__load(snapshot=False)
+    #enddef
+
+    def load_snapshot(self):
+        return self.__load(snapshot=True)
+    #enddef
+
+    def save(self, index):
+        self.append(index.changes())
+    #enddef
+
+    def append(self, changes):
+        import json
+
+        connection = self.__connect()
+        try:
+            with connection:
+                for key, value in changes.items():
+                    if value is None:
+                        connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    else:
+                        connection.execute("INSERT INTO entries (key, value) VALUES (?, ?) "
+                                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                                (key, json.dumps(value, sort_keys=True)))
+                #endfor
+            #endwith
+        finally:
+            connection.close()
+        logging.debug("Saved {} changed entries into index file '{}'.".format(len(changes), self.filepath))
+    #enddef
+
+    def stamp(self):
+        # Committed changes can be only in the write-ahead log until it's checkpointed.
+        db_stamp = _file_stamp(self.filepath)
+        return (db_stamp, _file_stamp(self.filepath + "-wal")) if db_stamp is not None else None
+    #enddef
+
+    def __load(self, snapshot):
+        import os
+
+        index = Index()
+        if os.path.exists(self.filepath):
+            index.load_base(SqliteEntries(self.__connect(read_only=True), snapshot))
+        return index
+    #enddef
+
+    def __connect(self, read_only=False):
+        import sqlite3
+
+        # Connections of the loaded indexes are only read, they can be used by any thread.
+        connection = sqlite3.connect(self.filepath, timeout=60, isolation_level=None if read_only else "",
+                check_same_thread=not read_only)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        return connection
+    #enddef
+
+#endclass
+
+# Extensions of the index files stored in SQLite databases.
+SQLITE_INDEX_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+def open_index_file(filepath):
+    """Returns the index file with the storage determined by the file extension, SQLite for
+    SQLITE_INDEX_EXTENSIONS and JSON otherwise."""
+    import os
+
+    if os.path.splitext(filepath)[1].lower() in SQLITE_INDEX_EXTENSIONS:
+        return SqliteIndexFile(filepath)
+    return IndexFile(filepath)
+#enddef
+
+def _file_stamp(filepath):
+    import os
+
+    try:
+        st = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+#enddef
+
+class IndexCache(object):
+    """Keeps loaded indexes in memory for long running processes. A cached index is reused as
+    long as its file doesn't change (see IndexFile.stamp()). Cached indexes are never modified,
+    so they can be shared by concurrent users."""
+
+    def __init__(self):
+        self.__entries = {}
+    #enddef
+
+    def load(self, index_file):
+        """Returns the index stored in the index file, loads it only if the file changed. The
+        returned index is a new one looking the entries up in the cached index (see
+        Index.load_base()), so its changes are visible only to the caller, who's expected to
+        save them."""
+        import os
+
+        filepath = os.path.abspath(index_file.filepath)
+        stamp = index_file.stamp()
+
+        entry = self.__entries.get(filepath, None)
+        if entry is not None and entry[0] == stamp and stamp is not None:
+            logging.debug("Using cached index file '{}'.".format(filepath))
+        else:
+            logging.debug("Loading index file '{}' into the cache.".format(filepath))
+            entry = self.__entries[filepath] = (stamp, index_file.load())
+
+        index = Index()
+        index.load_base(entry[1])
+        return index
+    #enddef
+
+    def update(self, index_file, index):
+        """Updates the cache after the index was saved into the index file. The index mustn't
+        be modified afterwards."""
+        import os
+
+        filepath = os.path.abspath(index_file.filepath)
+        index.clear_changes()
+        self.__entries[filepath] = (index_file.stamp(), index)
+    #enddef
+
+#endclass
+
+def read_records(f):
+    """Reads records of a line based text file (e.g. a batch manifest or index commands). Every
+    non-empty line which isn't a comment (starting with '#') is a record. If the line contains
+    a tab, the tab is used as the separator of the record's fields, otherwise any whitespace.
+    Yields (line number, fields) pairs."""
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        parts = line.split("\t") if "\t" in line else line.split()
+        yield line_no, [part.strip() for part in parts]
+    #endfor
+#enddef
+
+def atomic_write(filepath, data):
+    """Writes the data (bytes or a string written in UTF-8) into the file atomically, readers
+    see either the old or the new content."""
+    import os
+
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    tmp_filepath = "{}.{}.tmp".format(filepath, os.getpid())
+    try:
+        with open(tmp_filepath, "wb") as f:
+            f.write(data)
+        os.replace(tmp_filepath, filepath)
+    except:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+#enddef
@@ -0,0 +1,241 @@
+"""Incremental reading of codemodel's JSON documents.
+
+A class diagram document is a top-level node (usually a package) whose child nodes are stored
+in the "nodes" array. PackageReader reads the top-level node attributes and then provides
+the child nodes one by one, nested packages are descended into, so only a single class node
+has to be kept in memory at a time. Class nodes are provided as raw JSON texts, their bounds
+are found by a lexical scan, so they are parsed only once by codemodel. Keys following the
+"nodes" array of a package aren't supported, codemodel writes them before the child nodes."""
+
+import json
+import re
+
+PACKAGE_TYPE = "codemodel.classdiagram.Package"
+
+# Characters changing the nesting depth or starting a string, and characters ending a string or
+# starting an escape sequence within it.
+_STRUCTURE_RE = re.compile(r'[{}\[\]"]')
+_STRING_RE = re.compile(r'["\\]')
+
+# Characters which can be a part of a number.
+_NUMBER_CHARS = "0123456789+-.eE"
+
+class PackageReader(object):
+
+    def __init__(self, f, chunk_size=1 << 20):
+        self.__file = f
+        self.__chunk_size = chunk_size
+        self.__buf = ""
+        self.__pos = 0
+        self.__mark = None
+        self.__eof = False
+        self.__decoder = json.JSONDecoder()
+    #enddef
+
+    def read(self):
+        """Reads the top-level node up to its child nodes. Returns the node without the child
+        nodes (as a dictionary) and an iterator of its child nodes. The iterator provides
+        (shell, nodes) tuples for nested packages, where shell is the package without the child
+        nodes and nodes is an iterator of the same kind, and (raw JSON text, None) tuples for
+        other nodes. The iterators have to be consumed in order before the reader is used
+        again."""
+        self.__skip_ws()
+        self.__expect("{")
+        return self.__read_shell({})
+    #enddef
+
+    def __read_shell(self, shell):
+        """Reads keys of a package object up to its child nodes, the opening brace and keys
+        already present in the shell were consumed."""
+        while True:
+            self.__skip_ws()
+            if self.__peek() == "}":
+                self.__pos += 1
+                shell.setdefault("nodes", [])
+                return shell, iter(())
+
+            if self.__peek() == ",":
+                self.__pos += 1
+                continue
+
+            key = self.__decode_value()
+            if not isinstance(key, str):
+                raise ValueError("Expecting an object key, got '{}'.".format(key))
+            self.__skip_ws()
+            self.__expect(":")
+
+            if key == "nodes":
+                shell["nodes"] = []
+                return shell, self.__nodes()
+
+            shell[key] = self.__decode_value()
+        #endwhile
+    #enddef
+
+    def __nodes(self):
+        self.__skip_ws()
+        self.__expect("[")
+
+        self.__skip_ws()
+        if self.__peek() == "]":
+            self.__pos += 1
+        else:
+            while True:
+                shell, nodes = self.__node()
+                yield shell, nodes
+                if nodes is not None:
+                    # Make sure the nested package was read completely.
+                    for _ in nodes:
+                        pass
+
+                self.__skip_ws()
+                c = self.__peek()
+                self.__pos += 1
+                if c == "]":
+                    break
+                elif c != ",":
+                    raise ValueError("Expecting ',' or ']' in the nodes array, got '{}'.".format(c))
+            #endwhile
+        #endif
+
+        self.__skip_ws()
+        c = self.__peek()
+        if c == ",":
+            raise ValueError("Keys following the nodes array aren't supported when reading incrementally.")
+        self.__expect("}")
+    #enddef
+
+    def __node(self):
+        """Reads a node of the nodes array. Packages are read up to their child nodes if their
+        type comes first (as codemodel writes it), other nodes are scanned as a whole."""
+        self.__skip_ws()
+        self.__mark = self.__pos
+        try:
+            self.__expect("{")
+            self.__skip_ws()
+            if self.__peek() == '"':
+                key = self.__decode_value()
+                self.__skip_ws()
+                self.__expect(":")
+                if key == "type":
+                    node_type = self.__decode_value()
+                    if node_type == PACKAGE_TYPE:
+                        self.__mark = None
+                        return self.__read_shell({"type": node_type})
+            #endif
+
+            self.__scan(1)
+            return self.__buf[self.__mark:self.__pos], None
+        finally:
+            self.__mark = None
+    #enddef
+
+    def __scan(self, depth):
+        """Moves behind the end of the container the current position is nested in at the
+        given depth. Only brackets and strings are tracked, no values are built."""
+        while depth:
+            match = _STRUCTURE_RE.search(self.__buf, self.__pos)
+            if match is None:
+                self.__pos = len(self.__buf)
+                self.__fill_or_fail()
+                continue
+
+            self.__pos = match.end()
+            c = match.group()
+            if c == '"':
+                self.__scan_string()
+            elif c in "{[":
+                depth += 1
+            else:
+                depth -= 1
+        #endwhile
+    #enddef
+
+    def __scan_string(self):
+        """Moves behind the end of the string the current position is in."""
+        while True:
+            match = _STRING_RE.search(self.__buf, self.__pos)
+            if match is None:
+                self.__pos = len(self.__buf)
+                self.__fill_or_fail()
+                continue
+
+            if match.group() == '"':
+                self.__pos = match.end()
+                return
+
+            # Skip the escaped character.
+            self.__pos = match.end()
+            self.__peek()
+            self.__pos += 1
+        #endwhile
+    #enddef
+
+    def __fill(self, size=None):
+        """Reads more data, returns False at the end of the input."""
+        if self.__eof:
+            return False
+
+        # Drop the already processed data, but keep the data from the mark on.
+        drop = self.__pos if self.__mark is None else self.__mark
+        if drop:
+            self.__buf = self.__buf[drop:]
+            self.__pos -= drop
+            if self.__mark is not None:
+                self.__mark -= drop
+
+        chunk = self.__file.read(size if size is not None else self.__chunk_size)
+        if not chunk:
+            self.__eof = True
+            return False
+
+        self.__buf += chunk
+        return True
+    #enddef
+
+    def __fill_or_fail(self):
+        if not self.__fill():
+            raise ValueError("Unexpected end of the input.")
+    #enddef
+
+    def __peek(self):
+        while self.__pos >= len(self.__buf):
+            self.__fill_or_fail()
+        return self.__buf[self.__pos]
+    #enddef
+
+    def __skip_ws(self):
+        while True:
+            while self.__pos < len(self.__buf) and self.__buf[self.__pos] in " \t\n\r":
+                self.__pos += 1
+            if self.__pos < len(self.__buf) or not self.__fill():
+                break
+    #enddef
+
+    def __expect(self, c):
+        if self.__peek() != c:
+            raise ValueError("Expecting '{}', got '{}'.".format(c, self.__peek()))
+        self.__pos += 1
+    #enddef
+
+    def __decode_value(self):
+        """Decodes a value at the current position, reads more data if needed."""
+        self.__skip_ws()
+        while True:
+            # A number ending at the end of the buffer or followed by characters which could
+            # continue it (e.g. "1e" of "1e-5") could be truncated.
+            try:
+                value, end = self.__decoder.raw_decode(self.__buf, self.__pos)
+                if self.__eof or (end < len(self.__buf) and self.__buf[end] not in _NUMBER_CHARS):
+                    self.__pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.__eof:
+                    raise
+
+            # Read at least as much as is pending to avoid quadratic decoding of large values.
+            self.__fill(max(self.__chunk_size, len(self.__buf) - self.__pos))
+        #endwhile
+    #enddef
+
+#endclass
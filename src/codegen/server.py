@@ -0,0 +1,279 @@
+"""Code generation server keeping the generators and loaded indexes resident in memory.
+
+The server listens on a Unix socket and processes one request per connection. A request is
+a single line with a JSON object containing the command line arguments ("argv", the same as
+for 'python -m codegen') and the working directory ("cwd"). The response is a JSON object
+with the exit status ("status") and the captured standard ("stdout") and error ("stderr")
+output.
+
+Requests are processed concurrently, every one in its own thread. They don't change any state
+of the process: relative paths are resolved against the request's working directory (see
+codegen.driver.resolve_filepath()) and the standard streams and logging are redirected per
+thread (see RequestRedirection)."""
+
+import io
+import json
+import logging
+import os
+import socketserver
+import stat
+import sys
+import threading
+
+from codegen import driver
+
+# Streams and log level of the request processed by the current thread, if any.
+_request = threading.local()
+
+class ThreadStream(object):
+    """Standard stream writing into the stream of the request processed by the current thread
+    or into the original stream if the thread doesn't process any request."""
+
+    def __init__(self, name, stream):
+        self.__name = name
+        self.__stream = stream
+    #enddef
+
+    @property
+    def original(self):
+        return self.__stream
+    #enddef
+
+    def __getattr__(self, name):
+        stream = getattr(_request, self.__name, None)
+        return getattr(stream if stream is not None else self.__stream, name)
+    #enddef
+
+#endclass
+
+class RequestLogHandler(logging.Handler):
+    """Writes log records of the request processed by the current thread into its error output,
+    records of other threads are ignored."""
+
+    def emit(self, record):
+        stderr = getattr(_request, "stderr", None)
+        if stderr is None or record.levelno < _request.loglevel:
+            return
+        try:
+            stderr.write(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+    #enddef
+
+#endclass
+
+class ServerLogFilter(logging.Filter):
+    """Passes only records of the server itself to its own log handlers, i.e. records of threads
+    which don't process any request, at the server's log level."""
+
+    def __init__(self, level):
+        super(ServerLogFilter, self).__init__()
+        self.__level = level
+    #enddef
+
+    def filter(self, record):
+        return getattr(_request, "stderr", None) is None and record.levelno >= self.__level
+    #enddef
+
+#endclass
+
+class RequestRedirection(object):
+    """Redirects the standard streams and the logging of the threads processing requests into
+    the requests' own streams, so concurrent requests don't interfere with each other nor with
+    the server. The root logger's level is lowered to the lowest level any request being
+    processed needs, the server's own handlers keep filtering by the server's level."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__levels = {}
+        self.__server_level = None
+        self.__handler = None
+        self.__filter = None
+    #enddef
+
+    def install(self):
+        assert self.__handler is None
+        root_logger = logging.getLogger()
+        self.__server_level = root_logger.level
+        self.__filter = ServerLogFilter(self.__server_level)
+        for handler in root_logger.handlers:
+            handler.addFilter(self.__filter)
+
+        self.__handler = RequestLogHandler()
+        self.__handler.setFormatter(logging.Formatter(driver.LOG_FORMAT))
+        root_logger.addHandler(self.__handler)
+
+        sys.stdout = ThreadStream("stdout", sys.stdout)
+        sys.stderr = ThreadStream("stderr", sys.stderr)
+    #enddef
+
+    def uninstall(self):
+        if self.__handler is None:
+            return
+
+        sys.stdout = sys.stdout.original
+        sys.stderr = sys.stderr.original
+
+        root_logger = logging.getLogger()
+        root_logger.removeHandler(self.__handler)
+        for handler in root_logger.handlers:
+            handler.removeFilter(self.__filter)
+        root_logger.setLevel(self.__server_level)
+        self.__handler = None
+    #enddef
+
+    def begin(self, stdout, stderr):
+        """Redirects the current thread into the streams of its request, it logs warnings and
+        errors until set_loglevel() is called."""
+        _request.stdout = stdout
+        _request.stderr = stderr
+        self.set_loglevel(logging.WARNING)
+    #enddef
+
+    def set_loglevel(self, loglevel):
+        _request.loglevel = loglevel
+        with self.__lock:
+            self.__levels[threading.get_ident()] = loglevel
+            self.__update_level()
+    #enddef
+
+    def end(self):
+        with self.__lock:
+            del self.__levels[threading.get_ident()]
+            self.__update_level()
+        del _request.stdout, _request.stderr, _request.loglevel
+    #enddef
+
+    def __update_level(self):
+        logging.getLogger().setLevel(min([ self.__server_level ] + list(self.__levels.values())))
+    #enddef
+
+#endclass
+
+def process_request(request, index_cache, redirection):
+    """Processes a single request, returns the response. The current thread is redirected into
+    the request's streams by the redirection (see RequestRedirection) while processing it."""
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    status = 0
+
+    redirection.begin(stdout, stderr)
+    try:
+        args_parser = driver.create_args_parser()
+        args_parser.prog = "codegen"
+        args = args_parser.parse_args(request.get("argv", []))
+
+        error = driver.check_args(args)
+        if error:
+            raise RuntimeError(error)
+
+        if args.manifest.strip() == "-" or "-" in [f.strip() for f in args.input_files] \
+                or not (args.manifest or args.input_files):
+            raise RuntimeError("Reading the standard input isn't supported by the server.")
+
+        redirection.set_loglevel(driver.loglevel(args))
+        args.cwd = request.get("cwd", "")
+        driver.run(args, index_cache)
+    except SystemExit as e:
+        # Raised by the arguments parser, the error is already reported.
+        status = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        logging.exception("Code generation failed.")
+        status = 1
+    finally:
+        redirection.end()
+
+    return { "status": status, "stdout": stdout.getvalue(), "stderr": stderr.getvalue() }
+#enddef
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError as e:
+            response = { "status": 1, "stdout": "", "stderr": "Invalid request. ({})\n".format(e) }
+        else:
+            response = process_request(request, self.server.index_cache, self.server.redirection)
+
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+    #enddef
+
+#endclass
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    # Don't wait for requests being processed when the server is terminated.
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        # Remove a socket left behind by a previous instance.
+        if not _remove_socket(socket_path):
+            raise RuntimeError("Path '{}' exists and isn't a socket, not removing it.".format(socket_path))
+
+        super(Server, self).__init__(socket_path, RequestHandler)
+
+        import codegen.index
+        self.index_cache = codegen.index.IndexCache()
+        self.redirection = RequestRedirection()
+        self.redirection.install()
+
+        # Import the generator in advance so it's ready for the first request.
+        import codegen.cpp.visitor
+    #enddef
+
+    def server_close(self):
+        super(Server, self).server_close()
+        self.redirection.uninstall()
+        _remove_socket(self.server_address)
+    #enddef
+
+#endclass
+
+def _remove_socket(socket_path):
+    """Removes the socket if it exists. Returns False if there's something else than a socket
+    at the path, it's left untouched then."""
+    try:
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            return False
+        os.remove(socket_path)
+    except FileNotFoundError:
+        pass
+    return True
+#enddef
+
+def serve(socket_path):
+    with Server(socket_path) as server:
+        logging.info("Serving code generation requests on '{}'.".format(socket_path))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+#enddef
+
+if __name__ == "__main__":
+    import argparse
+    import signal
+
+    args_parser = argparse.ArgumentParser(description="Serve code generation requests on a Unix socket.")
+    args_parser.add_argument("socket", metavar="SOCKET", help="path to the Unix socket to listen on")
+    args_parser.add_argument("-l",  "--loglevel", dest="loglevel", default="WARNING", help="minimum logging level of the server (DEBUG|INFO|WARNING|ERROR|CRITICAL)")
+
+    args = args_parser.parse_args()
+
+    try:
+        logging.basicConfig(stream=sys.stderr, level=driver.loglevel(args), format=driver.LOG_FORMAT)
+
+        # Terminate gracefully so the socket gets removed.
+        def terminate(signum, frame):
+            raise KeyboardInterrupt()
+        #enddef
+        signal.signal(signal.SIGTERM, terminate)
+
+        serve(args.socket)
+    finally:
+        logging.shutdown()
+#endif __main__
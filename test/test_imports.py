@@ -0,0 +1,50 @@
+"""Checks that the command line tools don't import the backends and codemodel just to start."""
+
+import os
+import subprocess
+import sys
+import unittest
+
+SRC_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+# Runs the module as the main one and writes the imported modules to stderr.
+RUN_MODULE = """
+import runpy
+import sys
+
+sys.argv = [ sys.argv[1] ] + sys.argv[2:]
+try:
+    runpy.run_module(sys.argv[0], run_name="__main__", alter_sys=True)
+except SystemExit:
+    pass
+sys.stderr.write("\\n".join(sorted(sys.modules)))
+"""
+
+def imported_modules(module, *args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ SRC_DIR ] + [ p for p in [ env.get("PYTHONPATH", "") ] if p ])
+    result = subprocess.run([ sys.executable, "-c", RUN_MODULE, module ] + list(args), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return set(result.stderr.splitlines())
+#enddef
+
+class TestImports(unittest.TestCase):
+
+    def test_codegen_help(self):
+        modules = imported_modules("codegen", "--help")
+        self.assertIn("codegen.driver", modules)
+        for module in [ "codegen.cpp", "codegen.index", "codemodel" ]:
+            self.assertNotIn(module, modules)
+    #enddef
+
+    def test_index_help(self):
+        modules = imported_modules("codegen.index", "--help")
+        self.assertIn("codegen.index.module", modules)
+        for module in [ "codegen.cpp", "codemodel" ]:
+            self.assertNotIn(module, modules)
+    #enddef
+
+#endclass
+
+if __name__ == "__main__":
+    unittest.main()
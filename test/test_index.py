@@ -0,0 +1,228 @@
+"""Tests of the index storages."""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")))
+
+from codegen.index import CompiledIndex, Index, IndexFile
+
+ENTRIES = {
+    "a.B": { "cpp": { "include": "<a/b.hpp>" } },
+    "a.b.C": { "cpp": { "include": "\"c.hpp\"" } },
+    "a.bc.D": { "cpp": { "include": "\"d.hpp\"" } },
+    "ab.E": { "cpp": { "include": "\"e.hpp\"" } },
+    "ü.F": { "java": { "import": "u.F" } }
+}
+
+class TestCompiledIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.dir.name, "index.cache")
+    #enddef
+
+    def tearDown(self):
+        self.dir.cleanup()
+    #enddef
+
+    def test_round_trip(self):
+        CompiledIndex.compile(self.filepath, ENTRIES, (123, 456))
+        compiled = CompiledIndex(self.filepath)
+        try:
+            self.assertEqual(compiled.source_stamp, (123, 456))
+            self.assertEqual(len(compiled), len(ENTRIES))
+            self.assertEqual(list(compiled), sorted(ENTRIES, key=lambda key: key.encode("utf-8")))
+            self.assertEqual(dict(compiled.items()), ENTRIES)
+            for key, value in ENTRIES.items():
+                self.assertIn(key, compiled)
+                self.assertEqual(compiled[key], value)
+            #endfor
+            for key in [ "", "a", "a.b", "a.B.x", "zz" ]:
+                self.assertNotIn(key, compiled)
+                self.assertIsNone(compiled.get(key))
+            #endfor
+        finally:
+            compiled.close()
+    #enddef
+
+    def test_keys_with_prefix(self):
+        CompiledIndex.compile(self.filepath, ENTRIES, (0, 0))
+        compiled = CompiledIndex(self.filepath)
+        try:
+            self.assertEqual(list(compiled.keys_with_prefix("a.")), [ "a.B", "a.b.C", "a.bc.D" ])
+            self.assertEqual(list(compiled.keys_with_prefix("a.b.")), [ "a.b.C" ])
+            self.assertEqual(list(compiled.keys_with_prefix("a")), [ "a.B", "a.b.C", "a.bc.D", "ab.E" ])
+            self.assertEqual(list(compiled.keys_with_prefix("ü.")), [ "ü.F" ])
+            self.assertEqual(list(compiled.keys_with_prefix("b.")), [])
+        finally:
+            compiled.close()
+    #enddef
+
+    def test_empty(self):
+        CompiledIndex.compile(self.filepath, {}, (0, 0))
+        compiled = CompiledIndex(self.filepath)
+        try:
+            self.assertEqual(len(compiled), 0)
+            self.assertNotIn("a", compiled)
+            self.assertEqual(list(compiled.keys_with_prefix("")), [])
+        finally:
+            compiled.close()
+    #enddef
+
+    def test_invalid(self):
+        with open(self.filepath, "wb") as f:
+            f.write(b"CGIX")
+        self.assertRaises(ValueError, CompiledIndex, self.filepath)
+
+        with open(self.filepath, "wb") as f:
+            f.write(b"XXXX" + bytes(CompiledIndex.HEADER.size))
+        self.assertRaises(ValueError, CompiledIndex, self.filepath)
+    #enddef
+
+#endclass
+
+class TestIndexFile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.dir.name, "index.json")
+        self.index_file = IndexFile(self.filepath)
+    #enddef
+
+    def tearDown(self):
+        self.dir.cleanup()
+    #enddef
+
+    def write_index(self, entries):
+        with open(self.filepath, "w") as f:
+            json.dump(entries, f)
+    #enddef
+
+    def compiled_stamp(self):
+        compiled = CompiledIndex(self.index_file.compiled_filepath)
+        try:
+            return compiled.source_stamp
+        finally:
+            compiled.close()
+    #enddef
+
+    def test_compiled_cache(self):
+        self.write_index(ENTRIES)
+        self.assertEqual(dict(self.index_file.load_snapshot().items()), ENTRIES)
+
+        # The cache is compiled from the index file and used until the index file changes.
+        self.assertEqual(self.compiled_stamp(), self.index_file.stamp()[0])
+        cache_stamp = os.stat(self.index_file.compiled_filepath).st_mtime_ns
+        self.assertEqual(self.index_file.load_snapshot()["a.B"], ENTRIES["a.B"])
+        self.assertEqual(os.stat(self.index_file.compiled_filepath).st_mtime_ns, cache_stamp)
+
+        entries = dict(ENTRIES)
+        entries["x.Y"] = { "cpp": { "include": "\"y.hpp\"" } }
+        self.write_index(entries)
+        index = self.index_file.load_snapshot()
+        self.assertEqual(dict(index.items()), entries)
+        self.assertEqual(self.compiled_stamp(), self.index_file.stamp()[0])
+    #enddef
+
+    def test_invalid_compiled_cache(self):
+        self.write_index(ENTRIES)
+        with open(self.index_file.compiled_filepath, "wb") as f:
+            f.write(b"garbage")
+        self.assertEqual(dict(self.index_file.load_snapshot().items()), ENTRIES)
+        self.assertEqual(self.compiled_stamp(), self.index_file.stamp()[0])
+    #enddef
+
+    def test_journal(self):
+        self.write_index(ENTRIES)
+
+        index = self.index_file.load_snapshot()
+        index.ensure("x.Y", "cpp")["include"] = "\"y.hpp\""
+        del index["a.B"]
+        self.index_file.append(index.changes())
+
+        index = self.index_file.load_snapshot()
+        index["ab.E"] = { "cpp": { "include": "\"e2.hpp\"" } }
+        self.index_file.append(index.changes())
+
+        # A record being appended right now.
+        with open(self.index_file.journal_filepath, "a") as f:
+            f.write("{\"key\": \"z.Z\", \"val")
+
+        expected = dict(ENTRIES)
+        del expected["a.B"]
+        expected["x.Y"] = { "cpp": { "include": "\"y.hpp\"" } }
+        expected["ab.E"] = { "cpp": { "include": "\"e2.hpp\"" } }
+        for index in [ self.index_file.load(), self.index_file.load_snapshot() ]:
+            self.assertEqual(dict(index.items()), expected)
+            self.assertFalse(index.dirty)
+        #endfor
+
+        # The index file itself isn't changed by appending.
+        with open(self.filepath) as f:
+            self.assertEqual(json.load(f), ENTRIES)
+
+        self.assertTrue(self.index_file.compact())
+        with open(self.filepath) as f:
+            self.assertEqual(json.load(f), expected)
+        self.assertEqual(self.index_file.journal_size(), 0)
+        self.assertEqual(dict(self.index_file.load().items()), expected)
+        self.assertFalse(self.index_file.compact())
+    #enddef
+
+    def test_missing(self):
+        index = self.index_file.load()
+        self.assertEqual(len(index), 0)
+        self.assertFalse(index.dirty)
+        self.assertIsNone(self.index_file.stamp())
+    #enddef
+
+#endclass
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = Index()
+        self.index.load_entries(ENTRIES)
+    #enddef
+
+    def test_unchanged(self):
+        self.assertFalse(self.index.dirty)
+
+        # Accessing or setting the same content isn't a change.
+        self.index.ensure("a.B", "cpp")
+        self.index.ensure("a.b.C", "cpp")["include"] = "\"c.hpp\""
+        self.index["ab.E"] = { "cpp": { "include": "\"e.hpp\"" } }
+        self.assertFalse(self.index.dirty)
+        self.assertEqual(self.index.changes(), {})
+
+        # An entry set back to its original content isn't a change either.
+        self.index["a.bc.D"] = { "cpp": { "include": "\"other.hpp\"" } }
+        self.assertTrue(self.index.dirty)
+        self.index["a.bc.D"] = { "cpp": { "include": "\"d.hpp\"" } }
+        self.assertFalse(self.index.dirty)
+    #enddef
+
+    def test_changes(self):
+        self.index.ensure("x.Y", "cpp")["include"] = "\"y.hpp\""
+        self.index.ensure("a.B", "cpp")["include"] = "<b.hpp>"
+        del self.index["ab.E"]
+        self.assertTrue(self.index.dirty)
+        self.assertEqual(self.index.changes(), {
+            "x.Y": { "cpp": { "include": "\"y.hpp\"" } },
+            "a.B": { "cpp": { "include": "<b.hpp>" } },
+            "ab.E": None
+        })
+
+        self.index.clear_changes()
+        self.assertFalse(self.index.dirty)
+        self.assertEqual(self.index.changes(), {})
+    #enddef
+
+#endclass
+
+if __name__ == "__main__":
+    unittest.main()
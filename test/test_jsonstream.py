@@ -0,0 +1,116 @@
+"""Tests of the incremental reading of codemodel's JSON documents."""
+
+import io
+import json
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")))
+
+from codegen.jsonstream import PACKAGE_TYPE, PackageReader
+
+# Strings with characters the scanner has to handle inside of strings.
+STRINGS = [ "", "a", "\"", "\\", "\\\"", "{", "}", "[", "]", "[{\"}]", "\\u", "ü", "\n", "\t" ]
+
+def random_string(rng):
+    return "".join(rng.choice(STRINGS) for _ in range(rng.randint(0, 4)))
+#enddef
+
+def random_value(rng, depth):
+    kind = rng.randint(0, 6 if depth < 3 else 3)
+    if kind == 0:
+        return random_string(rng)
+    elif kind == 1:
+        return rng.choice([ 0, -1, 12345678901234567890, 0.5, -1e-10 ])
+    elif kind == 2:
+        return rng.choice([ True, False, None ])
+    elif kind == 3:
+        return []
+    elif kind == 4:
+        return [ random_value(rng, depth + 1) for _ in range(rng.randint(1, 3)) ]
+    else:
+        return { random_string(rng): random_value(rng, depth + 1) for _ in range(rng.randint(0, 3)) }
+#enddef
+
+def random_node(rng, depth):
+    """Returns a random node, a package with child nodes or a class."""
+    if depth < 3 and rng.random() < .3:
+        node = { "type": PACKAGE_TYPE, "attrs": { "name": random_string(rng) } }
+        node["nodes"] = [ random_node(rng, depth + 1) for _ in range(rng.randint(0, 3)) ]
+    else:
+        node = { "type": "codemodel.classdiagram.Class", "attrs": random_value(rng, 0) }
+        node["nodes"] = [ { "type": "codemodel.classdiagram.Attribute", "attrs": random_value(rng, 1) }
+                for _ in range(rng.randint(0, 2)) ]
+    #endif
+    return node
+#enddef
+
+def read_all(nodes):
+    """Reads the nodes provided by the reader into the nodes of the whole document."""
+    result = []
+    for node, child_nodes in nodes:
+        if child_nodes is None:
+            result.append(json.loads(node))
+        else:
+            node = dict(node)
+            node["nodes"] = read_all(child_nodes)
+            result.append(node)
+        #endif
+    #endfor
+    return result
+#enddef
+
+class TestPackageReader(unittest.TestCase):
+
+    def read(self, text, chunk_size):
+        shell, nodes = PackageReader(io.StringIO(text), chunk_size).read()
+        shell = dict(shell)
+        shell["nodes"] = read_all(nodes)
+        return shell
+    #enddef
+
+    def test_random(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            document = { "type": PACKAGE_TYPE, "using": random_value(rng, 1),
+                         "nodes": [ random_node(rng, 0) for _ in range(rng.randint(0, 4)) ] }
+            indent = rng.choice([ None, 0, 2 ])
+            text = json.dumps(document, indent=indent, ensure_ascii=rng.random() < .5)
+            chunk_size = rng.randint(1, 64)
+            self.assertEqual(self.read(text, chunk_size), json.loads(text), "chunk size {}: {}".format(chunk_size, text))
+        #endfor
+    #enddef
+
+    def test_nested_packages(self):
+        classes = [ { "type": "codemodel.classdiagram.Class", "attrs": { "name": "T{}".format(i) } } for i in range(3) ]
+        text = json.dumps({ "type": PACKAGE_TYPE, "nodes": [
+            { "type": PACKAGE_TYPE, "attrs": { "name": "ns" }, "nodes": [
+                { "type": PACKAGE_TYPE, "attrs": { "name": "inner" }, "nodes": classes[:1] } ] + classes[1:] } ] })
+
+        shell, nodes = PackageReader(io.StringIO(text), 7).read()
+        self.assertEqual(shell, { "type": PACKAGE_TYPE, "nodes": [] })
+
+        # Every class is provided on its own, the packages are descended into.
+        ns, ns_nodes = next(nodes)
+        self.assertEqual(ns, { "type": PACKAGE_TYPE, "attrs": { "name": "ns" }, "nodes": [] })
+        inner, inner_nodes = next(ns_nodes)
+        self.assertEqual(inner["attrs"], { "name": "inner" })
+        self.assertEqual([ (json.loads(node), child_nodes) for node, child_nodes in inner_nodes ], [ (classes[0], None) ])
+        self.assertEqual([ (json.loads(node), child_nodes) for node, child_nodes in ns_nodes ], [ (classes[1], None), (classes[2], None) ])
+        self.assertEqual(list(nodes), [])
+    #enddef
+
+    def test_invalid(self):
+        for text in [ "", "[]", "{\"nodes\": [", "{\"nodes\": [{\"type\": \"x\"", "{\"nodes\": [{\"a\": \"}",
+                      "{\"nodes\": [], \"name\": \"x\"}" ]:
+            with self.assertRaises(ValueError, msg=text):
+                self.read(text, 3)
+        #endfor
+    #enddef
+
+#endclass
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests of the code generation server."""
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")))
+
+from codegen.client import request
+from codegen.server import Server
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.server = Server(os.path.join(self.dir.name, "server.sock"))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+    #enddef
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.dir.cleanup()
+    #enddef
+
+    def test_concurrent_requests(self):
+        cwd = os.getcwd()
+        responses = {}
+
+        def send(i):
+            request_dir = os.path.join(self.dir.name, str(i))
+            os.mkdir(request_dir)
+            loglevel = "DEBUG" if i % 2 else "WARNING"
+            responses[i] = request(self.server.server_address, [ "-l", loglevel, "missing.in" ], request_dir)
+        #enddef
+
+        threads = [ threading.Thread(target=send, args=(i,)) for i in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Every request resolves the paths against its own directory and gets only its own log.
+        for i, response in responses.items():
+            self.assertEqual(response["status"], 1)
+            self.assertEqual(response["stdout"], "")
+            self.assertIn(os.path.join(self.dir.name, str(i), "missing.in"), response["stderr"])
+            for j in range(8):
+                if j != i:
+                    self.assertNotIn(os.path.join(self.dir.name, str(j), "missing.in"), response["stderr"])
+            self.assertEqual("DEBUG " in response["stderr"], i % 2 == 1)
+        #endfor
+        self.assertEqual(len(responses), 8)
+
+        # The working directory of the process isn't changed by the requests.
+        self.assertEqual(os.getcwd(), cwd)
+    #enddef
+
+    def test_invalid_arguments(self):
+        response = request(self.server.server_address, [ "--invalid" ], self.dir.name)
+        self.assertEqual(response["status"], 2)
+        self.assertIn("unrecognized arguments: --invalid", response["stderr"])
+    #enddef
+
+#endclass
+
+if __name__ == "__main__":
+    unittest.main()